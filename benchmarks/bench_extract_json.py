@@ -0,0 +1,84 @@
+"""
+Benchmark `extract_json_objects` against the nested regex it replaced, on
+large dirty model outputs and adversarial inputs. The regex only matches
+four levels of nesting and strict JSON, so it also finds fewer objects, or
+the wrong ones. The scanner skips prose faster, while blocks failing strict
+parsing cost it a second, dirty parse.
+
+    python benchmarks/bench_extract_json.py
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+from promptimize.utils import extract_json_objects
+
+NESTED_REGEX = r"(\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\}))*\})"
+
+PROSE = "Sure! Here's what I found, let me know if it's what you wanted {name}. "
+
+
+def regex_extract(text):
+    json_objects = []
+    for match in re.finditer(NESTED_REGEX, text):
+        try:
+            json_objects.append(json.loads(match.group()))
+        except json.JSONDecodeError:
+            pass
+    return json_objects
+
+
+def dirty_output(blocks, seed=42):
+    """prose around valid and dirty JSON blocks, cut short at the end like at max_tokens"""
+    rng = random.Random(seed)
+    parts = []
+    for i in range(blocks):
+        parts.append(PROSE * rng.randint(1, 5))
+        if rng.random() < 0.5:
+            obj = {"id": i, "tags": ["a", "b"], "nested": {"deep": {"value": i * 1.5}}}
+            parts.append(json.dumps(obj))
+        else:
+            parts.append(f"{{'id': {i}, 'ok': True, 'tags': ['a', 'b',], 'note': None,}}")
+    parts.append('{"id": "cut short", "tags": ["a"')
+    return "".join(parts)
+
+
+INPUTS = {
+    "dirty output, 1k blocks": lambda: dirty_output(1000),
+    "dirty output, 10k blocks": lambda: dirty_output(10000),
+    "20k unmatched {": lambda: "{" * 20000,
+    "20k unmatched { in prose": lambda: "{ and some text " * 20000,
+    "500 deep nesting": lambda: '{"a": ' * 500 + "1" + "}" * 500,
+    "20k small objects": lambda: 'x {"a": 1} ' * 20000,
+}
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'input':<26} {'size':>7} {'regex':>9} {'found':>6} {'scanner':>9} {'found':>6}")
+    for name, make_input in INPUTS.items():
+        text = make_input()
+        regex, regex_found = best_of(lambda: regex_extract(text), args.repeat)
+        scanner, found = best_of(lambda: extract_json_objects(text), args.repeat)
+        print(
+            f"{name:<26} {len(text) // 1024:>5}kb {regex * 1000:>7.1f}ms {len(regex_found):>6} "
+            f"{scanner * 1000:>7.1f}ms {len(found):>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark `KeywordMatcher` against the naive scan it replaced, which runs
+`word in response` once per keyword, rescanning the response every time.
+That scan is a fast C loop, so it stays ahead for a handful of keywords; the
+matcher pulls ahead as vocabularies grow, its cost being one pass over the
+response.
+
+    python benchmarks/bench_keyword_matcher.py
+"""
+import argparse
+import random
+import string
+import time
+
+from promptimize.evals import KeywordMatcher
+
+
+def naive_count(response, words):
+    response = response.lower()
+    return sum(1 for w in words if w.lower() in response)
+
+
+def random_word(rng, min_length=3, max_length=10):
+    length = rng.randint(min_length, max_length)
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--responses", type=int, default=50)
+    parser.add_argument("--response-words", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'keywords':>8} {'build':>9} {'naive':>9} {'matcher':>9} {'speedup':>8}")
+    for vocabulary_size in (10, 100, 1000, 5000):
+        rng = random.Random(args.seed)
+        words = [random_word(rng) for _ in range(vocabulary_size)]
+        responses = [
+            " ".join(
+                rng.choice(words) if rng.random() < 0.1 else random_word(rng)
+                for _ in range(args.response_words)
+            )
+            for _ in range(args.responses)
+        ]
+        start = time.perf_counter()
+        matcher = KeywordMatcher(words)
+        build = time.perf_counter() - start
+
+        for response in responses:
+            assert matcher.count(response) == naive_count(response, words)
+        naive = best_of(lambda: [naive_count(r, words) for r in responses], args.repeat)
+        fast = best_of(lambda: [matcher.count(r) for r in responses], args.repeat)
+        print(
+            f"{vocabulary_size:>8} {build * 1000:>7.1f}ms {naive * 1000:>7.1f}ms "
+            f"{fast * 1000:>7.1f}ms {naive / fast:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 """An example of how to test Python code generating prompts"""
-import re
 
 # Brining some "prompt generator" classes
 from promptimize.prompt_cases import LangchainPromptCase
@@ -9,13 +8,11 @@ from promptimize.prompt_cases import LangchainPromptCase
 # to return a score between 0 and 1
 from langchain import PromptTemplate
 from langchain.output_parsers import StructuredOutputParser, ResponseSchema
-import demjson
 
 from RestrictedPython import compile_restricted, safe_globals, safe_builtins
 from RestrictedPython.Guards import guarded_unpack_sequence
 from RestrictedPython.Eval import default_guarded_getiter
 
-
 response_schemas = [
     ResponseSchema(
         name="python_function",
@@ -106,43 +103,21 @@ def test(func, args, expected_result):
     return 0
 
 
-def decode_shitty_json(s):
-    json_match = re.search(r"\{[\s\S]*\}", s)
-
-    if json_match:
-        json_string = json_match.group()
-
-        # Parse the JSON string using demjson
-        json_data = demjson.decode(json_string)
-
-        return json_data
-    return None
-
-
 def test_is_prime(prompt_case, val, exp):
     return test(prompt_case.python_function, val, exp)
 
 
 class PythonGeneratorPrompt(LangchainPromptCase):
     def post_run(self):
-        success = False
         self.python_function = None
         self.f = None
-        try:
-            self.response = decode_shitty_json(self.response)
-            success = True
-        except Exception as e:
-            self.error = str(e)
-
-        if success:
-            # try:
-            f = function_from_string(
-                self.response.get("python_function"), self.response.get("function_name")
-            )
+        # `parsed_response` picks the first (possibly dirty) JSON object in the
+        # response, it's parsed once and shared with the evaluators
+        parsed = self.parsed_response
+        if parsed:
+            f = function_from_string(parsed.get("python_function"), parsed.get("function_name"))
             self.python_function = f
             self.f = f
-            # except Exception as e:
-            # self.error = str(e)
 
 
 prompts = [
@@ -0,0 +1,4 @@
+from promptimize.cli import cli
+
+if __name__ == "__main__":
+    cli()
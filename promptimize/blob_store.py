@@ -0,0 +1,219 @@
+"""
+Content-addressed, compressed storage for the prompt and response texts of
+reports.
+
+Rendered prompts (and the user inputs they are made of) tend to repeat the
+same few-shot template over and over. In "blobs" mode, texts are cut into
+chunks at paragraph boundaries, and every distinct chunk gets compressed and
+stored once in a pack file next to the report, keyed by its hash. The report
+only keeps references like `{"blobs": [<hash>, ...]}`, resolved when a
+prompt's text gets accessed.
+
+The pack gets appended to: `<report>.blobs` holds the compressed chunks back
+to back, `<report>.blobs.idx` maps their hashes to offsets. Chunks the report
+no longer references stay in there until they take more than half of the
+pack, when writing the report rewrites it with the live chunks only
+(`p9e blobs gc` does it on demand). Compression is zlib, or zstd when the
+`zstandard` package is installed and asked for.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+TEXT_FIELDS = ("prompt", "response", "user_input")
+COMPRESSIONS = ("gzip", "zstd")
+
+# paragraphs get merged into chunks of at least this many characters, so
+# short texts don't end up in a myriad of tiny blobs
+MIN_CHUNK_SIZE = 1024
+
+# writing a report compacts its pack past this share of unreferenced bytes
+MAX_DEAD_RATIO = 0.5
+
+_PARAGRAPH_END = re.compile(r"(?<=\n\n)")
+
+
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, dict) and list(value.keys()) == ["blobs"]
+
+
+def referenced_chunks(prompts: Iterable[Dict[str, Any]]) -> Set[str]:
+    """the hashes of the chunks the texts of some prompts are made of"""
+    hashes: Set[str] = set()
+    for prompt in prompts:
+        for field in TEXT_FIELDS:
+            if is_blob_ref(prompt.get(field)):
+                hashes.update(prompt[field]["blobs"])
+    return hashes
+
+
+def split_chunks(text: str, min_size: int = MIN_CHUNK_SIZE) -> List[str]:
+    """
+    Split a text at paragraph boundaries, greedily from the start so that
+    texts sharing a prefix share its chunks.
+    """
+    chunks: List[str] = []
+    current = ""
+    for paragraph in _PARAGRAPH_END.split(text):
+        current += paragraph
+        if len(current) >= min_size:
+            chunks.append(current)
+            current = ""
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+
+def _compressor(compression: str):
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ModuleNotFoundError:
+            raise ImportError("zstd compression requires zstandard, `pip install zstandard`")
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+    return zlib.compress, zlib.decompress
+
+
+class BlobStore:
+    """
+    Args:
+        path (str): Path of the pack file, its index being `<path>.idx`.
+        compression (str): "gzip" or "zstd", for newly added chunks. The
+            compression of an existing pack is read from its index.
+    """
+
+    def __init__(self, path: str, compression: str = "gzip") -> None:
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression should be one of {COMPRESSIONS}")
+        self.path = path
+        self.index_path = path + ".idx"
+        self.compression = compression
+        self.chunks: Dict[str, Tuple[int, int]] = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            self.compression = index["compression"]
+            self.chunks = {h: tuple(loc) for h, loc in index["chunks"].items()}  # type: ignore
+        self._compress, self._decompress = _compressor(self.compression)
+        self._lock = threading.Lock()
+        self._reader = None
+        self._writer = None
+        # chunks shared by many prompts get decompressed once
+        self.read_chunk = lru_cache(maxsize=1024)(self._read_chunk)
+
+    @staticmethod
+    def chunk_hash(chunk: str) -> str:
+        return hashlib.sha256(chunk.encode()).hexdigest()[:24]
+
+    def has(self, chunk_hash: str) -> bool:
+        return chunk_hash in self.chunks
+
+    def put(self, text: str) -> Dict[str, List[str]]:
+        """store a text, returning the reference to keep in the report"""
+        hashes = []
+        for chunk in split_chunks(text):
+            chunk_hash = self.chunk_hash(chunk)
+            if chunk_hash not in self.chunks:
+                self._append(chunk_hash, self._compress(chunk.encode()))
+            hashes.append(chunk_hash)
+        return {"blobs": hashes}
+
+    def copy_from(self, other: "BlobStore", ref: Dict[str, List[str]]) -> None:
+        """copy the chunks of a reference over from another store"""
+        for chunk_hash in ref["blobs"]:
+            if chunk_hash not in self.chunks:
+                if other.compression == self.compression:
+                    self._append(chunk_hash, other._read_raw(chunk_hash))
+                else:
+                    self._append(chunk_hash, self._compress(other.read_chunk(chunk_hash).encode()))
+
+    def get(self, ref: Dict[str, List[str]]) -> str:
+        """the text behind a reference"""
+        return "".join(self.read_chunk(chunk_hash) for chunk_hash in ref["blobs"])
+
+    def _append(self, chunk_hash: str, data: bytes) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = open(self.path, "ab")
+            offset = self._writer.seek(0, os.SEEK_END)
+            self._writer.write(data)
+            self.chunks[chunk_hash] = (offset, len(data))
+
+    def _read_raw(self, chunk_hash: str) -> bytes:
+        offset, length = self.chunks[chunk_hash]
+        with self._lock:
+            if self._writer is not None:
+                self._writer.flush()
+            if self._reader is None:
+                self._reader = open(self.path, "rb")
+            self._reader.seek(offset)
+            return self._reader.read(length)
+
+    def _read_chunk(self, chunk_hash: str) -> str:
+        return self._decompress(self._read_raw(chunk_hash)).decode()
+
+    def write_index(self) -> None:
+        """flush the pack and persist the index, making the new chunks visible to readers"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.flush()
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"compression": self.compression, "chunks": self.chunks}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def dead_bytes(self, live: Iterable[str]) -> int:
+        """how much of the pack isn't taken by the `live` chunks"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.flush()
+        if not os.path.exists(self.path):
+            return 0
+        live_bytes = sum(self.chunks[h][1] for h in set(live) if h in self.chunks)
+        return os.path.getsize(self.path) - live_bytes
+
+    def compact(self, live: Iterable[str]) -> int:
+        """
+        rewrite the pack and its index with the `live` chunks only, returning
+        how many bytes got reclaimed. Other processes reading the pack at the
+        same time would see the chunks at their old offsets.
+        """
+        dead = self.dead_bytes(live)
+        live = sorted((h for h in set(live) if h in self.chunks), key=lambda h: self.chunks[h])
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        chunks: Dict[str, Tuple[int, int]] = {}
+        with self._lock, open(tmp_path, "wb") as f:
+            for chunk_hash in live:
+                offset, length = self.chunks[chunk_hash]
+                self._reader = self._reader or open(self.path, "rb")
+                self._reader.seek(offset)
+                chunks[chunk_hash] = (f.tell(), length)
+                f.write(self._reader.read(length))
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.chunks = chunks
+        self.write_index()
+        return dead
+
+    def collect(self, live: Iterable[str], max_dead_ratio: float = MAX_DEAD_RATIO) -> int:
+        """compact the pack once what isn't `live` takes more than `max_dead_ratio` of it"""
+        live = set(live)
+        dead = self.dead_bytes(live)
+        if not dead or dead <= max_dead_ratio * os.path.getsize(self.path):
+            return 0
+        return self.compact(live)
+
+    def close(self) -> None:
+        with self._lock:
+            for f in (self._reader, self._writer):
+                if f is not None:
+                    f.close()
+            self._reader = self._writer = None
+
+    def same_as(self, other: Optional["BlobStore"]) -> bool:
+        return other is not None and os.path.abspath(self.path) == os.path.abspath(other.path)
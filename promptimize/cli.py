@@ -1,9 +1,114 @@
 import click
 
-from promptimize.crawler import discover_objects
-from promptimize.prompt_cases import BasePromptCase
-from promptimize.reports import Report
-from promptimize.suite import Suite
+from promptimize import profiling
+
+# heavier imports (langchain, pandas, ...) happen inside the commands that need
+# them, so that `--help` and the lighter commands start fast
+
+
+def _parse_param_value(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_matrix(matrix):
+    """parse ("engine=a,b", "temperature=0,0.7") into {"engine": ["a", "b"], ...}"""
+    parsed = {}
+    for item in matrix:
+        name, sep, values = item.partition("=")
+        if not sep or not name.strip():
+            raise click.BadParameter(
+                f"expected name=value1,value2 got: {item}", param_hint="--matrix"
+            )
+        parsed[name.strip()] = [_parse_param_value(v.strip()) for v in values.split(",")]
+    return parsed
+
+
+def expand_matrix(suite, matrix) -> None:
+    try:
+        suite.expand_matrix(parse_matrix(matrix))
+    except ValueError as e:
+        # executors that can't be reconfigured would make identical calls for every variant
+        raise click.BadParameter(str(e), param_hint="--matrix")
+
+
+def start_profiler(profile, workers):
+    if not profile:
+        return None
+    if profile == "memory" and workers:
+        # tracemalloc's peak is process-wide, concurrent prompt cases would blur it
+        raise click.BadParameter("can't be used with --workers", param_hint="--profile memory")
+    return profiling.Profiler(profile).start()
+
+
+def start_metrics_exporters(port, path, interval):
+    if not (port or path):
+        return None, []
+    from promptimize.metrics import MetricsServer, RunMetrics, TextfileExporter
+
+    metrics = RunMetrics()
+    exporters = []
+    if port:
+        exporters.append(MetricsServer(metrics, port).start())
+        click.secho(f"# Serving metrics on http://127.0.0.1:{port}/metrics", fg="yellow")
+    if path:
+        exporters.append(TextfileExporter(metrics, path, interval).start())
+    return metrics, exporters
+
+
+def print_profile(profiler, output_prefix):
+    from tabulate import tabulate
+
+    summary = profiler.summary()
+    click.secho("# Profile: time spent per section (ms)", fg="cyan")
+    click.echo(tabulate(sorted(summary["section_ms"].items()), tablefmt="psql", floatfmt=".1f"))
+    click.secho("# Profile: top evaluators", fg="cyan")
+    click.echo(tabulate(summary["evaluators"], headers="keys", tablefmt="psql", floatfmt=".2f"))
+    if profiler.mode == "cpu":
+        path = f"{output_prefix}.collapsed"
+        profiler.write_collapsed(path)
+        click.secho(
+            f"# Wrote {summary['samples']} stack samples to {path}, "
+            "feed it to flamegraph.pl or speedscope",
+            fg="yellow",
+        )
+    else:
+        click.secho("# Profile: top allocation sites", fg="cyan")
+        click.echo(
+            tabulate(summary["allocations"], headers="keys", tablefmt="psql", floatfmt=".1f")
+        )
+
+
+def write_output(suite, report, output, style, storage, compression):
+    from promptimize.reports import Report
+
+    output_report = Report.from_suite(suite)
+    if report:
+        output_report.merge(report)
+    click.secho(f"# Writing file output to {output}", fg="yellow")
+    output_report.write(output, style=style, storage=storage, compression=compression)
+
+
+def print_plan(plan, verbose):
+    from tabulate import tabulate
+
+    if verbose:
+        click.secho("# Plan", fg="cyan")
+        click.echo(tabulate(plan.rows, headers="keys", tablefmt="psql", floatfmt=".4g"))
+    click.secho("# Estimated totals", fg="cyan")
+    click.echo(tabulate(plan.totals().items(), tablefmt="psql", floatfmt=".4g"))
+
+
+def print_review_hint(suite, output):
+    if not output:
+        click.secho("# --human queues reviews in the report, it requires --output", fg="red")
+        return
+    queued = sum(1 for p in suite.prompts.values() if p.has_run)
+    click.secho(f"# {queued} prompt cases to review: promptimize review {output}", fg="cyan")
 
 
 @click.group(help="💡¡promptimize!💡 CLI. `p9e` works too!")
@@ -23,11 +128,62 @@ def cli():
     "--human",
     "-h",
     is_flag=True,
-    help="Human review, allowing a human to review and force pass/fail each prompt case",
+    help=(
+        "Queue the executed prompt cases for human review in the report, "
+        "to go through with `promptimize review` without holding up the run"
+    ),
 )
 @click.option("--repair", "-r", is_flag=True, help="Only re-run previously failed")
 @click.option("--dry-run", "-x", is_flag=True, help="DRY run, don't call the API")
+@click.option(
+    "--plan",
+    "show_plan",
+    is_flag=True,
+    help=(
+        "Show which prompt cases would run or skip, with their estimated tokens, "
+        "cost and duration out of the report's history, without running anything"
+    ),
+)
 @click.option("--shuffle", is_flag=True, help="Shuffle the prompts in a random order")
+@click.option(
+    "--order",
+    type=click.Choice(
+        ["declared", "shuffle", "longest", "failing", "prefix"], case_sensitive=False
+    ),
+    default="declared",
+    help=(
+        "longest runs the prompt cases with the longest expected latency first, for the "
+        "shortest run with --workers, failing the ones most likely to fail first, as "
+        "per the report's history, prefix the ones sharing a long prompt prefix back to "
+        "back, to benefit from the provider's prompt caching"
+    ),
+)
+@click.option(
+    "--time-budget",
+    type=click.FLOAT,
+    default=0,
+    help=(
+        "In seconds, only run the prompt cases most likely to fail for their expected "
+        "latency that fit in the budget"
+    ),
+)
+@click.option(
+    "--hedge",
+    type=click.FLOAT,
+    default=0,
+    help=(
+        "Send a duplicate request for API calls slower than this percentile of the "
+        "model's observed latencies (ie: 95), keeping the first response back"
+    ),
+)
+@click.option(
+    "--adaptive-max-tokens",
+    is_flag=True,
+    help=(
+        "Cap each prompt case's max_tokens from its own completion lengths in the report's "
+        "history, re-running with --max-tokens the ones reaching their cap"
+    ),
+)
 @click.option(
     "--style",
     "-s",
@@ -60,8 +216,8 @@ def cli():
     "--engine",
     "-e",
     type=click.STRING,
-    default="text-davinci-003",
-    help="model as accepted by the openai API",
+    default=None,
+    help="model as accepted by the openai API, defaults to $OPENAI_MODEL or text-davinci-003",
 )
 @click.option("--key", "-k", multiple=True, help="The keys to run")
 @click.option(
@@ -70,11 +226,106 @@ def cli():
     type=click.Path(),
 )
 @click.option("--silent", "-s", is_flag=True)
+@click.option(
+    "--storage",
+    type=click.Choice(["inline", "blobs"], case_sensitive=False),
+    help=(
+        "inline keeps prompts and responses in the report, blobs stores them deduplicated "
+        "and compressed next to it, defaults to how the existing report was stored"
+    ),
+)
+@click.option(
+    "--compression",
+    type=click.Choice(["gzip", "zstd"], case_sensitive=False),
+    default="gzip",
+    help="compression of the texts with --storage blobs",
+)
+@click.option(
+    "--display",
+    type=click.Choice(["auto", "progress", "detailed"], case_sensitive=False),
+    default="auto",
+    help=(
+        "progress shows a single live line, detailed prints every prompt case, "
+        "auto uses progress for large runs or when the output isn't a terminal"
+    ),
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    default=None,
+    help="Stream responses, measuring time to first token and applying stop checks",
+)
+@click.option(
+    "--target-ci",
+    type=click.FLOAT,
+    default=0,
+    help=(
+        "Sample prompt cases in stratified order, stopping once the suite score "
+        "is known within +/- this value (ie: 0.02)"
+    ),
+)
+@click.option(
+    "--confidence",
+    type=click.FLOAT,
+    default=0.95,
+    help="Confidence level used with --target-ci",
+)
+@click.option(
+    "--matrix",
+    multiple=True,
+    help=(
+        "Run every prompt case for each combination of executor params, "
+        "ie: --matrix engine=gpt-3.5-turbo,gpt-4 --matrix temperature=0,0.7"
+    ),
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.INT,
+    default=0,
+    help="Run prompt cases concurrently, with that many threads per model",
+)
+@click.option(
+    "--no-coalesce",
+    is_flag=True,
+    help="Make one API call per prompt case, even for identical prompts and settings",
+)
+@click.option(
+    "--metrics-port",
+    type=click.INT,
+    help="Serve live run metrics on http://127.0.0.1:<port>/metrics",
+)
+@click.option(
+    "--metrics-file",
+    type=click.Path(),
+    help="Write live run metrics to this Prometheus textfile",
+)
+@click.option(
+    "--metrics-interval",
+    type=click.FLOAT,
+    default=5.0,
+    help="How often (in seconds) the metrics textfile gets updated",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(profiling.PROFILE_MODES, case_sensitive=False),
+    help=(
+        "Profile the suite's own overhead (discovery, evaluation, report I/O, output), "
+        "excluding network waits"
+    ),
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(),
+    default="promptimize-profile",
+    help="Path prefix for the profile output files",
+)
 def run(
     path,
     verbose,
     force,
     dry_run,
+    show_plan,
     style,
     temperature,
     max_tokens,
@@ -82,16 +333,43 @@ def run(
     key,
     output,
     silent,
+    storage,
+    compression,
     repair,
     human,
     shuffle,
+    order,
+    time_budget,
+    hedge,
+    adaptive_max_tokens,
     limit,
+    display,
+    stream,
+    target_ci,
+    confidence,
+    matrix,
+    workers,
+    no_coalesce,
+    metrics_port,
+    metrics_file,
+    metrics_interval,
+    profile,
+    profile_output,
 ):
     """Run some prompts/suites!"""
+    from promptimize.crawler import discover_objects
+    from promptimize.planning import update_history_index
+    from promptimize.prompt_cases import BasePromptCase
+    from promptimize.reports import Report
+    from promptimize.suite import Suite
+
     click.secho("💡 ¡promptimize! 💡", fg="cyan")
     if dry_run:
         click.secho("# DRY RUN MODE ACTIVATED!", fg="red")
-    uses_cases = discover_objects(path, BasePromptCase)
+    profiler = start_profiler(profile, workers)
+
+    with profiling.section("discovery"):
+        uses_cases = discover_objects(path, BasePromptCase)
     completion_create_kwargs = {
         "engine": engine,
         "max_tokens": max_tokens,
@@ -100,29 +378,72 @@ def run(
 
     report = None
     if output:
-        report = Report.from_path(output)
+        with profiling.section("report_io"):
+            report = Report.from_path(output)
 
-    suite = Suite(uses_cases, completion_create_kwargs)
-    suite.execute(
-        verbose=verbose,
-        style=style,
-        silent=silent,
-        report=report,
-        dry_run=dry_run,
-        keys=key,
-        force=force,
-        repair=repair,
-        human=human,
-        shuffle=shuffle,
-        limit=limit,
-    )
+    suite = Suite(uses_cases)
+    suite.apply_executor_params(completion_create_kwargs)
+    if matrix:
+        expand_matrix(suite, matrix)
+    if show_plan:
+        print_plan(
+            suite.plan(
+                report=report,
+                keys=key,
+                force=force,
+                repair=repair,
+                limit=limit,
+                workers=workers,
+                stream=stream,
+                coalesce=not no_coalesce,
+                order="shuffle" if shuffle else order,
+                time_budget=time_budget,
+            ),
+            verbose,
+        )
+        return
+    metrics, exporters = start_metrics_exporters(metrics_port, metrics_file, metrics_interval)
+
+    try:
+        suite.execute(
+            verbose=verbose,
+            style=style,
+            silent=silent,
+            report=report,
+            dry_run=dry_run,
+            keys=key,
+            force=force,
+            repair=repair,
+            human=human,
+            shuffle=shuffle,
+            limit=limit,
+            display=display,
+            stream=stream,
+            target_ci=target_ci,
+            confidence=confidence,
+            workers=workers,
+            metrics=metrics,
+            coalesce=not no_coalesce,
+            order=order,
+            time_budget=time_budget,
+            hedge=hedge,
+            adaptive_max_tokens=adaptive_max_tokens,
+        )
+    finally:
+        for exporter in exporters:
+            exporter.stop()
 
     if output:
-        output_report = Report.from_suite(suite)
-        if report:
-            output_report.merge(report)
-        click.secho(f"# Writing file output to {output}", fg="yellow")
-        output_report.write(output, style=style)
+        with profiling.section("report_io"):
+            write_output(suite, report, output, style, storage, compression)
+            if not dry_run:
+                update_history_index(output, suite)
+    if human:
+        print_review_hint(suite, output)
+
+    if profiler:
+        profiler.stop()
+        print_profile(profiler, profile_output)
 
 
 cli.add_command(run)
@@ -137,9 +458,448 @@ cli.add_command(run)
 @click.option("--groupby", "-g", help="GROUPBY", default="category")
 def report(path, groupby):
     """Get some summary of how your prompt suites are performing"""
+    from promptimize.reports import Report
+
     click.secho(f"# Reading report @ {path}", fg="yellow")
     report = Report.from_path(path)
     report.print_summary(groupby)
 
 
 cli.add_command(report)
+
+
+@click.command(help="re-run evaluators against the responses stored in a report")
+@click.argument(
+    "path",
+    required=True,
+    type=click.Path(exists=True),
+)
+@click.option(
+    "--report",
+    "-r",
+    "report_path",
+    required=True,
+    type=click.Path(exists=True),
+    help="the report holding the responses, updated in place",
+)
+@click.option("--key", "-k", multiple=True, help="The keys to rescore")
+@click.option(
+    "--workers",
+    "-w",
+    type=click.INT,
+    default=4,
+    help="how many prompt cases to evaluate concurrently",
+)
+@click.option(
+    "--cache",
+    type=click.Path(),
+    help="evaluator results cache, defaults to <report>.evalcache.json",
+)
+@click.option("--no-cache", is_flag=True, help="don't memoize evaluator results")
+@click.option(
+    "--style",
+    "-s",
+    type=click.Choice(["json", "yaml"], case_sensitive=False),
+    default="yaml",
+    help="json or yaml formatting",
+)
+def rescore(path, report_path, key, workers, cache, no_cache, style):
+    """Rescore stored responses after changing evaluators, without calling the API"""
+    from promptimize.crawler import discover_objects
+    from promptimize.evaluation_cache import EvaluationCache
+    from promptimize.prompt_cases import BasePromptCase
+    from promptimize.reports import Report
+    from promptimize.suite import Suite
+
+    click.secho("💡 ¡promptimize! 💡", fg="cyan")
+    report = Report.from_path(report_path)
+    evaluation_cache = None
+    if not no_cache:
+        evaluation_cache = EvaluationCache(cache or report_path + ".evalcache.json")
+
+    suite = Suite(discover_objects(path, BasePromptCase))
+    suite.rescore(report, keys=key, workers=workers, cache=evaluation_cache, style=style)
+
+    output_report = Report.from_suite(suite)
+    output_report.merge(report)
+    click.secho(f"# Writing file output to {report_path}", fg="yellow")
+    output_report.write(report_path, style=style)
+    if evaluation_cache is not None:
+        evaluation_cache.write()
+
+
+cli.add_command(rescore)
+
+
+@click.command("stub-server", help="serve a local OpenAI-compatible stand-in API, for load testing")
+@click.option("--port", "-p", type=click.INT, default=8089, help="port to listen on")
+@click.option("--host", default="127.0.0.1", help="interface to listen on")
+@click.option(
+    "--latency",
+    default="0.5",
+    help=(
+        "time to first token in seconds, fixed (0.5) or a distribution: uniform:MIN,MAX, "
+        "normal:MEAN,STDEV, lognormal:MEDIAN,SIGMA or exponential:MEAN"
+    ),
+)
+@click.option("--token-latency", default="0", help="added per completion token, same format")
+@click.option(
+    "--completion-tokens",
+    type=click.INT,
+    default=16,
+    help="how many tokens to generate, capped by the request's max_tokens",
+)
+@click.option("--rpm", type=click.INT, default=0, help="requests per minute before 429s")
+@click.option("--burst", type=click.INT, default=0, help="requests allowed in a burst with --rpm")
+@click.option(
+    "--max-concurrency",
+    type=click.INT,
+    default=0,
+    help="in-flight requests before 429s",
+)
+@click.option(
+    "--error-rate",
+    type=click.FLOAT,
+    default=0.0,
+    help="probability of answering with an injected error",
+)
+@click.option(
+    "--error-codes",
+    default="500,502,503",
+    help="HTTP status codes to pick injected errors from",
+)
+@click.option("--response", help="a fixed response text, instead of generated filler")
+@click.option("--seed", type=click.INT, help="seed for latencies, errors and filler text")
+@click.option(
+    "--prefix-cache",
+    type=click.INT,
+    default=0,
+    help="simulate prompt caching, reporting the prefix shared with that many recent prompts",
+)
+def stub_server(
+    port,
+    host,
+    latency,
+    token_latency,
+    completion_tokens,
+    rpm,
+    burst,
+    max_concurrency,
+    error_rate,
+    error_codes,
+    response,
+    seed,
+    prefix_cache,
+):
+    """Serve fake completions until interrupted, then print request stats"""
+    import time
+
+    from promptimize.stub_server import StubServer, parse_error_codes
+
+    try:
+        server = StubServer(
+            port=port,
+            host=host,
+            latency=latency,
+            token_latency=token_latency,
+            completion_tokens=completion_tokens,
+            rpm=rpm,
+            max_concurrency=max_concurrency,
+            burst=burst,
+            error_rate=error_rate,
+            error_codes=parse_error_codes(error_codes),
+            response=response,
+            seed=seed,
+            prefix_cache=prefix_cache,
+        )
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    server.start()
+    click.secho(f"# Stub OpenAI API serving on {server.api_base}", fg="cyan")
+    click.secho(f"export OPENAI_API_BASE={server.api_base}", fg="yellow")
+    click.secho("export OPENAI_API_KEY=stub", fg="yellow")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        click.secho("# Stub server stats", fg="cyan")
+        for stat, value in server.stats.items():
+            click.echo(f"{stat}: {value}")
+
+
+cli.add_command(stub_server)
+
+
+@click.command(help="compare two reports, exiting with 1 if any score regressed")
+@click.argument("old", required=True, type=click.Path(exists=True))
+@click.argument("new", required=True, type=click.Path(exists=True))
+@click.option(
+    "--tolerance",
+    type=click.FLOAT,
+    default=0.0,
+    help="score changes up to this much are considered unchanged",
+)
+@click.option(
+    "--max-keys",
+    type=click.INT,
+    default=50,
+    help="how many keys to list for each kind of change",
+)
+@click.pass_context
+def diff(ctx, old, new, tolerance, max_keys):
+    """Diff two reports in key order, keeping memory constant"""
+    import yaml
+    from tabulate import tabulate
+
+    from promptimize.report_diff import diff_reports
+
+    try:
+        report_diff = diff_reports(old, new, tolerance=tolerance, max_keys=max_keys)
+    except (ValueError, yaml.YAMLError) as e:
+        # decoding errors and pyarrow's are ValueErrors
+        raise click.UsageError(f"can't read the reports, yaml and parquet are supported: {e}")
+
+    click.secho("# Changes", fg="cyan")
+    click.echo(tabulate(report_diff.counts.items(), tablefmt="psql"))
+    click.secho("# Deltas per category", fg="cyan")
+    click.echo(
+        tabulate(report_diff.category_rows(), headers="keys", tablefmt="psql", floatfmt=".3f")
+    )
+    for status, fg in (("prompt_changed", "yellow"), ("new", None), ("removed", None)):
+        if report_diff.keys[status]:
+            click.secho(f"# {status}: {', '.join(report_diff.keys[status])}", fg=fg)
+    if report_diff.has_regressions:
+        count = report_diff.counts["regressed"]
+        click.secho(f"# {count} regressed: {', '.join(report_diff.keys['regressed'])}", fg="red")
+        ctx.exit(1)
+
+
+cli.add_command(diff)
+
+
+@click.command(help="keep running prompt cases as their modules change")
+@click.argument(
+    "path",
+    required=True,
+    type=click.Path(exists=True),
+)
+@click.option(
+    "--output",
+    "-o",
+    required=True,
+    type=click.Path(),
+    help="the report to keep up to date",
+)
+@click.option("--verbose", "-v", is_flag=True, help="Trigger more verbose output")
+@click.option(
+    "--style",
+    "-s",
+    type=click.Choice(["json", "yaml"], case_sensitive=False),
+    default="yaml",
+    help="json or yaml formatting",
+)
+@click.option(
+    "--max-tokens",
+    "-m",
+    type=click.INT,
+    default=1000,
+    help="max_tokens passed to the model",
+)
+@click.option(
+    "--temperature",
+    "-t",
+    type=click.FLOAT,
+    default=0.5,
+    help="the temperature passed to the model",
+)
+@click.option(
+    "--engine",
+    "-e",
+    type=click.STRING,
+    default=None,
+    help="model as accepted by the openai API, defaults to $OPENAI_MODEL or text-davinci-003",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.INT,
+    default=0,
+    help="Run prompt cases concurrently, with that many threads per model",
+)
+@click.option(
+    "--interval",
+    type=click.FLOAT,
+    default=0.5,
+    help="how often (in seconds) to check the modules for changes",
+)
+def watch(path, output, verbose, style, max_tokens, temperature, engine, workers, interval):
+    """Re-run the prompt cases whose prompt changed, from a warm process"""
+    from promptimize.watch import Watcher
+
+    click.secho("💡 ¡promptimize! 💡", fg="cyan")
+    watcher = Watcher(
+        path,
+        output,
+        executor_params={"engine": engine, "max_tokens": max_tokens, "temperature": temperature},
+        execute_kwargs={"verbose": verbose, "style": style, "workers": workers},
+        interval=interval,
+        style=style,
+    )
+    watcher.watch()
+
+
+cli.add_command(watch)
+
+
+@click.command(help="serve a job API running suites from a warm process")
+@click.option("--port", "-p", type=click.INT, default=8090, help="port to listen on")
+@click.option("--host", default="127.0.0.1", help="interface to listen on")
+@click.option("--max-jobs", type=click.INT, default=4, help="jobs running at the same time")
+@click.option(
+    "--max-concurrency",
+    type=click.INT,
+    default=8,
+    help="API calls in flight, shared fairly by the running jobs",
+)
+@click.option(
+    "--rpm",
+    type=click.INT,
+    default=0,
+    help="API calls per minute, shared fairly by the running jobs",
+)
+def serve(port, host, max_jobs, max_concurrency, rpm):
+    """Take runs as jobs over HTTP until interrupted"""
+    import time
+
+    from promptimize.server import EvaluationServer
+
+    server = EvaluationServer(
+        port=port, host=host, max_jobs=max_jobs, max_concurrency=max_concurrency, rpm=rpm
+    )
+    server.start()
+    click.secho(f"# Evaluation server listening on {server.url}", fg="cyan")
+    click.secho(
+        f'curl -X POST {server.url}/jobs -d \'{{"path": "examples/", "output": "report.yaml"}}\'',
+        fg="yellow",
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        click.secho("# Stopping, cancelling running jobs", fg="yellow")
+        server.stop()
+
+
+cli.add_command(serve)
+
+
+@click.command(help="review the prompt cases of a report, overriding their scores")
+@click.argument(
+    "path",
+    required=True,
+    type=click.Path(exists=True),
+)
+@click.option(
+    "--all",
+    "all_prompts",
+    is_flag=True,
+    help="Go through every prompt case, not just the ones queued for review",
+)
+@click.option("--failed", is_flag=True, help="Only the prompt cases that scored below 1")
+@click.option("--key", "-k", multiple=True, help="The keys to review")
+@click.option("--category", "-c", help="Only the prompt cases of this category")
+@click.option("--verbose", "-v", is_flag=True, help="Show the whole execution details")
+@click.option(
+    "--style",
+    "-s",
+    type=click.Choice(["json", "yaml"], case_sensitive=False),
+    default="yaml",
+    help="json or yaml formatting",
+)
+def review(path, all_prompts, failed, key, category, verbose, style):
+    """Step through queued prompt cases, saving overrides as they're made"""
+    from promptimize import console, utils
+    from promptimize.reports import Report
+    from promptimize.review import record_review, save_reviews, select_prompts
+
+    report = Report.from_path(path)
+    keys = select_prompts(
+        report, pending=not all_prompts, failed=failed, keys=key, category=category
+    )
+    if not keys:
+        click.secho("# Nothing to review", fg="green")
+        return
+
+    color = console.is_terminal()
+    reviewed = {}
+    try:
+        for i, prompt_key in enumerate(keys):
+            prompt = report.get_prompt(prompt_key)
+            s = f"# ({i+1}/{len(keys)}) [REVIEW] prompt: {prompt_key}"
+            click.echo(console.format_separated_section(s, "cyan", color), nl=False)
+            shown = prompt.to_dict()
+            if not verbose:
+                shown["execution"] = {
+                    k: v for k, v in shown["execution"].items() if k in ("score", "results")
+                }
+            click.echo(utils.serialize_object(shown, style, color))
+            v = click.prompt(
+                'Enter to accept, "Y" to force success, "N" to force fail, '
+                '"S" to skip, "X" to save and exit',
+                default="",
+                show_default=False,
+            ).lower()
+            if v == "x":
+                break
+            if v == "s":
+                continue
+            if v in ("", "y", "n"):
+                record_review(prompt, {"": None, "y": 1, "n": 0}[v])
+                reviewed[prompt_key] = prompt
+                click.secho(
+                    {"": "Accepted", "y": "Forcing SUCCESS", "n": "Forcing FAILURE"}[v],
+                    fg={"": "yellow", "y": "green", "n": "red"}[v],
+                )
+            else:
+                click.secho(f"Unknown answer {v}, skipping", fg="red")
+    except click.Abort:
+        click.echo()
+    finally:
+        if reviewed:
+            save_reviews(path, reviewed, style=style)
+            click.secho(f"# Saved {len(reviewed)} reviews to {path}", fg="yellow")
+
+
+cli.add_command(review)
+
+
+@click.group(help="manage the packs of reports stored with --storage blobs")
+def blobs():
+    pass
+
+
+@blobs.command(help="reclaim the space of the texts a report no longer references")
+@click.argument(
+    "path",
+    required=True,
+    type=click.Path(exists=True),
+)
+def gc(path):
+    from promptimize.blob_store import referenced_chunks
+    from promptimize.reports import Report
+
+    report = Report.from_path(path)
+    if report is None or report.blob_store is None:
+        raise click.UsageError(f"{path} doesn't store its texts as blobs")
+    store = report.blob_store
+    reclaimed = store.compact(referenced_chunks(report.prompts.values()))
+    click.secho(f"# Reclaimed {reclaimed} bytes from {store.path}", fg="yellow")
+
+
+cli.add_command(blobs)
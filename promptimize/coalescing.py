@@ -0,0 +1,110 @@
+"""
+Coalescing of identical API calls.
+
+Prompt cases that render the same prompt for the same executor settings, and
+only differ by their evaluators, key or category, would get the same
+completion. `RequestCoalescer` groups them before a run so that one call is
+made per group: the first case of a group to execute makes the call while
+the others wait for it, in between threads or later on in a sequential run.
+Every case of the group gets the response and the call's usage, the cases
+that didn't make the call being marked with `coalesced.shared`: totals of
+tokens and cost leave them out, see `is_shared`. Their wait isn't an API
+latency either, and gets recorded as `coalesced.waited_ms` instead.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+from box import Box
+
+
+def is_shared(execution) -> bool:
+    """whether the usage of an execution is the one of a call another case made"""
+    return bool((execution.get("coalesced") or {}).get("shared"))
+
+
+class _SharedCall:
+    def __init__(self) -> None:
+        self.size = 0
+        self.pending = 0
+        self.leader: Optional[str] = None
+        self.done = threading.Event()
+        self.response: Optional[str] = None
+        self.usage: Optional[dict] = None
+        self.error: Optional[BaseException] = None
+
+
+class RequestCoalescer:
+    """Share API calls in between prompt cases registered with identical requests"""
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, _SharedCall] = {}
+        self._lock = threading.Lock()
+        self.saved_calls = 0
+
+    @staticmethod
+    def make_key(prompt_case) -> Hashable:
+        """the rendered prompt, and what the executor is called with"""
+        if prompt_case.uses_default_executor:
+            executor: Any = type(prompt_case.prompt_executor).__name__
+        else:
+            # custom executors may carry settings we can't see, only share the same instance
+            executor = id(prompt_case.prompt_executor)
+        kwargs = sorted((k, repr(v)) for k, v in prompt_case.prompt_executor_kwargs.items())
+        return prompt_case.prompt, executor, tuple(kwargs)
+
+    def register(self, prompt_cases: Iterable) -> int:
+        """register the prompt cases about to run, returns how many calls get saved"""
+        with self._lock:
+            for prompt_case in prompt_cases:
+                call = self._calls.setdefault(self.make_key(prompt_case), _SharedCall())
+                call.size += 1
+                call.pending += 1
+            self.saved_calls = sum(c.size - 1 for c in self._calls.values())
+        return self.saved_calls
+
+    def execute(self, prompt_case, execute_prompt: Callable[[str], str]) -> str:
+        """
+        Execute the prompt of a registered prompt case through
+        `execute_prompt`, or wait for the identical call another case made.
+        """
+        key = self.make_key(prompt_case)
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None or call.size < 2:
+                call = None
+            else:
+                is_leader = call.leader is None
+                if is_leader:
+                    call.leader = prompt_case.key
+                call.pending -= 1
+                if not call.pending:
+                    # every case of the group got its turn, nothing left to share
+                    del self._calls[key]
+        if call is None:
+            return execute_prompt(prompt_case.prompt)
+
+        if is_leader:
+            try:
+                call.response = execute_prompt(prompt_case.prompt)
+                call.usage = prompt_case.execution.get("openai")
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                call.done.set()
+        else:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+        self._record(prompt_case, call)
+        return call.response  # type: ignore
+
+    @staticmethod
+    def _record(prompt_case, call: _SharedCall) -> None:
+        shared = call.leader != prompt_case.key
+        if call.usage is not None and shared:
+            prompt_case.execution.openai = Box(call.usage)
+        prompt_case.execution.coalesced = Box(
+            group_size=call.size, leader=call.leader, shared=shared
+        )
@@ -0,0 +1,177 @@
+"""
+Columnar (Arrow/Parquet) representation of reports.
+
+Prompts get flattened into a typed schema, one row per prompt case, so that
+large run histories can be memory-mapped and analyzed without rebuilding
+nested dicts. The report's name and run summary travel in the schema
+metadata. The variant params of matrix runs go in a struct column, typed
+after the params found in the report. Fields outside the schema (pre/post
+run outputs and such) are not kept.
+
+Requires `pyarrow`, which is imported lazily.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+METADATA_KEY = b"promptimize"
+
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "cached_prompt_tokens", "total_tokens")
+USAGE_FIELDS = (*TOKEN_FIELDS, "total_cost")
+DURATION_FIELDS = ("api_call_duration_ms", "evaluation_duration_ms", "parse_duration_ms")
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa
+    except ModuleNotFoundError:
+        raise ImportError("Columnar reports require pyarrow, `pip install pyarrow`")
+    return pyarrow
+
+
+def report_schema():
+    pa = import_pyarrow()
+    return pa.schema(
+        [
+            ("key", pa.string()),
+            ("prompt_hash", pa.string()),
+            ("category", pa.dictionary(pa.int32(), pa.string())),
+            ("weight", pa.float64()),
+            ("score", pa.float64()),
+            ("results", pa.list_(pa.float64())),
+            ("human_override", pa.bool_()),
+            ("review_status", pa.dictionary(pa.int32(), pa.string())),
+            ("reviewed_at", pa.timestamp("us")),
+            *[(f, pa.int64()) for f in TOKEN_FIELDS],
+            ("total_cost", pa.float64()),
+            *[(f, pa.float64()) for f in DURATION_FIELDS],
+            ("time_to_first_token_ms", pa.float64()),
+            ("run_at", pa.timestamp("us")),
+            ("git_sha", pa.dictionary(pa.int32(), pa.string())),
+            ("user_input", pa.large_string()),
+            ("prompt", pa.large_string()),
+            ("response", pa.large_string()),
+        ]
+    )
+
+
+def _variant_array(variants: List[Optional[dict]]):
+    """a struct array of the variant params, as strings if a param's values have mixed types"""
+    pa = import_pyarrow()
+    try:
+        return pa.array(variants)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(
+            [{k: str(v) for k, v in variant.items()} if variant else None for variant in variants]
+        )
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    if not value or isinstance(value, datetime):
+        return value or None
+    return datetime.fromisoformat(str(value))
+
+
+def _flatten(prompt: Dict[str, Any], git_sha: Optional[str]) -> Dict[str, Any]:
+    execution = prompt.get("execution") or {}
+    openai = execution.get("openai") or {}
+    review = execution.get("review") or {}
+    category = prompt.get("category")
+    user_input = prompt.get("user_input")
+    row = {
+        "key": prompt.get("key"),
+        "prompt_hash": prompt.get("prompt_hash"),
+        # any value is accepted as a category, the column holds strings
+        "category": str(category) if category is not None else None,
+        "weight": prompt.get("weight"),
+        "score": execution.get("score"),
+        "results": execution.get("results"),
+        "human_override": execution.get("human_override"),
+        "review_status": review.get("status"),
+        "reviewed_at": _parse_timestamp(review.get("reviewed_at")),
+        "time_to_first_token_ms": (execution.get("stream") or {}).get("time_to_first_token_ms"),
+        "run_at": _parse_timestamp(execution.get("run_at")),
+        "git_sha": git_sha,
+        "user_input": str(user_input) if user_input is not None else None,
+        "prompt": prompt.get("prompt"),
+        "response": prompt.get("response"),
+    }
+    row.update({f: openai.get(f) for f in USAGE_FIELDS})
+    row.update({f: execution.get(f) for f in DURATION_FIELDS})
+    return row
+
+
+def report_to_table(data: Dict[str, Any]):
+    """Flatten a report's data into an Arrow table"""
+    pa = import_pyarrow()
+    run_summary = data.get("run_summary") or {}
+    git_sha = (run_summary.get("git_info") or {}).get("sha")
+    prompts = (data.get("prompts") or {}).values()
+    schema = report_schema()
+    columns: Dict[str, List[Any]] = {name: [] for name in schema.names}
+    for prompt in prompts:
+        for name, value in _flatten(prompt, git_sha).items():
+            columns[name].append(value)
+    variants = [prompt.get("variant") or None for prompt in prompts]
+    if any(variants):
+        columns["variant"] = _variant_array(variants)
+        schema = schema.append(pa.field("variant", columns["variant"].type))
+    metadata = {"name": data.get("name"), "run_summary": run_summary}
+    schema = schema.with_metadata({METADATA_KEY: json.dumps(metadata, default=str)})
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def _nest(row: Dict[str, Any]) -> Dict[str, Any]:
+    execution: Dict[str, Any] = {
+        f: row.get(f) for f in ("score", "results", *DURATION_FIELDS) if row.get(f) is not None
+    }
+    openai = {f: row[f] for f in USAGE_FIELDS if row.get(f) is not None}
+    if openai:
+        execution["openai"] = openai
+    if row.get("time_to_first_token_ms") is not None:
+        execution["stream"] = {"time_to_first_token_ms": row["time_to_first_token_ms"]}
+    if row.get("run_at") is not None:
+        execution["run_at"] = row["run_at"].isoformat()
+    if row.get("human_override"):
+        execution["human_override"] = True
+    if row.get("review_status"):
+        execution["review"] = {"status": row["review_status"]}
+        if row.get("reviewed_at") is not None:
+            execution["review"]["reviewed_at"] = row["reviewed_at"].isoformat()
+    prompt = {f: row.get(f) for f in ("key", "prompt_hash", "prompt", "category", "response")}
+    if row.get("variant"):
+        prompt["variant"] = {k: v for k, v in row["variant"].items() if v is not None}
+    if row.get("user_input") is not None:
+        prompt["user_input"] = row["user_input"]
+    prompt["weight"] = row.get("weight")
+    prompt["execution"] = execution
+    return prompt
+
+
+def table_to_report_data(table) -> Dict[str, Any]:
+    """Rebuild a report's nested data out of an Arrow table"""
+    metadata = json.loads((table.schema.metadata or {}).get(METADATA_KEY, b"{}"))
+    prompts = {row["key"]: _nest(row) for row in table.to_pylist()}
+    return {
+        "name": metadata.get("name"),
+        "prompts": prompts,
+        "run_summary": metadata.get("run_summary") or {},
+    }
+
+
+def iter_parquet_prompts(path: str, batch_size: int = 1024) -> Iterator[Tuple[str, dict]]:
+    """yield (key, prompt) pairs from a parquet report, one row batch at a time"""
+    parquet_file = import_pyarrow().parquet.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        for row in batch.to_pylist():
+            yield row["key"], _nest(row)
+
+
+def write_parquet(table, path: str) -> None:
+    import_pyarrow().parquet.write_table(table, path)
+
+
+def read_parquet(path: str, columns: Optional[List[str]] = None, memory_map: bool = True):
+    """Read a table, memory-mapping the file so that columns get loaded as they're used"""
+    return import_pyarrow().parquet.read_table(path, columns=columns, memory_map=memory_map)
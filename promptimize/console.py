@@ -0,0 +1,190 @@
+"""
+Console output helpers used while executing suites.
+
+Rendering a prompt case (building its dict, dumping YAML/JSON and
+highlighting it) is slow enough to become the bottleneck on fast or cached
+runs, so this module provides:
+
+* a `BackgroundWriter` that renders and writes output on a separate thread,
+  buffering writes in batches
+* a `ProgressLine` that summarizes a run in a single live line
+"""
+import queue
+import sys
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Optional, TextIO, Union
+
+import click
+
+# number of prompt cases over which the compact progress display is the default
+LARGE_RUN_THRESHOLD = 50
+
+
+def is_terminal(stream: Optional[TextIO] = None) -> bool:
+    """Whether the stream (stdout by default) is an interactive terminal"""
+    stream = stream or sys.stdout
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def resolve_display(display: str, num_prompts: int, stream: Optional[TextIO] = None) -> str:
+    """Turn the "auto" display mode into either "progress" or "detailed" """
+    if display != "auto":
+        return display
+    if not is_terminal(stream) or num_prompts > LARGE_RUN_THRESHOLD:
+        return "progress"
+    return "detailed"
+
+
+def format_separated_section(s: str, fg=None, color: bool = True) -> str:
+    line = "# " + "-" * 40
+    return "\n".join(click.style(t, fg=fg) if color else t for t in (line, s, line)) + "\n"
+
+
+class BackgroundWriter:
+    """
+    Write to a stream from a background thread.
+
+    Items put on the writer are either strings or callables returning a
+    string, the latter being rendered on the writer thread. Pending items are
+    joined and written in batches of up to `batch_size` items.
+    """
+
+    _STOP = object()
+
+    def __init__(self, stream: Optional[TextIO] = None, batch_size: int = 64) -> None:
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def write(self, item: Union[str, Callable[[], str]]) -> None:
+        self._queue.put(item)
+
+    def flush(self) -> None:
+        """Block until everything written so far made it to the stream"""
+        self._queue.join()
+
+    def close(self) -> None:
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _work(self) -> None:
+        running = True
+        while running:
+            items = [self._queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            running = self._STOP not in items
+            chunks = [self._render(item) for item in items if item is not self._STOP]
+            if chunks:
+                self.stream.write("".join(chunks))
+                self.stream.flush()
+            for _ in items:
+                self._queue.task_done()
+
+    @staticmethod
+    def _render(item: Union[str, Callable[[], str]]) -> str:
+        if not callable(item):
+            return item
+        try:
+            return item()
+        except Exception as e:
+            return f"# Failed to render output: {e}\n"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ProgressLine:
+    """
+    A single line summarizing a run: progress, throughput, ETA, pass rate
+    and tokens/sec.
+
+    On a terminal the line is redrawn in place at most every `interval`
+    seconds, otherwise a new line is emitted every `non_tty_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        total: int,
+        stream: Optional[TextIO] = None,
+        interval: float = 0.1,
+        non_tty_interval: float = 10.0,
+    ) -> None:
+        self.total = total
+        self.stream = stream or sys.stderr
+        self.tty = is_terminal(self.stream)
+        self.interval = interval if self.tty else non_tty_interval
+        self.done = 0
+        self.ran = 0
+        self.tested = 0
+        self.passed = 0
+        self.tokens = 0
+        self.start_time = time.time()
+        # estimated duration of the run, out of the report's history
+        self.expected_ms: Optional[float] = None
+        self._last_draw = 0.0
+        self._drawn_at = 0
+
+    def update(self, prompt, ran: bool) -> None:
+        """Account for one more processed prompt case"""
+        self.done += 1
+        if ran:
+            self.ran += 1
+            self.tokens += prompt.execution.get("openai", {}).get("total_tokens", 0) or 0
+            score = prompt.execution.get("score")
+            if score is not None:
+                self.tested += 1
+                if score >= 1:
+                    self.passed += 1
+        now = time.time()
+        if now - self._last_draw >= self.interval or self.done == self.total:
+            self._draw(now)
+
+    def render(self, now: Optional[float] = None) -> str:
+        elapsed = max((now or time.time()) - self.start_time, 1e-9)
+        rate = self.done / elapsed
+        remaining = self.total - self.done
+        eta: Any = timedelta(seconds=int(remaining / rate)) if rate else "?"
+        if self.expected_ms and elapsed < self.expected_ms / 1000 and remaining:
+            # early rates are noisy, trust the estimate until it's overrun
+            eta = timedelta(seconds=int(self.expected_ms / 1000 - elapsed))
+        pass_rate = f"{self.passed / self.tested:.0%}" if self.tested else "-"
+        width = len(str(self.total))
+        return (
+            f"# [{self.done:>{width}}/{self.total}] {rate:.1f} cases/s | ETA {eta} | "
+            f"ran {self.ran} | pass {pass_rate} | {self.tokens / elapsed:.0f} tokens/s"
+        )
+
+    def _draw(self, now: float) -> None:
+        self._last_draw = now
+        self._drawn_at = self.done
+        line = self.render(now)
+        if self.tty:
+            self.stream.write("\r\033[K" + line)
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def finish(self) -> None:
+        if not self.done:
+            return
+        if self._drawn_at != self.done:
+            # the run may have stopped before processing every prompt case
+            self._draw(time.time())
+        if self.tty:
+            self.stream.write("\n")
+            self.stream.flush()
@@ -1,48 +1,99 @@
 import sys
+import hashlib
 import importlib
 import pkgutil
 from pathlib import Path
-from typing import List, Type, Any
+from types import ModuleType
+from typing import List, Optional, Set, Type, Any
 
 
 def is_instance_or_derivative(obj: Any, object_type: Type) -> bool:
     return isinstance(obj, object_type)
 
 
-def discover_objects(path: str, object_type: Type) -> List[Any]:  # noqa
+def objects_in_module(module: ModuleType, object_type: Type) -> List[Any]:
     objects = []
+    # Iterate over the objects in the module
+    for name, obj in module.__dict__.items():
+        # Check if the object is an instance or derivative of the specified type
+        if is_instance_or_derivative(obj, object_type):
+            objects.append(obj)
+        # Check if the object is a list or tuple containing instances or
+        # derivatives of the specified type
+        elif isinstance(obj, (list, tuple)):
+            for item in obj:
+                if is_instance_or_derivative(item, object_type):
+                    objects.append(item)
+    return objects
+
+
+def module_mtime(module: ModuleType) -> Optional[int]:
+    """when the module's source was last modified, to tell when it needs reloading"""
+    try:
+        return Path(module.__file__).stat().st_mtime_ns  # type: ignore
+    except (OSError, TypeError):
+        return None
+
+
+def module_references(module: ModuleType, names: Set[str]) -> bool:
+    """whether a module imported any of the named modules, or something out of them"""
+    for obj in module.__dict__.values():
+        if isinstance(obj, ModuleType):
+            if obj.__name__ in names:
+                return True
+        elif getattr(obj, "__module__", None) in names:
+            return True
+    return False
+
+
+def _folder_package(folder: Path) -> str:
+    """
+    A package named after the folder's path, so that the modules of
+    different folders don't collide in `sys.modules` when they share a name
+    """
+    name = "_promptimize_" + hashlib.sha256(str(folder).encode()).hexdigest()[:12]
+    if name not in sys.modules:
+        package = ModuleType(name)
+        package.__path__ = [str(folder)]  # type: ignore
+        sys.modules[name] = package
+    return name
+
+
+def _import(folder: Path, module_name: str, isolated: bool) -> ModuleType:
+    if isolated:
+        return importlib.import_module(f"{_folder_package(folder)}.{module_name}")
+    return importlib.import_module(module_name)
+
+
+def discover_modules(path: str, isolated: bool = False) -> List[ModuleType]:
+    """
+    Import the modules of a folder, or a single module file. With `isolated`,
+    they get imported in a package of their own, for processes serving
+    suites that may have modules with the same names.
+    """
     folder_path = Path(path).resolve()
 
-    def process_module(module):
-        # Iterate over the objects in the module
-        for name, obj in module.__dict__.items():
-            # Check if the object is an instance or derivative of the specified type
-            if is_instance_or_derivative(obj, object_type):
-                objects.append(obj)
-            # Check if the object is a list or tuple containing instances or
-            # derivatives of the specified type
-            elif isinstance(obj, (list, tuple)):
-                for item in obj:
-                    if is_instance_or_derivative(item, object_type):
-                        objects.append(item)
-
-    # If the path points to a file, import the module and process it directly
+    # If the path points to a file, import the module directly
     if folder_path.is_file() and folder_path.suffix == ".py":
-        sys.path.insert(0, str(folder_path.parent))
-        module_name = folder_path.stem
-        module = importlib.import_module(module_name)
-        process_module(module)
+        if str(folder_path.parent) not in sys.path:
+            sys.path.insert(0, str(folder_path.parent))
+        return [_import(folder_path.parent, folder_path.stem, isolated)]
 
-    # If the path points to a directory, proceed with the existing logic
-    elif folder_path.is_dir():
+    # If the path points to a directory, import all the modules in it
+    modules = []
+    if folder_path.is_dir():
         # Add the folder to the Python path to enable importing modules from it
-        if folder_path not in sys.path:
+        if str(folder_path) not in sys.path:
             sys.path.insert(0, str(folder_path))
 
         # Iterate over all the modules in the folder
         for _, module_name, _ in pkgutil.iter_modules([str(folder_path)]):
-            # Import the module
-            module = importlib.import_module(module_name)
-            process_module(module)
+            modules.append(_import(folder_path, module_name, isolated))
+    return modules
+
 
+def discover_objects(path: str, object_type: Type) -> List[Any]:
+    objects = []
+    for module in discover_modules(path):
+        objects.extend(objects_in_module(module, object_type))
     return objects
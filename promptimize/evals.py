@@ -8,10 +8,162 @@ All functions here are expected to:
 success, and a range in-between
 """
 
-from typing import List
+import functools
+import re
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
 
 
-def percentage_of_words(response: str, words: List[str], case_sensitive: bool = False) -> float:
+_WORD_CHAR = re.compile(r"\w")
+
+
+def _build_trie(words: List[str]) -> dict:
+    """a nested dict per character, "" marking the end of a word"""
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = None
+    return trie
+
+
+def _trie_regex(trie: dict) -> str:
+    """Build a regex matching any of the words of a trie, factored by common prefixes"""
+
+    def to_regex(node: dict) -> str:
+        terminal = "" in node
+        branches = [re.escape(char) + to_regex(child) for char, child in node.items() if char]
+        if not branches:
+            return ""
+        regex = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if terminal:
+            # greedy, so the longest keyword wins but shorter ones can still backtrack in
+            regex = "(?:" + regex + ")?"
+        return regex
+
+    return to_regex(trie)
+
+
+class KeywordMatcher:
+    """
+    A precompiled matcher that finds which keywords from a vocabulary are
+    present in a string in a single linear pass.
+
+    All keywords are folded into a single trie-shaped regex wrapped in a
+    lookahead, so that at every position the longest keyword starting there
+    is reported, and the regex engine only ever follows one branch per
+    character instead of trying every keyword in turn. Keywords that are substrings of a
+    reported keyword are necessarily present too, and are resolved through a
+    containment map computed once at construction time, by running the
+    matcher over each keyword and walking the trie for the shorter keywords
+    starting at the same positions. This gives the same
+    results as running ``w in response`` for every word, without rescanning
+    the response once per word.
+
+    Args:
+        words (List[str]): The keywords to look for.
+        case_sensitive (bool, optional): If False, both the keywords and the
+            searched string are lowercased. Defaults to False.
+        whole_word (bool, optional): If True, keywords only match on word
+            boundaries, so "cat" won't match "concatenate". Defaults to False.
+
+    Examples:
+    >>> sorted(KeywordMatcher(["frank zappa", "zappa", "hendrix"]).find("Frank Zappa rules"))
+    ['frank zappa', 'zappa']
+    >>> KeywordMatcher(["cat"], whole_word=True).find("concatenate")
+    set()
+    """
+
+    def __init__(
+        self, words: List[str], case_sensitive: bool = False, whole_word: bool = False
+    ) -> None:
+        self.words = list(words)
+        self.case_sensitive = case_sensitive
+        self.whole_word = whole_word
+
+        normalized = {self._normalize(w) for w in self.words}
+        self._always_found: Set[str] = {w for w in normalized if not w}
+        keywords = sorted(w for w in normalized if w)
+
+        self._pattern: Optional[re.Pattern] = None
+        self._contained: Dict[str, FrozenSet[str]] = {}
+        if keywords:
+            trie = _build_trie(keywords)
+            self._pattern = re.compile(self._wrap(_trie_regex(trie)))
+            for keyword in keywords:
+                self._contained[keyword] = frozenset(self._keywords_in(keyword, trie))
+
+    def _normalize(self, s: str) -> str:
+        return s if self.case_sensitive else s.lower()
+
+    def _wrap(self, alternation: str) -> str:
+        if self.whole_word:
+            alternation = rf"(?<!\w)(?:{alternation})(?!\w)"
+        return rf"(?=({alternation}))"
+
+    def _ends_word(self, text: str, end: int) -> bool:
+        return not self.whole_word or end == len(text) or not _WORD_CHAR.match(text[end])
+
+    def _keywords_in(self, text: str, trie: dict) -> Set[str]:
+        """
+        every keyword in the text: the longest one found at each position, and
+        the keywords it starts with, which are on its path down the trie
+        """
+        found = set()
+        for match in self._pattern.finditer(text):  # type: ignore
+            longest, start = match.group(1), match.start(1)
+            node = trie
+            for i, char in enumerate(longest):
+                node = node[char]
+                if "" in node and self._ends_word(text, start + i + 1):
+                    found.add(longest[: i + 1])
+        return found
+
+    def find(self, response: str) -> Set[str]:
+        """Return the set of normalized keywords present in the response"""
+        found = set(self._always_found)
+        if self._pattern is None:
+            return found
+        for match in self._pattern.finditer(self._normalize(response)):
+            keyword = match.group(1)
+            if keyword not in found:
+                found |= self._contained[keyword]
+        return found
+
+    def search(self, response: str) -> bool:
+        """Return True as soon as any keyword is found in the response"""
+        if self._always_found:
+            return True
+        if self._pattern is None:
+            return False
+        return self._pattern.search(self._normalize(response)) is not None
+
+    def count(self, response: str) -> int:
+        """Count how many of the (possibly repeated) words are in the response"""
+        found = self.find(response)
+        return sum(1 for w in self.words if self._normalize(w) in found)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_keyword_matcher(
+    words: Tuple[str, ...], case_sensitive: bool, whole_word: bool
+) -> KeywordMatcher:
+    return KeywordMatcher(list(words), case_sensitive=case_sensitive, whole_word=whole_word)
+
+
+def get_keyword_matcher(
+    words: List[str], case_sensitive: bool = False, whole_word: bool = False
+) -> KeywordMatcher:
+    """
+    Get a KeywordMatcher for a word list, reusing a previously compiled one
+    when the same words and settings were requested before.
+    """
+    return _cached_keyword_matcher(tuple(words), case_sensitive, whole_word)
+
+
+def percentage_of_words(
+    response: str, words: List[str], case_sensitive: bool = False, whole_word: bool = False
+) -> float:
     """
     Calculate the percentage of words from a list that are present in the given response.
 
@@ -20,6 +172,8 @@ def percentage_of_words(response: str, words: List[str], case_sensitive: bool =
         words (List[str]): A list of words to check for their presence in the response.
         case_sensitive (bool, optional): If True, the search will be case-sensitive;
                                          otherwise, it will be case-insensitive. Defaults to False.
+        whole_word (bool, optional): If True, words only match on word boundaries.
+                                     Defaults to False.
 
     Returns:
         float: The percentage of words found in the response (0.0 to 1.0).
@@ -36,29 +190,26 @@ def percentage_of_words(response: str, words: List[str], case_sensitive: bool =
     >>> percentage_of_words_in_response("This is an Example string.", ["notfound"])
     0.0
     """
-    if not case_sensitive:
-        response = response.lower()
-        words = [w.lower() for w in words]
-
-    return sum(1 if w in response else 0 for w in words) / len(words)
+    matcher = get_keyword_matcher(words, case_sensitive, whole_word)
+    return matcher.count(response) / len(words)
 
 
 def _common_word_search(
-    response: str, words: List[str], case_sensitive: bool, match_type: str
+    response: str, words: List[str], case_sensitive: bool, match_type: str, whole_word: bool
 ) -> int:
-    if not case_sensitive:
-        response = response.lower()
-        words = [w.lower() for w in words]
+    matcher = get_keyword_matcher(words, case_sensitive, whole_word)
 
     if match_type == "any":
-        return 1 if any(w in response for w in words) else 0
+        return 1 if matcher.search(response) else 0
     elif match_type == "all":
-        return 1 if all(w in response for w in words) else 0
+        return 1 if matcher.count(response) == len(words) else 0
     else:
         raise ValueError("Invalid match_type. Accepted values are 'any' or 'all'.")
 
 
-def any_word(response: str, words: List[str], case_sensitive: bool = False) -> int:
+def any_word(
+    response: str, words: List[str], case_sensitive: bool = False, whole_word: bool = False
+) -> int:
     """
     Check if any word from a list of words is present in the given response and return 1 or 0.
 
@@ -67,6 +218,8 @@ def any_word(response: str, words: List[str], case_sensitive: bool = False) -> i
         words (List[str]): A list of words to check for their presence in the response.
         case_sensitive (bool, optional): If True, the search will be case-sensitive;
                                          otherwise, it will be case-insensitive. Defaults to False.
+        whole_word (bool, optional): If True, words only match on word boundaries.
+                                     Defaults to False.
 
     Returns:
         int: 1 if any word from the list is found in the response; otherwise, 0.
@@ -81,10 +234,14 @@ def any_word(response: str, words: List[str], case_sensitive: bool = False) -> i
     >>> any_word("This is an Example string.", ["notfound"])
     0
     """
-    return _common_word_search(response, words, case_sensitive, match_type="any")
+    return _common_word_search(
+        response, words, case_sensitive, match_type="any", whole_word=whole_word
+    )
 
 
-def all_words(response: str, words: List[str], case_sensitive: bool = False) -> int:
+def all_words(
+    response: str, words: List[str], case_sensitive: bool = False, whole_word: bool = False
+) -> int:
     """
     Check if all words from a list of words are present in the given response and return 1 or 0.
 
@@ -93,6 +250,8 @@ def all_words(response: str, words: List[str], case_sensitive: bool = False) ->
         words (List[str]): A list of words to check for their presence in the response.
         case_sensitive (bool, optional): If True, the search will be case-sensitive;
                                          otherwise, it will be case-insensitive. Defaults to False.
+        whole_word (bool, optional): If True, words only match on word boundaries.
+                                     Defaults to False.
 
     Returns:
         int: 1 if all words from the list are found in the response; otherwise, 0.
@@ -107,7 +266,9 @@ def all_words(response: str, words: List[str], case_sensitive: bool = False) ->
     >>> all_words("This is an Example string.", ["example", "notfound"])
     0
     """
-    return _common_word_search(response, words, case_sensitive, match_type="all")
+    return _common_word_search(
+        response, words, case_sensitive, match_type="all", whole_word=whole_word
+    )
 
 
 base_all = all
@@ -115,8 +276,35 @@ base_any = any
 
 
 def all(iteratable):
-    return 1 if base_all([i == 1 for i in iteratable]) else 0
+    return 1 if base_all(i == 1 for i in iteratable) else 0
 
 
 def any(iteratable):
-    return 1 if base_any([i == 1 for i in iteratable]) else 0
+    return 1 if base_any(i == 1 for i in iteratable) else 0
+
+
+def evaluator(func: Optional[Callable] = None, cost: float = 1, weight: float = 1):
+    """
+    Annotate an evaluator with a relative cost and a weight.
+
+    Prompt cases combining their results with "all" or "any" run the cheapest
+    evaluators first and skip the remaining ones once the score is decided,
+    while "weighted" averages results using the weights. Works both as a
+    decorator and as a plain function call wrapping a lambda.
+
+    Examples:
+    >>> @evaluator(cost=100)
+    ... def runs_the_generated_code(prompt_case):
+    ...     return 1
+    >>> evaluator(lambda x: any_word(x.response, ["hi"]), cost=0.1).cost
+    0.1
+    """
+
+    def decorate(f: Callable) -> Callable:
+        f.cost = cost  # type: ignore
+        f.weight = weight  # type: ignore
+        return f
+
+    if func is None:
+        return decorate
+    return decorate(func)
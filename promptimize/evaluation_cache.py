@@ -0,0 +1,80 @@
+"""
+Memoization of evaluator results.
+
+Results are keyed by the prompt hash, a hash of the response and the
+fingerprint of the evaluator's code, so that when rescoring stored responses
+only the evaluator/response pairs that actually changed get recomputed. The
+fingerprint covers the module globals the evaluator uses, and the prompt
+case methods and properties it gets to by name, `post_run` included. Code
+reached otherwise, ie: through `getattr` or other objects' methods, isn't:
+rescore with `--no-cache` after changing such code.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from promptimize import utils
+
+
+class EvaluationCache:
+    """A thread-safe evaluator results cache, optionally persisted as a JSON file"""
+
+    version = "0.2.0"
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.results: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # per (prompt case class, evaluator), code doesn't change within a run
+        self._fingerprints: Dict[Tuple[type, int], Tuple[Any, str]] = {}
+        # shared between evaluators of the same code, ie: lambdas made in a loop
+        self._memo: Dict[Any, Any] = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self.results = data.get("results", {})
+
+    def fingerprint(self, prompt_case, evaluator) -> str:
+        """the evaluator's code, and the code of the prompt case it gets to"""
+        key = (type(prompt_case), id(evaluator))
+        cached = self._fingerprints.get(key)
+        if cached is None:
+            cls = type(prompt_case)
+            fingerprint = utils.code_fingerprint(evaluator, memo=self._memo)
+            fingerprint += utils.attribute_fingerprint(cls, evaluator, ("post_run",), self._memo)
+            # holding on to the evaluator, so that its id doesn't get reused
+            cached = self._fingerprints[key] = (evaluator, fingerprint)
+        return cached[1]
+
+    def make_key(self, prompt_case, evaluator) -> str:
+        return "|".join(
+            [
+                prompt_case.prompt_hash,
+                utils.short_hash(prompt_case.response, 16),
+                self.fingerprint(prompt_case, evaluator),
+            ]
+        )
+
+    def get(self, key: str) -> Optional[float]:
+        with self._lock:
+            result = self.results.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def set(self, key: str, result: float) -> None:
+        with self._lock:
+            self.results[key] = result
+
+    def write(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        with self._lock:
+            data = {"version": self.version, "results": self.results}
+        with open(path, "w") as f:
+            json.dump(data, f)
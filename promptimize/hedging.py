@@ -0,0 +1,235 @@
+"""
+Hedged API calls, cutting the tail latency.
+
+A few stragglers can set the wall-clock time of a whole run. With hedging,
+a call still running once it's slower than a percentile of the latencies
+observed so far for its model gets a duplicate request, and whichever
+attempt finishes first wins. Latencies are tracked online per model, in a
+sliding window seeded from the report's history, and no call gets hedged
+until enough of them were seen.
+
+Attempts run on copies of the prompt case, so that they don't step on each
+other's response and usage, the winner's getting copied back. Python can't
+interrupt a blocking HTTP call: a losing attempt still waiting on the limiter
+gets cancelled, one already sent is abandoned and its result dropped. It
+gets billed all the same, which `execution.hedge.extra_cost` estimates.
+"""
+import copy
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from box import Box
+
+from promptimize import planning
+from promptimize.coalescing import is_shared
+
+PRIMARY = "primary"
+HEDGE = "hedge"
+
+
+class LatencyTracker:
+    """the latest API call latencies of each model, in a sliding window"""
+
+    def __init__(self, window: int = 200) -> None:
+        self.window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, pool_key: str, duration_ms: float) -> None:
+        with self._lock:
+            latencies = self._latencies.setdefault(pool_key, deque(maxlen=self.window))
+            latencies.append(duration_ms)
+
+    def count(self, pool_key: str) -> int:
+        with self._lock:
+            return len(self._latencies.get(pool_key, ()))
+
+    def percentile(self, pool_key: str, percentile: float) -> Optional[float]:
+        """nearest-rank percentile, between 0 and 100"""
+        with self._lock:
+            latencies = list(self._latencies.get(pool_key, ()))
+        return planning.percentile(latencies, percentile)
+
+
+class _Attempt:
+    def __init__(self, role: str, prompt_case) -> None:
+        self.role = role
+        self.case = copy.copy(prompt_case)
+        self.case.execution = Box()
+        self.case.response = None
+        self.status = "pending"
+        self.response: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.started = threading.Event()
+        self.queued_at = time.time()
+        self.sent_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self, since: float, until: float) -> dict:
+        d = {"role": self.role, "status": self.status}
+        if self.sent_at is not None:
+            d["sent_after_ms"] = (self.sent_at - since) * 1000
+            d["duration_ms"] = ((self.finished_at or until) - self.sent_at) * 1000
+        if self.error is not None:
+            d["error"] = str(self.error)
+        return d
+
+
+class _Race:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.finished: "queue.Queue[_Attempt]" = queue.Queue()
+
+
+class Hedger:
+    """
+    Args:
+        percentile (float): Hedge a call once it's running for longer than
+            this percentile of the model's observed latencies, ie: 95.
+        min_samples (int): Latencies to observe for a model before hedging
+            any of its calls.
+        window (int): How many of the latest latencies are kept per model.
+    """
+
+    def __init__(self, percentile: float = 95, min_samples: int = 20, window: int = 200) -> None:
+        if not 0 < percentile < 100:
+            raise ValueError("percentile should be in between 0 and 100")
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.tracker = LatencyTracker(window)
+
+    def seed(self, latencies: Iterable[Tuple[str, Optional[float]]]) -> None:
+        """warm up the tracker with (pool_key, latency_ms) from earlier runs"""
+        for pool_key, duration_ms in latencies:
+            if duration_ms is not None:
+                self.tracker.observe(pool_key, duration_ms)
+
+    def threshold_ms(self, pool_key: str) -> Optional[float]:
+        """how long a call of this model runs before getting hedged, None if not yet known"""
+        if self.tracker.count(pool_key) < self.min_samples:
+            return None
+        return self.tracker.percentile(pool_key, self.percentile)
+
+    def _launch(self, role, prompt_case, prompt_str, limiter, race) -> _Attempt:
+        attempt = _Attempt(role, prompt_case)
+
+        def work():
+            try:
+                with limiter if limiter is not None else nullcontext():
+                    with race.lock:
+                        if race.cancelled:
+                            attempt.status = "cancelled"
+                            return
+                        attempt.sent_at = time.time()
+                    attempt.started.set()
+                    attempt.response = attempt.case.execute_prompt(prompt_str)
+                    # before the limiter's slot goes to an attempt that lost already
+                    with race.lock:
+                        race.cancelled = True
+                attempt.finished_at = time.time()
+                duration_ms = (attempt.finished_at - attempt.sent_at) * 1000
+                self.tracker.observe(prompt_case.pool_key, duration_ms)
+            except BaseException as e:
+                attempt.error = e
+            finally:
+                attempt.started.set()
+                race.finished.put(attempt)
+
+        name = f"promptimize-{role}-{prompt_case.key}"
+        threading.Thread(target=work, name=name, daemon=True).start()
+        return attempt
+
+    @staticmethod
+    def _next_finished(race: _Race, timeout: Optional[float] = None) -> _Attempt:
+        """
+        the next attempt done with its call, skipping the ones that got
+        cancelled, which may show up before the attempt that cancelled them
+        """
+        while True:
+            attempt = race.finished.get(timeout=timeout)
+            if attempt.status != "cancelled":
+                return attempt
+
+    def _race(self, prompt_case, prompt_str, limiter) -> Tuple[_Attempt, List[_Attempt]]:
+        race = _Race()
+        launch = (prompt_case, prompt_str, limiter, race)
+        attempts = [self._launch(PRIMARY, *launch)]
+        # the clock starts once the request is sent, not while waiting on the limiter
+        attempts[0].started.wait()
+        threshold_ms = self.threshold_ms(prompt_case.pool_key)
+        try:
+            timeout = None if threshold_ms is None else threshold_ms / 1000
+            winner = self._next_finished(race, timeout)
+        except queue.Empty:
+            attempts.append(self._launch(HEDGE, *launch))
+            winner = self._next_finished(race)
+            if winner.error is not None:
+                # the other attempt may still make it
+                other = self._next_finished(race)
+                if other.error is None:
+                    winner = other
+        with race.lock:
+            race.cancelled = True
+        return winner, attempts
+
+    def execute(self, prompt_case, prompt_str: str, limiter=None) -> str:
+        """execute the prompt, hedging the call if it gets slow"""
+        winner, attempts = self._race(prompt_case, prompt_str, limiter)
+        if winner.error is not None:
+            raise winner.error
+        prompt_case.response = winner.response
+        prompt_case.execution.update(winner.case.execution)
+        if len(attempts) > 1:
+            self._record(prompt_case, winner, attempts)
+        return winner.response  # type: ignore
+
+    @staticmethod
+    def _record(prompt_case, winner: _Attempt, attempts: List[_Attempt]) -> None:
+        until = time.time()
+        extra_requests = 0
+        extra_cost = 0.0
+        for attempt in attempts:
+            if attempt is winner:
+                attempt.status = "won"
+            elif attempt.sent_at is None:
+                attempt.status = "cancelled"
+            else:
+                attempt.status = "failed" if attempt.error is not None else "abandoned"
+                # an abandoned request gets billed too, likely about as much as the winner
+                usage = attempt.case.execution.get("openai") or winner.case.execution.get("openai")
+                extra_cost += (usage or {}).get("total_cost") or 0
+                extra_requests += 1
+        since = attempts[0].sent_at or attempts[0].queued_at
+        prompt_case.execution.hedge = Box(
+            winner=winner.role,
+            attempts=[a.to_dict(since, until) for a in attempts],
+            extra_requests=extra_requests,
+            extra_cost=extra_cost,
+        )
+
+
+def summarize(prompt_cases) -> Optional[dict]:
+    """how many calls got hedged and won, and what the duplicates cost on top"""
+    hedges = [p.execution.hedge for p in prompt_cases if p.has_run and p.execution.get("hedge")]
+    if not hedges:
+        return None
+    total_cost = sum(
+        (p.execution.get("openai") or {}).get("total_cost") or 0
+        for p in prompt_cases
+        if p.has_run and not is_shared(p.execution)
+    )
+    extra_cost = sum(h.get("extra_cost") or 0 for h in hedges)
+    summary = {
+        "hedged_calls": len(hedges),
+        "hedge_wins": sum(1 for h in hedges if h.get("winner") == HEDGE),
+        "extra_requests": sum(h.get("extra_requests") or 0 for h in hedges),
+        "extra_cost": extra_cost,
+    }
+    if total_cost:
+        summary["cost_overhead"] = extra_cost / total_cost
+    return summary
@@ -0,0 +1,212 @@
+"""
+Live metrics for long-running suites.
+
+`RunMetrics` gets fed from `Suite.execute` and keeps counters and latency
+histograms (cases started/completed/failed, API latency, tokens, cost, report
+cache hits, evaluator time). They can be exported in the Prometheus text
+format, either served over HTTP on `/metrics` or written periodically to a
+textfile for node_exporter's textfile collector.
+"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from promptimize.coalescing import is_shared
+
+# in seconds, covering fast evaluators up to slow completions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name: str, labels: Labels) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', str(bound)))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {self.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {self.count}")
+        return lines
+
+
+class RunMetrics:
+    """Thread-safe counters and histograms describing a run in progress"""
+
+    descriptions = {
+        "promptimize_cases_started_total": "Prompt cases sent for execution",
+        "promptimize_cases_completed_total": "Prompt cases executed and tested",
+        "promptimize_cases_failed_total": "Prompt cases that scored below 1",
+        "promptimize_cases_skipped_total": "Prompt cases skipped, their result being in the report",
+        "promptimize_tokens_total": "Tokens used, by type",
+        "promptimize_cost_total": "Cost of the API calls, as reported by the executor",
+        "promptimize_api_latency_seconds": "Duration of the API calls",
+        "promptimize_evaluation_seconds": "Time spent running evaluators for a prompt case",
+        "promptimize_hedged_calls_total": "API calls that got a duplicate request, by winner",
+    }
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def total(self, name: str) -> float:
+        """a counter summed over all its labels"""
+        with self._lock:
+            return sum(self.counters.get(name, {}).values())
+
+    def case_started(self, prompt) -> None:
+        self.inc("promptimize_cases_started_total", model=prompt.pool_key)
+
+    def case_skipped(self, prompt) -> None:
+        self.inc("promptimize_cases_skipped_total", model=prompt.pool_key)
+
+    def case_completed(self, prompt) -> None:
+        """record everything there is to know about an executed prompt case"""
+        model = prompt.pool_key
+        execution = prompt.execution
+        self.inc("promptimize_cases_completed_total", model=model)
+        score = execution.get("score")
+        if score is not None and score < 1:
+            self.inc("promptimize_cases_failed_total", model=model)
+        if execution.get("api_call_duration_ms") is not None:
+            latency = execution.api_call_duration_ms / 1000
+            self.observe("promptimize_api_latency_seconds", latency, model=model)
+        if execution.get("evaluation_duration_ms") is not None:
+            duration = execution.evaluation_duration_ms / 1000
+            self.observe("promptimize_evaluation_seconds", duration, model=model)
+        # the call another case made already got counted
+        openai = {} if is_shared(execution) else execution.get("openai") or {}
+        for token_type in ("prompt_tokens", "completion_tokens", "cached_prompt_tokens"):
+            if openai.get(token_type):
+                self.inc(
+                    "promptimize_tokens_total", openai[token_type], model=model, type=token_type
+                )
+        if openai.get("total_cost"):
+            self.inc("promptimize_cost_total", openai["total_cost"], model=model)
+        hedge = execution.get("hedge")
+        if hedge:
+            self.inc("promptimize_hedged_calls_total", model=model, winner=hedge.winner)
+            if hedge.get("extra_cost"):
+                self.inc("promptimize_cost_total", hedge.extra_cost, model=model)
+        token_cap = execution.get("token_cap")
+        if token_cap and token_cap.get("wasted_cost"):
+            self.inc("promptimize_cost_total", token_cap.wasted_cost, model=model)
+
+    def render(self) -> str:
+        """the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {self.descriptions.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, histograms in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {self.descriptions.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(histograms.items()):
+                    lines.extend(histogram.render(name, labels))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serve the metrics on http://<host>:<port>/metrics from a background thread"""
+
+    def __init__(self, metrics: RunMetrics, port: int, host: str = "127.0.0.1") -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> "MetricsServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TextfileExporter:
+    """Write the metrics to a file every `interval` seconds, atomically replacing it"""
+
+    def __init__(self, metrics: RunMetrics, path: str, interval: float = 5.0) -> None:
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+
+    def write(self) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.metrics.render())
+        os.replace(tmp_path, self.path)
+
+    def _work(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.write()
+
+    def start(self) -> "TextfileExporter":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.thread.join()
+        self.write()
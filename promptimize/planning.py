@@ -0,0 +1,394 @@
+"""
+Pre-flight planning: what a run would do and cost, without calling the API.
+
+Rendered prompts get tokenized locally, with `tiktoken` when it's installed
+and the ~4 characters per token rule of thumb otherwise. Counts are memoized
+by prompt hash, as rendering and tokenizing large suites isn't free either.
+
+Completions and durations can't be known ahead of time, they're estimated
+from the report: a prompt case's own last run when there is one, the mean
+over the report otherwise. Cost comes from langchain's OpenAI price table
+when the model is known to it, else from the cost per token seen in the
+report. `History` also feeds the run's ETA and scheduling, so they all agree.
+
+Across runs, a compact per-key index next to the report
+(`<report>.history.json`) keeps how often each case ran and failed, a
+moving average of its latency and its latest completion lengths. It drives
+the scheduling policies: longest expected latency first (shortest makespan
+with concurrent workers), most likely to fail first (fastest feedback), and
+picking the most valuable cases that fit a time budget. Completion lengths
+size the adaptive max_tokens, see `promptimize.token_caps`.
+
+The "prefix" order needs no history: prompt cases sharing a long rendered
+prefix (system prompt, few-shot examples) get dispatched back to back, as
+providers only serve a prefix from their cache when it was seen recently.
+"""
+import heapq
+import json
+import math
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from promptimize.coalescing import RequestCoalescer
+
+CHARS_PER_TOKEN = 4
+
+ORDERS = ("declared", "shuffle", "longest", "failing", "prefix")
+# how many leading characters prompts share at least to be grouped together
+MIN_SHARED_PREFIX = 256
+# weight of the latest run in the latency moving average
+LATENCY_ALPHA = 0.3
+# how many of the latest completion lengths are kept per key
+COMPLETION_WINDOW = 20
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """the tiktoken encoding for a model, or None without tiktoken"""
+    try:
+        import tiktoken
+    except ModuleNotFoundError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class TokenCounter:
+    """Count prompt tokens, memoized by prompt hash and model"""
+
+    def __init__(self) -> None:
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def count(self, text: str, model: str) -> int:
+        encoding = get_encoding(model)
+        if encoding is None:
+            return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def count_prompt(self, prompt_case) -> int:
+        key = (prompt_case.prompt_hash, prompt_case.pool_key)
+        with self._lock:
+            if key in self._counts:
+                return self._counts[key]
+        n = self.count(prompt_case.prompt or "", prompt_case.pool_key)
+        with self._lock:
+            self._counts[key] = n
+        return n
+
+
+# shared, so that warm processes (watch, serve) keep their counts around
+token_counter = TokenCounter()
+
+
+def model_token_cost(model: str, tokens: float, completion: bool = False) -> Optional[float]:
+    """the cost of tokens as per langchain's OpenAI price table, None for unknown models"""
+    try:
+        from langchain.callbacks.openai_info import get_openai_token_cost_for_model
+    except ImportError:
+        return None
+    try:
+        return get_openai_token_cost_for_model(model, int(tokens), is_completion=completion)
+    except ValueError:
+        return None
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+
+def _waited(key: str, execution) -> bool:
+    """cases that waited on a coalesced call say little about their own duration"""
+    return (execution.get("coalesced") or {}).get("leader") not in (None, key)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """nearest-rank percentile, q in between 0 and 100"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(int(math.ceil(q / 100 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class HistoryIndex:
+    """
+    Per key run count, failure count, latency moving average and latest
+    completion lengths, as `{"keys": {key: [runs, failures, latency_ms, completions]}}`.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.keys: Dict[str, List[Any]] = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.keys = json.load(f).get("keys") or {}
+
+    @classmethod
+    def for_report(cls, report_path: str) -> "HistoryIndex":
+        return cls(f"{report_path}.history.json")
+
+    def entry(self, key: str) -> List[Any]:
+        """[runs, failures, latency_ms, completions], entries written before completions padded"""
+        entry = list(self.keys.get(key) or (0, 0, None))
+        return entry + [[]] * (4 - len(entry))
+
+    def record(self, prompt_case) -> None:
+        """account for a prompt case that just ran and got tested"""
+        execution = prompt_case.execution
+        runs, failures, latency_ms, completions = self.entry(prompt_case.key)
+        score = execution.get("score")
+        duration = execution.get("api_call_duration_ms")
+        if duration is not None and not _waited(prompt_case.key, execution):
+            if latency_ms is None:
+                latency_ms = duration
+            else:
+                latency_ms = LATENCY_ALPHA * duration + (1 - LATENCY_ALPHA) * latency_ms
+            latency_ms = round(latency_ms, 1)
+        completion_tokens = (execution.get("openai") or {}).get("completion_tokens")
+        if completion_tokens is not None:
+            completions = (completions + [completion_tokens])[-COMPLETION_WINDOW:]
+        failed = score is not None and score < 1
+        self.keys[prompt_case.key] = [runs + 1, failures + int(failed), latency_ms, completions]
+
+    def record_suite(self, suite) -> None:
+        for prompt_case in suite.prompts.values():
+            # rescored responses were accounted for when they ran
+            if prompt_case.has_run and prompt_case.was_tested and not prompt_case.from_report:
+                self.record(prompt_case)
+
+    def write(self) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"keys": self.keys}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)  # type: ignore
+
+
+def update_history_index(report_path: str, suite) -> None:
+    """account for the prompt cases a suite just ran, in the index next to its report"""
+    index = HistoryIndex.for_report(report_path)
+    index.record_suite(suite)
+    index.write()
+
+
+class History:
+    """
+    Per prompt case completion tokens, durations, costs and failure odds, out
+    of a report and its history index (found next to the report by default).
+    """
+
+    def __init__(self, report=None, index: Optional[HistoryIndex] = None) -> None:
+        self.completion_tokens: Dict[str, float] = {}
+        self.completions: Dict[str, List[float]] = {}
+        self.duration_ms: Dict[str, float] = {}
+        self.scores: Dict[str, float] = {}
+        if index is None and report is not None and report.path:
+            index = HistoryIndex.for_report(report.path)
+        self.index = index or HistoryIndex()
+        tokens = cost = 0.0
+        for key, prompt in report.prompts.items() if report else []:
+            execution = prompt.get("execution") or {}
+            openai = execution.get("openai") or {}
+            if execution.get("score") is not None:
+                self.scores[key] = execution["score"]
+            if openai.get("completion_tokens") is not None:
+                self.completion_tokens[key] = openai["completion_tokens"]
+                self.completions[key] = [openai["completion_tokens"]]
+            if execution.get("api_call_duration_ms") is not None and not _waited(key, execution):
+                self.duration_ms[key] = execution["api_call_duration_ms"]
+            if openai.get("total_cost") and openai.get("total_tokens"):
+                tokens += openai["total_tokens"]
+                cost += openai["total_cost"]
+        for key in self.index.keys:
+            _, _, latency_ms, completions = self.index.entry(key)
+            if latency_ms is not None:
+                self.duration_ms[key] = latency_ms
+            if completions:
+                self.completions[key] = completions
+        self.mean_completion_tokens = _mean(list(self.completion_tokens.values()))
+        self.mean_duration_ms = _mean(list(self.duration_ms.values()))
+        self.cost_per_token = cost / tokens if tokens else None
+
+    def estimate_completion_tokens(self, key: str) -> Optional[float]:
+        return self.completion_tokens.get(key, self.mean_completion_tokens)
+
+    def estimate_duration_ms(self, key: str) -> Optional[float]:
+        return self.duration_ms.get(key, self.mean_duration_ms)
+
+    def completion_tokens_percentile(self, key: str, q: float) -> Optional[float]:
+        """out of the case's own latest completion lengths, None if it never ran"""
+        return percentile(self.completions.get(key) or [], q)
+
+    def failure_probability(self, key: str) -> float:
+        """Laplace smoothed over the indexed runs, or from the last score, 0.5 if unknown"""
+        if key in self.index.keys:
+            runs, failures = self.index.entry(key)[:2]
+            return (failures + 1) / (runs + 2)
+        if key in self.scores:
+            return (1 - self.scores[key] + 0.5) / 2
+        return 0.5
+
+    def estimate_cost(self, model: str, prompt_tokens: float, completion_tokens: float):
+        cost = model_token_cost(model, prompt_tokens)
+        if cost is not None:
+            completion_cost = model_token_cost(model, completion_tokens, completion=True)
+            return cost + (completion_cost or 0)
+        if self.cost_per_token is not None:
+            return (prompt_tokens + completion_tokens) * self.cost_per_token
+        return None
+
+
+def estimate_wall_clock_ms(durations: Iterable[Tuple[str, float]], workers: int = 0) -> float:
+    """
+    How long running prompt cases takes, given (pool, duration) pairs in
+    dispatch order: sequential without workers, otherwise each pool hands
+    cases out to `workers` threads in order, and pools run side by side.
+    """
+    if not workers:
+        return sum(duration for _, duration in durations)
+    lanes: Dict[str, List[float]] = {}
+    for pool, duration in durations:
+        heap = lanes.setdefault(pool, [0.0] * workers)
+        heapq.heappush(heap, heapq.heappop(heap) + duration)
+    return max((max(heap) for heap in lanes.values()), default=0.0)
+
+
+def _shared_prefix_length(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def prefix_groups(prompts: List[Any], min_prefix: int = MIN_SHARED_PREFIX) -> List[List[Any]]:
+    """
+    Group prompt cases of the same pool sharing at least `min_prefix`
+    characters of rendered prompt. Sorting the prompts lays them out as a
+    depth-first walk of their trie would, so that each prompt shares its
+    longest prefix with a neighbor, and groups are runs of neighbors sharing
+    enough. Groups come in the order their first case was declared.
+    """
+    position = {id(p): i for i, p in enumerate(prompts)}
+    groups: List[List[Any]] = []
+    previous = None
+    for prompt in sorted(prompts, key=lambda p: (p.pool_key, p.prompt or "")):
+        if (
+            previous is None
+            or previous.pool_key != prompt.pool_key
+            or _shared_prefix_length(previous.prompt or "", prompt.prompt or "") < min_prefix
+        ):
+            groups.append([])
+        groups[-1].append(prompt)
+        previous = prompt
+    groups.sort(key=lambda group: min(position[id(p)] for p in group))
+    return groups
+
+
+def schedule(
+    prompts: List[Any],
+    to_run: Set[str],
+    history: History,
+    order: str = "declared",
+    time_budget: float = 0,
+    workers: int = 0,
+) -> Tuple[List[Any], Set[str]]:
+    """
+    Order the prompt cases as per a policy, and with a time budget (in
+    seconds), leave out the cases to run that are worth the least for their
+    expected duration. Returns the cases to go through and the keys left out.
+    """
+    prompts = list(prompts)
+    if order == "longest":
+        prompts.sort(key=lambda p: -(history.estimate_duration_ms(p.key) or 0))
+    elif order == "failing":
+        prompts.sort(key=lambda p: -history.failure_probability(p.key))
+    elif order == "prefix":
+        prompts = [p for group in prefix_groups(prompts) for p in group]
+
+    dropped: Set[str] = set()
+    if time_budget:
+        # the budget is wall-clock time: without workers cases run one after the
+        # other, with workers each pool runs that many cases side by side
+        remaining_ms: Dict[Optional[str], float] = {}
+
+        def density(p) -> float:
+            value = p.weight * history.failure_probability(p.key)
+            return value / max(history.estimate_duration_ms(p.key) or 0, 1)
+
+        for prompt in sorted((p for p in prompts if p.key in to_run), key=density, reverse=True):
+            pool = prompt.pool_key if workers else None
+            remaining = remaining_ms.setdefault(pool, time_budget * 1000 * max(workers, 1))
+            duration = history.estimate_duration_ms(prompt.key) or 0
+            if duration <= remaining:
+                remaining_ms[pool] = remaining - duration
+            else:
+                dropped.add(prompt.key)
+        prompts = [p for p in prompts if p.key not in dropped]
+    return prompts, dropped
+
+
+class RunPlan:
+    """What a run would do: one row per selected prompt case, and totals"""
+
+    def __init__(self, rows: List[Dict[str, Any]], workers: int = 0) -> None:
+        self.rows = rows
+        self.workers = workers
+
+    def totals(self) -> Dict[str, Any]:
+        calls = [r for r in self.rows if r["action"] == "run"]
+        totals: Dict[str, Any] = {
+            action: sum(1 for r in self.rows if r["action"] == action)
+            for action in ("run", "coalesced", "skip", "left_out")
+        }
+        for field in ("prompt_tokens", "completion_tokens", "cost"):
+            known = [r[field] for r in calls if r[field] is not None]
+            totals[field] = sum(known) if known else None
+            if len(known) < len(calls):
+                totals[f"{field}_unknown"] = len(calls) - len(known)
+        durations = [(r["pool"], r["duration_ms"] or 0) for r in calls]
+        totals["wall_clock_s"] = estimate_wall_clock_ms(durations, self.workers) / 1000
+        return totals
+
+
+def plan_run(
+    prompts: List[Any],
+    to_run: Set[str],
+    history: History,
+    workers: int = 0,
+    coalesce: bool = True,
+    stream: Optional[bool] = None,
+    counter: Optional[TokenCounter] = None,
+    left_out: Iterable[str] = (),
+) -> RunPlan:
+    """
+    Estimate every prompt case's tokens, cost and duration, `to_run` holding
+    the keys to run and `left_out` the ones a time budget left out.
+    """
+    counter = counter or token_counter
+    left_out = set(left_out)
+    rows = []
+    seen: Set[Any] = set()
+    for prompt in prompts:
+        row: Dict[str, Any] = {"key": prompt.key, "pool": prompt.pool_key, "action": "skip"}
+        row.update(dict.fromkeys(("prompt_tokens", "completion_tokens", "cost", "duration_ms")))
+        if prompt.key in left_out:
+            row["action"] = "left_out"
+        elif prompt.key in to_run:
+            row["action"] = "run"
+            # the run doesn't coalesce streamed responses either
+            if coalesce and not (prompt.stream if stream is None else stream):
+                request = RequestCoalescer.make_key(prompt)
+                if request in seen:
+                    row["action"] = "coalesced"
+                seen.add(request)
+            prompt_tokens = counter.count_prompt(prompt)
+            completion_tokens = history.estimate_completion_tokens(prompt.key)
+            row["prompt_tokens"] = prompt_tokens
+            row["completion_tokens"] = completion_tokens
+            row["cost"] = history.estimate_cost(
+                prompt.pool_key, prompt_tokens, completion_tokens or 0
+            )
+            row["duration_ms"] = history.estimate_duration_ms(prompt.key)
+        rows.append(row)
+    return RunPlan(rows, workers)
@@ -0,0 +1,218 @@
+"""
+Profiling hooks, to find out where a suite spends its own time and memory,
+as opposed to waiting on the network.
+
+The suite wraps its phases (discovery, evaluation, report I/O, output) in
+`section` blocks and every evaluator call in `evaluator_call`. Those are
+no-ops unless a `Profiler` is active, in which case:
+
+* "cpu" mode samples the stacks of the threads currently inside a section,
+  and writes them in the collapsed format that flamegraph.pl, speedscope or
+  inferno take as input
+* "memory" mode uses tracemalloc to measure what each evaluator call
+  allocates, and the top allocation sites over the whole run. Its peak being
+  process-wide, evaluator calls get serialized, and the CLI refuses to
+  combine it with concurrent workers
+
+Both modes time every evaluator call, to build a per-evaluator table.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+PROFILE_MODES = ("cpu", "memory")
+
+active: Optional["Profiler"] = None
+
+
+def section(name: str):
+    """Profile a phase of the run, if a profiler is active"""
+    if active is None:
+        return nullcontext()
+    return active.section(name)
+
+
+def evaluator_call(evaluator):
+    """Measure a single evaluator call, if a profiler is active"""
+    if active is None:
+        return nullcontext()
+    return active.evaluator_call(evaluator)
+
+
+def evaluator_name(evaluator) -> str:
+    name = getattr(evaluator, "__qualname__", None) or type(evaluator).__name__
+    code = getattr(evaluator, "__code__", None)
+    if code is not None:
+        name = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name
+
+
+class EvaluatorStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total_ms = 0.0
+        self.allocated_kb = 0.0
+        self.peak_kb = 0.0
+
+
+class Profiler:
+    """
+    Args:
+        mode (str): "cpu" or "memory".
+        interval (float): Seconds in between two stack samples in "cpu" mode.
+    """
+
+    def __init__(self, mode: str = "cpu", interval: float = 0.005) -> None:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode should be one of {PROFILE_MODES}")
+        self.mode = mode
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.section_ms: Dict[str, float] = defaultdict(float)
+        self.evaluators: Dict[str, EvaluatorStats] = defaultdict(EvaluatorStats)
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        # one evaluator call measured at a time, as each one resets the peak
+        self._memory_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._snapshot_start = None
+        self._snapshot_end = None
+
+    def start(self) -> "Profiler":
+        global active
+        if self.mode == "cpu":
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        else:
+            tracemalloc.start()
+            self._snapshot_start = tracemalloc.take_snapshot()
+        active = self
+        return self
+
+    def stop(self) -> None:
+        global active
+        active = None
+        if self._sampler:
+            self._stopped.set()
+            self._sampler.join()
+        if self.mode == "memory" and tracemalloc.is_tracing():
+            self._snapshot_end = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+    @contextmanager
+    def section(self, name: str):
+        thread_id = threading.get_ident()
+        with self._lock:
+            outer = self._threads.get(thread_id)
+            self._threads[thread_id] = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if not outer:
+                    self.section_ms[name] += (time.perf_counter() - start) * 1000
+                    del self._threads[thread_id]
+                else:
+                    self._threads[thread_id] = outer
+
+    @contextmanager
+    def evaluator_call(self, evaluator):
+        memory = self.mode == "memory" and tracemalloc.is_tracing()
+        with self._memory_lock if memory else nullcontext():
+            with self._measure(evaluator, memory):
+                yield
+
+    @contextmanager
+    def _measure(self, evaluator, memory: bool):
+        stats = self.evaluators[evaluator_name(evaluator)]
+        if memory:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                stats.calls += 1
+                stats.total_ms += elapsed
+                if memory:
+                    current, peak = tracemalloc.get_traced_memory()
+                    stats.allocated_kb += (current - before) / 1024
+                    stats.peak_kb = max(stats.peak_kb, (peak - before) / 1024)
+
+    def _sample(self) -> None:
+        sampler_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            for thread_id, section_name in threads.items():
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    filename = os.path.basename(code.co_filename)
+                    stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(section_name)
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: str) -> None:
+        """write sampled stacks as "frame;frame;frame count" lines"""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def evaluator_rows(self, top: int = 20) -> List[Dict[str, Any]]:
+        rows = []
+        for name, stats in self.evaluators.items():
+            row: Dict[str, Any] = {
+                "evaluator": name,
+                "calls": stats.calls,
+                "total_ms": stats.total_ms,
+                "mean_ms": stats.total_ms / stats.calls if stats.calls else 0,
+            }
+            if self.mode == "memory":
+                row["allocated_kb"] = stats.allocated_kb
+                row["peak_kb"] = stats.peak_kb
+            rows.append(row)
+        sort_key = "peak_kb" if self.mode == "memory" else "total_ms"
+        return sorted(rows, key=lambda r: r[sort_key], reverse=True)[:top]
+
+    def allocation_rows(self, top: int = 20) -> List[Dict[str, Any]]:
+        if not (self._snapshot_start and self._snapshot_end):
+            return []
+        # leave out what modules allocate while being imported
+        filters = [
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ]
+        end = self._snapshot_end.filter_traces(filters)
+        stats = end.compare_to(self._snapshot_start.filter_traces(filters), "lineno")
+        return [
+            {"location": str(stat.traceback), "size_kb": stat.size_diff / 1024, "count": stat.count}
+            for stat in stats[:top]
+        ]
+
+    def summary(self, top: int = 20) -> Dict[str, Any]:
+        d: Dict[str, Any] = {
+            "mode": self.mode,
+            "section_ms": dict(self.section_ms),
+            "evaluators": self.evaluator_rows(top),
+        }
+        if self.mode == "cpu":
+            d["samples"] = sum(self.stacks.values())
+        else:
+            d["allocations"] = self.allocation_rows(top)
+        return d
@@ -1,20 +1,85 @@
+import copy
+import functools
 import os
-from typing import Any, Callable, List, Optional, Union
-
-from langchain.llms import OpenAI
-from langchain.callbacks import get_openai_callback
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Union
 
 from box import Box
 
-from promptimize import utils
+from promptimize import profiling, utils
+from promptimize.coalescing import is_shared
 from promptimize.simple_jinja import process_template
 
+_NOT_PARSED = object()
+
+SCORE_COMBINATIONS = ("mean", "all", "any", "weighted")
+
+
+def format_variant(params: dict) -> str:
+    """a readable identifier for a set of executor params, ie: engine=gpt-4,temperature=0"""
+    return ",".join(f"{k}={v}" for k, v in params.items())
+
+
+@functools.lru_cache(maxsize=None)
+def _usage_handler_class():
+    from langchain.callbacks.openai_info import OpenAICallbackHandler
+
+    class UsageCallbackHandler(OpenAICallbackHandler):
+        """langchain's OpenAI token and cost accounting, plus cached prompt tokens"""
+
+        cached_prompt_tokens: Optional[int] = None
+
+        def on_llm_end(self, response, **kwargs) -> None:
+            super().on_llm_end(response, **kwargs)
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            cached = utils.cached_prompt_tokens(usage)
+            if cached is not None:
+                self.cached_prompt_tokens = (self.cached_prompt_tokens or 0) + cached
+
+    return UsageCallbackHandler
+
+
+@contextmanager
+def usage_callback():
+    """like langchain's `get_openai_callback`, also picking up cached prompt tokens"""
+    from langchain.callbacks.manager import openai_callback_var
+
+    cb = _usage_handler_class()()
+    openai_callback_var.set(cb)
+    try:
+        yield cb
+    finally:
+        openai_callback_var.set(None)
+
+
+def default_model_name() -> str:
+    """the model of the default executor, unless a run says otherwise"""
+    return os.environ.get("OPENAI_MODEL") or "text-davinci-003"
+
+
+def _limited(execute_prompt, limiter):
+    def execute(prompt_str):
+        with limiter:
+            return execute_prompt(prompt_str)
+
+    return execute
+
 
 class BasePromptCase:
     """Abstract base prompt case"""
 
     attributes_used_for_hash = set()
     verbose_attrs = {"prompt"}
+    # callable turning the raw response string into a structured object,
+    # exposed to evaluators through `parsed_response`
+    response_parser: Optional[Callable[[str], Any]] = None
+    # whether to stream the response, required for `stop_checks` to apply
+    stream = False
+    # how evaluator results get combined into a score: mean, all, any or weighted
+    score_combination = "mean"
+    # maps run options to the attribute names langchain LLMs use
+    executor_param_aliases = {"engine": "model_name"}
 
     def __init__(
         self,
@@ -25,6 +90,10 @@ class BasePromptCase:
         prompt_executor: Any = None,
         prompt_executor_kwargs: dict = None,
         prompt_hash=None,
+        response_parser: Optional[Callable[[str], Any]] = None,
+        stream: Optional[bool] = None,
+        stop_checks: Optional[List[Callable]] = None,
+        score_combination: Optional[str] = None,
         *args,
         **kwargs,
     ) -> None:
@@ -39,11 +108,21 @@ class BasePromptCase:
             weight (int, optional): Optional weight for the prompt (default: 1).
             category (Optional[str], optional): Optional category for
                 the prompt (used for info/reporting purposes only).
+            response_parser (Optional[Callable[[str], Any]]): Optional callable
+                used to build `parsed_response`, overriding the class-level one.
+            stream (Optional[bool]): Whether to stream the response, overriding
+                the class-level setting.
+            stop_checks (Optional[List[Callable]]): Checks run against the partial
+                response while streaming, see `promptimize.stop_checks`.
+            score_combination (Optional[str]): How evaluator results combine
+                into the score, one of "mean", "all", "any" or "weighted".
         """
         self.extra_args = args
         self.extra_kwargs = kwargs
         self.response = None
         self.has_run = False
+        # whether the response got reattached from a report, rather than run
+        self.from_report = False
         self.was_tested = False
         self.test_results = None
         self.evaluators = evaluators or []
@@ -51,28 +130,48 @@ class BasePromptCase:
         self.category = category
         self.pre_run_output = None
         self.post_run_output = None
+        self.uses_default_executor = prompt_executor is None
         self.prompt_executor = prompt_executor or self.get_prompt_executor()
         self.prompt_executor_kwargs = prompt_executor_kwargs or {}
+        # the executor params this case was derived with, see `make_variant`
+        self.variant: dict = {}
 
         self._prompt_hash = prompt_hash
 
+        if response_parser:
+            self.response_parser = response_parser
+        self._parsed_response: Any = _NOT_PARSED
+        self._parsed_response_source = None
+
+        if stream is not None:
+            self.stream = stream
+        self.stop_checks = list(stop_checks or [])
+        if score_combination:
+            self.score_combination = score_combination
+        if self.score_combination not in SCORE_COMBINATIONS:
+            raise ValueError(f"score_combination should be one of {SCORE_COMBINATIONS}")
+
         self.execution = Box()
 
         self.prompt = utils.literal_str(self.render()).strip()
 
         self.key = key or "prompt-" + self.prompt_hash
+        # the key before any variant suffix got added
+        self.base_key = self.key
 
         if not utils.is_iterable(self.evaluators):
             self.evaluators = [self.evaluators]  # type: ignore
 
     def get_prompt_executor(self):
-        model_name = os.environ.get("OPENAI_MODEL") or "text-davinci-003"
+        from langchain.llms import OpenAI
+
+        model_name = default_model_name()
         openai_api_key = os.environ.get("OPENAI_API_KEY")
         self.prompt_executor_kwargs = {"model_name": model_name}
         return OpenAI(model_name=model_name, openai_api_key=openai_api_key)
 
     def execute_prompt(self, prompt_str):
-        with get_openai_callback() as cb:
+        with usage_callback() as cb:
             self.response = self.prompt_executor(prompt_str)
         self.execution.openai = Box()
         oai = self.execution.openai
@@ -80,9 +179,176 @@ class BasePromptCase:
         oai.prompt_tokens = cb.prompt_tokens
         oai.completion_tokens = cb.completion_tokens
         oai.total_cost = cb.total_cost
+        if cb.cached_prompt_tokens is not None:
+            oai.cached_prompt_tokens = cb.cached_prompt_tokens
 
         return self.response
 
+    def set_executor_params(self, params: dict) -> None:
+        """
+        Reconfigure the executor with params like engine, temperature or
+        max_tokens. It has to support it as langchain's pydantic LLMs do,
+        through `copy(update=...)`, a ValueError is raised otherwise.
+        """
+        updates = {
+            self.executor_param_aliases.get(k, k): v for k, v in params.items() if v is not None
+        }
+        if not updates:
+            return
+        executor_copy = getattr(self.prompt_executor, "copy", None)
+        if not callable(executor_copy):
+            raise ValueError(
+                f"can't apply {format_variant(params)} to prompt case {self.key}, its "
+                f"{type(self.prompt_executor).__name__} executor has no copy(update=...)"
+            )
+        executor = executor_copy(update=updates)
+        # pydantic's copy() drops fields declared with exclude=True, like
+        # langchain's callbacks, which the LLM needs to be called
+        for name, value in getattr(self.prompt_executor, "__dict__", {}).items():
+            executor.__dict__.setdefault(name, value)
+        self.prompt_executor = executor
+        self.prompt_executor_kwargs = {**self.prompt_executor_kwargs, **updates}
+
+    def clone(self):
+        """
+        A copy of this prompt case that hasn't run, reusing the rendered
+        prompt and its hash, with the same executor until reconfigured.
+        """
+        clone = copy.copy(self)
+        clone._prompt_hash = self.prompt_hash
+        clone.response = None
+        clone.has_run = False
+        clone.from_report = False
+        clone.was_tested = False
+        clone.test_results = None
+        clone.pre_run_output = None
+        clone.post_run_output = None
+        clone.execution = Box()
+        clone._parsed_response = _NOT_PARSED
+        clone._parsed_response_source = None
+        clone.stop_checks = list(self.stop_checks)
+        clone.__dict__.pop("error", None)
+        return clone
+
+    def make_variant(self, params: dict):
+        """
+        Derive a copy of this prompt case running with different executor
+        params, reusing the rendered prompt and its hash.
+        """
+        variant = self.clone()
+        variant.variant = {**self.variant, **params}
+        variant.key = f"{self.key}[{format_variant(params)}]"
+        variant.set_executor_params(params)
+        return variant
+
+    @property
+    def pool_key(self) -> str:
+        """identifies the model/provider, prompt cases are run concurrently per pool"""
+        # the model actually applied to the executor, not just the variant's label
+        return str(
+            self.prompt_executor_kwargs.get("model_name")
+            or getattr(self.prompt_executor, "model_name", None)
+            or type(self.prompt_executor).__name__
+        )
+
+    def stream_prompt(self, prompt_str) -> Iterator[str]:
+        """Yield the response in chunks, as they get generated"""
+        stream = getattr(self.prompt_executor, "stream", None)
+        if stream is None:
+            # executors that can't stream return the whole response at once
+            yield self.prompt_executor(prompt_str)
+            return
+        for chunk in stream(prompt_str):
+            if isinstance(chunk, str):
+                yield chunk
+            else:
+                # raw OpenAI completion chunks, as returned by langchain's OpenAI.stream
+                yield chunk["choices"][0].get("text") or ""
+
+    def add_stop_check(self, check: Callable) -> None:
+        """Register a check that can cancel generation early while streaming"""
+        self.stop_checks.append(check)
+
+    def _check_stop(self, partial_response: str) -> Optional[str]:
+        for check in self.stop_checks:
+            reason = check(self, partial_response)
+            if reason:
+                return reason if isinstance(reason, str) else getattr(check, "__name__", "stop")
+        return None
+
+    def execute_prompt_streaming(self, prompt_str):
+        """
+        Execute the prompt in streaming mode, recording the time to first token
+        and throughput, and stopping early if any of the stop checks says so.
+        """
+        response = ""
+        num_chunks = 0
+        first_chunk_at = None
+        stop_reason = None
+        start_time = time.time()
+        chunks = self.stream_prompt(prompt_str)
+        try:
+            for chunk in chunks:
+                if first_chunk_at is None:
+                    first_chunk_at = time.time()
+                response += chunk
+                num_chunks += 1
+                stop_reason = self._check_stop(response)
+                if stop_reason:
+                    break
+        finally:
+            # closing the generator cancels the underlying request
+            chunks.close()
+        end_time = time.time()
+
+        stream_info = Box()
+        if first_chunk_at is not None:
+            stream_info.time_to_first_token_ms = (first_chunk_at - start_time) * 1000
+            generation_time = end_time - first_chunk_at
+            stream_info.chunks = num_chunks
+            if generation_time > 0:
+                # OpenAI streams roughly one token per chunk
+                stream_info.tokens_per_second = num_chunks / generation_time
+        if stop_reason:
+            stream_info.stopped_early = stop_reason
+        self.execution.stream = stream_info
+
+        self.response = response
+        return self.response
+
+    def parse_response(self, response):
+        """Parse the raw response, by default picking the first JSON object in it"""
+        # looked up on the class so that a plain function doesn't get bound
+        parser = self.__dict__.get("response_parser") or type(self).response_parser
+        if parser:
+            return parser(response)
+        json_objects = utils.extract_json_objects(response, get_first=True)
+        if not json_objects:
+            raise ValueError("No JSON object found in the response")
+        return json_objects[0]
+
+    @property
+    def parsed_response(self):
+        """
+        The response parsed through `parse_response`, computed once and shared
+        by all evaluators. Failures are cached too and yield None, with the
+        error recorded in `execution.parse_error`.
+        """
+        if (
+            self._parsed_response is _NOT_PARSED
+            or self._parsed_response_source is not self.response
+        ):
+            self._parsed_response_source = self.response
+            self.execution.pop("parse_error", None)
+            with utils.MeasureDuration() as md:
+                try:
+                    self._parsed_response = self.parse_response(self.response)
+                except Exception as e:
+                    self._parsed_response = None
+                    self.execution.parse_error = str(e)
+            self.execution.parse_duration_ms = md.duration
+        return self._parsed_response
+
     def pre_run(self):
         pass
 
@@ -119,31 +385,81 @@ class BasePromptCase:
             "weight": self.weight,
             "execution": self.execution.to_dict(),
         }
+        if self.variant:
+            d = utils.insert_in_dict(d, "variant", self.variant, after_key="key")
         if hasattr(self, "error"):
             d["error"] = self.error
         return d
 
-    def print(self, verbose=False, style="yaml"):
-        style = style or "yaml"
+    def to_print_dict(self, verbose=False):
+        """the dict shown when printing the prompt case"""
         output = self.to_dict(verbose)
         if not verbose:
             for attr in self.verbose_attrs:
                 del output[attr]
         if self.weight == 1:
             del output["weight"]
-        highlighted = utils.serialize_object(output, style)
-        print(highlighted)
+        return output
 
-    def test(self):
-        test_results = []
-        for evaluator in self.evaluators:
+    def print(self, verbose=False, style="yaml", highlighted=True):
+        style = style or "yaml"
+        print(utils.serialize_object(self.to_print_dict(verbose), style, highlighted))
+
+    def _is_score_decided(self, result):
+        """whether a single result settles the score, so other evaluators can be skipped"""
+        if self.score_combination == "all":
+            return result != 1
+        if self.score_combination == "any":
+            return result == 1
+        return False
+
+    def combine_results(self, test_results):
+        """combine evaluator results (None for skipped ones) into a score"""
+        ran = [(r, getattr(e, "weight", 1)) for r, e in zip(test_results, self.evaluators)]
+        ran = [(r, w) for r, w in ran if r is not None]
+        if self.score_combination == "all":
+            return 1 if all(r == 1 for r, _ in ran) else 0
+        if self.score_combination == "any":
+            return 1 if any(r == 1 for r, _ in ran) else 0
+        if self.score_combination == "weighted":
+            total_weight = sum(w for _, w in ran)
+            return sum(r * w for r, w in ran) / total_weight if total_weight else 0
+        return sum(r for r, _ in ran) / len(ran)
+
+    def evaluate(self, evaluator, cache=None):
+        """run a single evaluator, going through the `EvaluationCache` if any"""
+        key = None
+        if cache is not None:
+            key = cache.make_key(self, evaluator)
+            result = cache.get(key)
+            if result is not None:
+                return result
+        with profiling.evaluator_call(evaluator):
             result = evaluator(self)
-            if not (utils.is_numeric(result) and 0 <= result <= 1):
-                raise Exception("Value should be between 0 and 1")
-            test_results.append(result)
+        if not (utils.is_numeric(result) and 0 <= result <= 1):
+            raise Exception("Value should be between 0 and 1")
+        if key is not None:
+            cache.set(key, result)
+        return result
+
+    def test(self, cache=None):
+        test_results: List[Optional[float]] = [None] * len(self.evaluators)
+        order = list(range(len(self.evaluators)))
+        if self.score_combination in ("all", "any"):
+            # cheap evaluators first, expensive ones may not need to run at all
+            order.sort(key=lambda i: getattr(self.evaluators[i], "cost", 1))
+
+        with utils.MeasureDuration() as md:
+            for i in order:
+                result = self.evaluate(self.evaluators[i], cache)
+                test_results[i] = result
+                if self._is_score_decided(result):
+                    break
+        self.execution.evaluation_duration_ms = md.duration
 
         if len(test_results):
-            self.execution.score = sum(test_results) / len(test_results)
+            self.execution.score = self.combine_results(test_results)
+            # skipped evaluators show as null
             self.execution.results = test_results
         self.was_tested = True
 
@@ -153,21 +469,73 @@ class BasePromptCase:
             return self._prompt_hash
         return utils.short_hash(hash(self))
 
-    def _run(self, dry_run):
+    def attach_response(self, report_prompt) -> bool:
+        """
+        Reattach a response stored in a report, as if the prompt had just
+        run, so that it can be tested again without calling the API.
+        Returns False if the report entry doesn't match this prompt.
+        """
+        if report_prompt.get("prompt_hash") != self.prompt_hash:
+            return False
+        if report_prompt.get("response") is None or not report_prompt.get("execution"):
+            return False
+        self.response = report_prompt.response
+        self.execution = Box(report_prompt.execution.to_dict())
+        for attr in ("score", "results"):
+            self.execution.pop(attr, None)
+        post_run_output = self.post_run()
+        if post_run_output:
+            self.execution.post_run_output = post_run_output
+        self.has_run = True
+        self.from_report = True
+        return True
+
+    def _prompt_executor(self, stream, limiter=None, hedger=None, token_caps=None):
+        """what executes the prompt, through the hedger, limiter and token caps in use"""
+        execute_prompt = self.execute_prompt_streaming if stream else self.execute_prompt
+        if hedger is not None and not stream:
+            # the hedger goes through the limiter for each of its attempts
+            execute_prompt = functools.partial(hedger.execute, self, limiter=limiter)
+        elif limiter is not None:
+            # only around the call itself, so that coalesced cases waiting
+            # on their leader don't hold on to the budget
+            execute_prompt = _limited(execute_prompt, limiter)
+        if token_caps is not None and not stream:
+            execute_prompt = functools.partial(token_caps.execute, self, execute_prompt)
+        return execute_prompt
+
+    def _run(
+        self, dry_run, stream=None, coalescer=None, limiter=None, hedger=None, token_caps=None
+    ):
         pre_run_output = self.pre_run()
         if pre_run_output:
             self.execution.pre_run_output = pre_run_output
 
+        if stream is None:
+            stream = self.stream
+
         if not dry_run:
+            execute_prompt = self._prompt_executor(stream, limiter, hedger, token_caps)
             with utils.MeasureDuration() as md:
-                self.response = self.execute_prompt(self.prompt).strip()
-
-            self.execution.api_call_duration_ms = md.duration
+                if coalescer is not None and not stream:
+                    response = coalescer.execute(self, execute_prompt)
+                    if token_caps is not None and is_shared(self.execution):
+                        token_caps.record_shared(self)
+                else:
+                    response = execute_prompt(self.prompt)
+                self.response = response.strip()
+
+            if is_shared(self.execution):
+                # waiting on another case's call, not an API latency
+                self.execution.coalesced.waited_ms = md.duration
+            else:
+                self.execution.api_call_duration_ms = md.duration
 
             post_run_output = self.post_run()
             if post_run_output:
                 self.execution.post_run_output = post_run_output
             self.has_run = True
+            self.from_report = False
             self.execution.run_at = utils.current_iso_timestamp()
             return self.response
 
@@ -243,9 +611,13 @@ class LangchainPromptCase(BasePromptCase):
         self,
         langchain_prompt,
         *args,
+        output_parser=None,
         **kwargs,
     ) -> None:
         self.langchain_prompt = langchain_prompt
+        self.output_parser = output_parser
+        if output_parser and not kwargs.get("response_parser"):
+            kwargs["response_parser"] = output_parser.parse
         return super().__init__(*args, **kwargs)
 
     def to_dict(self, verbose=False, *args, **kwargs):
@@ -0,0 +1,274 @@
+"""
+Streaming comparison of two reports, to spot regressions in CI.
+
+Both reports are read one prompt at a time, off the YAML event stream or
+parquet row batches, and merge-joined on their keys, so memory stays constant no matter how many
+prompt cases they hold. Reports are written with their prompts sorted by key;
+older, unsorted reports get sorted through a temporary sqlite database
+instead of being loaded in memory.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import yaml
+
+from promptimize.coalescing import is_shared
+
+STATUSES = ("new", "removed", "prompt_changed", "improved", "regressed", "unchanged")
+
+PromptItem = Tuple[str, Dict[str, Any]]
+
+
+class UnsortedReportError(ValueError):
+    pass
+
+
+# libyaml's parser when available, it's an order of magnitude faster
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def _load_value(loader) -> Any:
+    """build the next value off the event stream, resolving scalars like safe_load does"""
+    event = loader.get_event()
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        return loader.construct_document(yaml.ScalarNode(tag, event.value, style=event.style))
+    if isinstance(event, yaml.MappingStartEvent):
+        mapping = {}
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _load_value(loader)
+            mapping[key] = _load_value(loader)
+        loader.get_event()
+        return mapping
+    if isinstance(event, yaml.SequenceStartEvent):
+        sequence = []
+        while not loader.check_event(yaml.SequenceEndEvent):
+            sequence.append(_load_value(loader))
+        loader.get_event()
+        return sequence
+    raise yaml.YAMLError(f"unexpected {type(event).__name__} in report")
+
+
+def iter_report_prompts(path: str) -> Iterator[PromptItem]:
+    """yield (key, prompt) pairs from a report, without loading it whole"""
+    if str(path).endswith(".parquet"):
+        from promptimize.columnar import iter_parquet_prompts
+
+        return iter_parquet_prompts(path)
+    return _iter_yaml_prompts(path)
+
+
+def _iter_yaml_prompts(path: str) -> Iterator[PromptItem]:
+    with open(path, "r") as f:
+        loader = _Loader(f)
+        try:
+            loader.get_event()
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            loader.get_event()
+            if not loader.check_event(yaml.MappingStartEvent):
+                return
+            loader.get_event()
+            while not loader.check_event(yaml.MappingEndEvent):
+                section = _load_value(loader)
+                if section != "prompts" or not loader.check_event(yaml.MappingStartEvent):
+                    # run_summary and such, small enough to just skip over
+                    _load_value(loader)
+                    continue
+                loader.get_event()
+                while not loader.check_event(yaml.MappingEndEvent):
+                    key = str(_load_value(loader))
+                    yield key, _load_value(loader)
+                loader.get_event()
+        finally:
+            loader.dispose()
+
+
+def _checked_order(items: Iterator[PromptItem], path: str) -> Iterator[PromptItem]:
+    previous = None
+    for key, prompt in items:
+        if previous is not None and key <= previous:
+            raise UnsortedReportError(f"prompts aren't sorted by key in {path}")
+        previous = key
+        yield key, prompt
+
+
+def iter_sorted_prompts(path: str) -> Iterator[PromptItem]:
+    """yield (key, prompt) pairs sorted by key, spilling to a temporary sqlite database"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = sqlite3.connect(os.path.join(tmp, "prompts.db"))
+        try:
+            db.execute("CREATE TABLE prompts (key TEXT PRIMARY KEY, data TEXT)")
+            db.executemany(
+                "INSERT OR REPLACE INTO prompts VALUES (?, ?)",
+                ((k, json.dumps(v, default=str)) for k, v in iter_report_prompts(path)),
+            )
+            # sqlite's binary collation on UTF-8 orders like python's str comparison
+            for key, data in db.execute("SELECT key, data FROM prompts ORDER BY key"):
+                yield key, json.loads(data)
+        finally:
+            db.close()
+
+
+def merge_join(
+    old: Iterator[PromptItem], new: Iterator[PromptItem]
+) -> Iterator[Tuple[str, Optional[dict], Optional[dict]]]:
+    """join two key-sorted streams, yielding (key, old_prompt, new_prompt)"""
+    old_item = next(old, None)
+    new_item = next(new, None)
+    while old_item is not None or new_item is not None:
+        if new_item is None or (old_item is not None and old_item[0] < new_item[0]):
+            yield old_item[0], old_item[1], None  # type: ignore
+            old_item = next(old, None)
+        elif old_item is None or new_item[0] < old_item[0]:
+            yield new_item[0], None, new_item[1]
+            new_item = next(new, None)
+        else:
+            yield old_item[0], old_item[1], new_item[1]
+            old_item = next(old, None)
+            new_item = next(new, None)
+
+
+class _Side:
+    """running totals for one category on one side of the diff"""
+
+    def __init__(self) -> None:
+        self.weight = 0.0
+        self.score = 0.0
+        self.tokens: float = 0
+        self.latency_ms = 0.0
+        self.latency_count = 0
+
+    def add(self, prompt: dict) -> None:
+        execution = prompt.get("execution") or {}
+        weight = prompt.get("weight") or 1
+        if execution.get("score") is not None:
+            self.weight += weight
+            self.score += execution["score"] * weight
+        if not is_shared(execution):
+            self.tokens += (execution.get("openai") or {}).get("total_tokens") or 0
+        # cases that waited on a coalesced call another case made say nothing of latency
+        leader = (execution.get("coalesced") or {}).get("leader")
+        if execution.get("api_call_duration_ms") is not None and leader in (
+            None,
+            prompt.get("key"),
+        ):
+            self.latency_ms += execution["api_call_duration_ms"]
+            self.latency_count += 1
+
+    @property
+    def mean_score(self) -> Optional[float]:
+        return self.score / self.weight if self.weight else None
+
+    @property
+    def mean_latency_ms(self) -> Optional[float]:
+        return self.latency_ms / self.latency_count if self.latency_count else None
+
+
+def _delta(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    return None if old is None or new is None else new - old
+
+
+class ReportDiff:
+    """
+    Classifies prompt keys as they get added and keeps per-category totals,
+    holding on to at most `max_keys` example keys per status.
+
+    Args:
+        tolerance (float): Score changes up to this much are considered unchanged.
+        max_keys (int): How many keys to keep for each status, for display.
+    """
+
+    def __init__(self, tolerance: float = 0.0, max_keys: int = 100) -> None:
+        self.tolerance = tolerance
+        self.max_keys = max_keys
+        self.counts = {status: 0 for status in STATUSES}
+        self.keys: Dict[str, List[str]] = {status: [] for status in STATUSES}
+        self.categories: Dict[str, Tuple[_Side, _Side]] = defaultdict(lambda: (_Side(), _Side()))
+
+    @staticmethod
+    def _score(prompt: dict) -> Optional[float]:
+        return (prompt.get("execution") or {}).get("score")
+
+    def classify(self, old: Optional[dict], new: Optional[dict]) -> str:
+        if old is None:
+            return "new"
+        if new is None:
+            return "removed"
+        if old.get("prompt_hash") != new.get("prompt_hash"):
+            return "prompt_changed"
+        old_score, new_score = self._score(old), self._score(new)
+        if old_score is None or new_score is None:
+            return "unchanged"
+        if new_score > old_score + self.tolerance:
+            return "improved"
+        if new_score < old_score - self.tolerance:
+            return "regressed"
+        return "unchanged"
+
+    def add(self, key: str, old: Optional[dict], new: Optional[dict]) -> str:
+        status = self.classify(old, new)
+        self.counts[status] += 1
+        if len(self.keys[status]) < self.max_keys:
+            self.keys[status].append(key)
+        category = str((new or old or {}).get("category") or "-")
+        old_side, new_side = self.categories[category]
+        if old is not None:
+            old_side.add(old)
+        if new is not None:
+            new_side.add(new)
+        return status
+
+    @property
+    def has_regressions(self) -> bool:
+        return self.counts["regressed"] > 0
+
+    def category_rows(self) -> List[Dict[str, Any]]:
+        rows = []
+        for category, (old, new) in sorted(self.categories.items()):
+            rows.append(
+                {
+                    "category": category,
+                    "old_score": old.mean_score,
+                    "new_score": new.mean_score,
+                    "score_delta": _delta(old.mean_score, new.mean_score),
+                    "old_tokens": old.tokens,
+                    "new_tokens": new.tokens,
+                    "tokens_delta": new.tokens - old.tokens,
+                    "old_latency_ms": old.mean_latency_ms,
+                    "new_latency_ms": new.mean_latency_ms,
+                    "latency_delta_ms": _delta(old.mean_latency_ms, new.mean_latency_ms),
+                }
+            )
+        return rows
+
+
+def _join(diff: ReportDiff, old: Iterator[PromptItem], new: Iterator[PromptItem]) -> ReportDiff:
+    for key, old_prompt, new_prompt in merge_join(old, new):
+        diff.add(key, old_prompt, new_prompt)
+    return diff
+
+
+def diff_reports(
+    old_path: str, new_path: str, tolerance: float = 0.0, max_keys: int = 100
+) -> ReportDiff:
+    """Stream and compare two reports"""
+    try:
+        return _join(
+            ReportDiff(tolerance, max_keys),
+            _checked_order(iter_report_prompts(old_path), old_path),
+            _checked_order(iter_report_prompts(new_path), new_path),
+        )
+    except UnsortedReportError:
+        # a report from before prompts got sorted, start over sorting both on disk
+        return _join(
+            ReportDiff(tolerance, max_keys),
+            iter_sorted_prompts(old_path),
+            iter_sorted_prompts(new_path),
+        )
@@ -1,9 +1,10 @@
+import os
+
 import yaml
 from box import Box
 
-import pandas as pd
-
 from promptimize import utils
+from promptimize.blob_store import TEXT_FIELDS, BlobStore, is_blob_ref, referenced_chunks
 
 
 class Report:
@@ -11,26 +12,101 @@ class Report:
 
     version = "0.1.0"
 
-    def __init__(self, path=None, data=None):
+    def __init__(self, path=None, data=None, table=None):
         self.data = Box()
         if data:
             self.data = Box(data)
         self.path = path
-
-    def write(self, path=None, style="yaml"):
-        """write the report to the filesystem"""
+        # the Arrow table the report was read from, see `from_parquet`
+        self.table = table
+        # where the prompt/response texts live when stored as blobs, see `write`
+        self.blob_store = None
+
+    def _materialize(self):
+        """build the nested data out of the Arrow table, when first needed"""
+        if not self.data and self.table is not None:
+            from promptimize.columnar import table_to_report_data
+
+            self.data = Box(table_to_report_data(self.table))
+
+    def write(self, path=None, style="yaml", storage=None, compression="gzip"):
+        """
+        write the report to the filesystem, as parquet if the path ends with .parquet
+
+        Args:
+            storage (str): "inline" keeps prompt and response texts in the report,
+                "blobs" stores them deduplicated and compressed in `<path>.blobs`.
+                Defaults to the way the report was read.
+            compression (str): "gzip" or "zstd", for texts stored as blobs.
+        """
         path = path or self.path
+        if str(path).endswith(".parquet"):
+            self.write_parquet(path)
+            return
+        if storage is None:
+            storage = "blobs" if self.blob_store else "inline"
+        store = None
+        if storage == "blobs":
+            store = BlobStore(path + ".blobs", compression)
+            if store.same_as(self.blob_store):
+                store = self.blob_store
+        data = self._export_data(store)
+        if store:
+            store.write_index()
+            data["blob_store"] = os.path.basename(store.path)
         with open(path, "w") as f:
-            f.write(utils.serialize_object(self.data.to_dict(), highlighted=False, style=style))
+            f.write(utils.serialize_object(data, highlighted=False, style=style))
+        if store:
+            # once the report doesn't reference the dropped chunks anymore
+            store.collect(referenced_chunks((data.get("prompts") or {}).values()))
+
+    def _export_data(self, store=None):
+        """the report's data with texts in `store`, or inline if no store is given"""
+        self._materialize()
+        data = self.data.to_dict()
+        data.pop("blob_store", None)
+        if data.get("prompts"):
+            # sorted by key, so that reports can be diffed as streams
+            data["prompts"] = dict(sorted(data["prompts"].items()))
+            for prompt in data["prompts"].values():
+                for field in TEXT_FIELDS:
+                    if prompt.get(field) is not None:
+                        prompt[field] = self._export_text(prompt[field], store)
+        return data
+
+    def _export_text(self, value, store):
+        if is_blob_ref(value):
+            if store is None:
+                return self.blob_store.get(value)
+            if store is not self.blob_store:
+                store.copy_from(self.blob_store, value)
+            return value
+        if store is not None and isinstance(value, str):
+            return store.put(value)
+        return value
+
+    def _resolve_texts(self, prompt):
+        """replace blob references by the actual texts, in place"""
+        if self.blob_store and prompt:
+            for field in TEXT_FIELDS:
+                if is_blob_ref(prompt.get(field)):
+                    prompt[field] = self.blob_store.get(prompt[field])
+        return prompt
 
     def merge(self, report):
         """merge in another report into this one"""
+        if self.blob_store is None:
+            self.blob_store = report.blob_store
+        foreign_blobs = report.blob_store and not report.blob_store.same_as(self.blob_store)
         all_keys = set(report.prompts.keys()) | set(self.prompts.keys())
         for k in all_keys:
             a = report.prompts.get(k)
             b = self.prompts.get(k)
+            if a and foreign_blobs:
+                # references only make sense within their own store
+                a = report._resolve_texts(a)
             if a and b:
-                if a.execution.get("run_at", "") > b.execution.get("run_at", ""):
+                if self._version(a) > self._version(b):
                     self.prompts[k] = a
                 else:
                     self.prompts[k] = b
@@ -40,9 +116,29 @@ class Report:
             elif not b:
                 self.prompts[k] = a
 
+    @staticmethod
+    def _version(prompt):
+        """the most recent run wins, then the most recent human review of that run"""
+        execution = prompt.execution
+        review = execution.get("review") or {}
+        return execution.get("run_at", ""), review.get("reviewed_at", "")
+
+    def to_arrow(self):
+        """flatten the prompts into a typed Arrow table"""
+        from promptimize.columnar import report_to_table
+
+        return report_to_table(self._export_data())
+
+    def write_parquet(self, path=None):
+        """write the report as a parquet file"""
+        from promptimize.columnar import write_parquet
+
+        write_parquet(self.to_arrow(), path or self.path)
+
     @property
     def prompts(self):
         """list the prompts in this report"""
+        self._materialize()
         if self.data:
             return self.data.prompts
         return {}
@@ -59,13 +155,34 @@ class Report:
     @classmethod
     def from_path(cls, path):
         """load a report object from a path in the filesystem"""
+        if str(path).endswith(".parquet"):
+            try:
+                return cls.from_parquet(path)
+            except FileNotFoundError:
+                return None
         try:
             with open(path, "r") as f:
-                report = cls(path, yaml.safe_load(f))
+                # libyaml's loader when available, it's an order of magnitude faster
+                report = cls(
+                    path, yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+                )
+            if report.data.get("blob_store"):
+                blob_path = os.path.join(os.path.dirname(path), report.data.blob_store)
+                report.blob_store = BlobStore(blob_path)
             return report
         except FileNotFoundError:
             return None
 
+    @classmethod
+    def from_parquet(cls, path, columns=None, memory_map=True):
+        """
+        load a report object from a parquet file, memory-mapped by default so
+        that only the columns being used get read
+        """
+        from promptimize.columnar import read_parquet
+
+        return cls(path, table=read_parquet(path, columns=columns, memory_map=memory_map))
+
     @classmethod
     def from_suite(cls, suite):
         """load a report object from a suite instance"""
@@ -73,22 +190,39 @@ class Report:
         return report
 
     def get_prompt(self, prompt_key):
-        """get a specific prompt data structure from the report"""
-        return self.prompts.get(prompt_key)
+        """get a specific prompt data structure from the report, with its texts"""
+        return self._resolve_texts(self.prompts.get(prompt_key))
 
     def prompt_df(self):
         """make a flat pandas dataframe out of the prompts in the reports"""
+        import pandas as pd
+
         prompts = [p for p in self.prompts.values() if p.execution]
         return pd.json_normalize(prompts)
 
+    def score_df(self, groupby=None):
+        """a dataframe with the weight and score of the prompts that ran, and the groupby column"""
+        columns = [c for c in (groupby, "weight", "score") if c]
+        if self.table is not None and not self.data:
+            # straight from the columns, without building the nested data,
+            # struct columns flattened as "variant.engine" and such
+            table = self.table.flatten()
+            df = table.select(list(dict.fromkeys(columns + ["run_at"]))).to_pandas()
+            df = df[df["score"].notna() | df["run_at"].notna()]
+            if groupby and hasattr(df[groupby], "cat"):
+                df[groupby] = df[groupby].astype(object)
+            return df[columns]
+        df = self.prompt_df()
+        return df.rename(columns={"execution.score": "score"})[columns]
+
     def print_summary(self, groupby="category"):
         """print the summary from the report"""
         if groupby:
             self.print_summary(groupby=None)
 
-        df = self.prompt_df()
+        df = self.score_df(groupby)
 
-        df["score"] = df["weight"] * df["execution.score"]
+        df["score"] = df["weight"] * df["score"]
 
         if groupby:
             df = df[[groupby, "weight", "score"]].groupby(groupby).sum()
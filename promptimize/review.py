@@ -0,0 +1,74 @@
+"""
+Human review of the prompt cases stored in a report.
+
+Running with `--human` doesn't stop for a person after each prompt case
+anymore: executed cases get queued for review in the report
+(`execution.review.status: pending`) and the run goes on at full speed.
+`promptimize review <report>` then steps through the queue, out of band.
+
+Reviews are saved by merging into a fresh read of the report with
+`Report.merge`, so that a report updated by a run in the meantime keeps its
+newer results; a review only lands if the response it was made on is still
+the latest one.
+"""
+from typing import Dict, List, Optional, Sequence
+
+from box import Box
+
+from promptimize import utils
+from promptimize.reports import Report
+
+PENDING = "pending"
+REVIEWED = "reviewed"
+
+
+def queue_for_review(execution: Box) -> None:
+    execution.review = Box(status=PENDING)
+
+
+def review_status(prompt) -> Optional[str]:
+    return ((prompt.get("execution") or {}).get("review") or {}).get("status")
+
+
+def select_prompts(
+    report: Report,
+    pending: bool = True,
+    failed: bool = False,
+    keys: Sequence[str] = (),
+    category: Optional[str] = None,
+) -> List[str]:
+    """the keys of the prompts to review, in key order"""
+    selected = []
+    for key, prompt in sorted(report.prompts.items()):
+        execution = prompt.get("execution") or {}
+        if pending and review_status(prompt) != PENDING:
+            continue
+        if failed and execution.get("score", 0) >= 1:
+            continue
+        if keys and key not in keys:
+            continue
+        if category and prompt.get("category") != category:
+            continue
+        selected.append(key)
+    return selected
+
+
+def record_review(prompt, score: Optional[float] = None) -> None:
+    """mark a prompt as reviewed, overriding its score if one is given"""
+    execution = prompt.execution
+    if score is not None:
+        execution.score = score
+        execution.human_override = True
+    execution.review = Box(status=REVIEWED, reviewed_at=utils.current_iso_timestamp())
+
+
+def save_reviews(path: str, reviewed: Dict[str, Box], style: str = "yaml") -> Report:
+    """merge the reviewed prompts into the report as it is now on disk, and write it"""
+    current = Report.from_path(path) or Report(path)
+    current._materialize()
+    data = current.data.to_dict()
+    data["prompts"] = {key: prompt.to_dict() for key, prompt in reviewed.items()}
+    report = Report(path, data)
+    report.merge(current)
+    report.write(path, style=style)
+    return report
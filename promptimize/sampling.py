@@ -0,0 +1,115 @@
+"""
+Sequential sampling, to estimate a suite score to a target precision
+without running every prompt case.
+
+Prompt cases are visited in a stratified random order (strata being
+categories, allocated proportionally to their total weight) while a running
+weighted estimate of the suite score and its confidence interval get updated
+after every result. The run can stop as soon as the interval is narrow enough.
+"""
+import math
+import random
+from collections import defaultdict
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional
+
+
+def stratified_order(prompts: List[Any], seed: Optional[int] = None) -> List[Any]:
+    """
+    Order prompt cases so that any prefix of the result is a stratified
+    sample: categories are interleaved proportionally to their total
+    weight, and cases are shuffled within each category.
+    """
+    rng = random.Random(seed)
+    strata: Dict[Any, List[Any]] = defaultdict(list)
+    for prompt in prompts:
+        strata[prompt.category].append(prompt)
+    for stratum in strata.values():
+        rng.shuffle(stratum)
+
+    total_weights = {k: sum(p.weight for p in v) for k, v in strata.items()}
+    taken_weights = {k: 0.0 for k in strata}
+    positions = {k: 0 for k in strata}
+    ordered = []
+    while len(ordered) < len(prompts):
+        # pick the category that is the most behind its fair share
+        category = min(
+            (k for k in strata if positions[k] < len(strata[k])),
+            key=lambda k: taken_weights[k] / total_weights[k] if total_weights[k] else 0,
+        )
+        prompt = strata[category][positions[category]]
+        positions[category] += 1
+        taken_weights[category] += prompt.weight
+        ordered.append(prompt)
+    return ordered
+
+
+class WeightedScoreEstimator:
+    """
+    Running weighted mean of scores with a normal-approximation confidence
+    interval, corrected for sampling without replacement from a finite
+    population of prompt cases.
+
+    Args:
+        population (int): The number of prompt cases that could be sampled.
+        confidence (float): The confidence level of the interval. Defaults to 0.95.
+        min_samples (int): The interval is considered unbounded until this
+            many scores were added. Defaults to 10.
+    """
+
+    def __init__(self, population: int, confidence: float = 0.95, min_samples: int = 10):
+        self.population = population
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.n = 0
+        self.sum_w = 0.0
+        self.sum_w2 = 0.0
+        self.sum_ws = 0.0
+        self.sum_ws2 = 0.0
+
+    def add(self, score: float, weight: float = 1) -> None:
+        self.n += 1
+        self.sum_w += weight
+        self.sum_w2 += weight * weight
+        self.sum_ws += weight * score
+        self.sum_ws2 += weight * score * score
+
+    @property
+    def estimate(self) -> Optional[float]:
+        if not self.sum_w:
+            return None
+        return self.sum_ws / self.sum_w
+
+    @property
+    def half_width(self) -> float:
+        """half the width of the confidence interval, inf if not known yet"""
+        if self.n < max(self.min_samples, 2):
+            return math.inf
+        if self.n >= self.population:
+            return 0.0
+        # Agresti-Coull style: add z²/2 pseudo-scores at both 0 and 1 so that a
+        # handful of identical scores doesn't look like zero variance
+        k = self.z * self.z / 2 * self.sum_w / self.n
+        mean = (self.sum_ws + k) / (self.sum_w + 2 * k)
+        variance = max((self.sum_ws2 + k) / (self.sum_w + 2 * k) - mean * mean, 0.0)
+        effective_n = self.sum_w * self.sum_w / self.sum_w2
+        fpc = (self.population - self.n) / (self.population - 1)
+        return self.z * math.sqrt(variance / effective_n * fpc)
+
+    def has_reached(self, target_half_width: float) -> bool:
+        return self.half_width <= target_half_width
+
+    def to_dict(self) -> Dict[str, Any]:
+        estimate = self.estimate
+        half_width = self.half_width
+        ci = None
+        if estimate is not None and not math.isinf(half_width):
+            ci = [max(estimate - half_width, 0.0), min(estimate + half_width, 1.0)]
+        return {
+            "estimate": estimate,
+            "ci": ci,
+            "confidence": self.confidence,
+            "sampled": self.n,
+            "population": self.population,
+        }
@@ -0,0 +1,496 @@
+"""
+A long-running evaluation server, taking runs as jobs over a small JSON API.
+
+Starting a run from the CLI pays for the heavy imports, discovering and
+importing the suite's modules, and parsing the report, every time. The
+server pays for those once: modules are kept imported and only reloaded when
+their source changes (prompt cases and their executors, with their HTTP
+connection pools, stay alive in between jobs), compiled templates are cached,
+and reports are kept parsed in memory until their file changes on disk.
+
+Jobs run concurrently, sharing a single budget of in-flight API calls and
+requests per minute. `FairScheduler` hands the budget out to the job with
+the fewest calls in flight, so that a large suite doesn't starve the small
+ones submitted after it.
+
+    POST   /jobs              {"path": "examples/", "output": "report.yaml", ...}
+    GET    /jobs              list the jobs
+    GET    /jobs/<id>         status and progress of a job
+    GET    /jobs/<id>/report  the report of a finished job
+    DELETE /jobs/<id>         cancel a job
+    GET    /health
+"""
+import importlib
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from promptimize import crawler, planning
+from promptimize.metrics import RunMetrics
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+DEFAULT_JOB_PARAMS: Dict[str, Any] = {
+    "path": None,
+    "output": None,
+    "style": "yaml",
+    "engine": None,
+    "max_tokens": 1000,
+    "temperature": 0.5,
+    "force": False,
+    "repair": False,
+    "keys": [],
+    "limit": 0,
+    "workers": 4,
+    "target_ci": 0,
+    "confidence": 0.95,
+    "stream": None,
+    "coalesce": True,
+    "order": "declared",
+    "time_budget": 0,
+    "hedge": 0,
+    "adaptive_max_tokens": False,
+}
+
+_JOB_PATH = re.compile(r"^/jobs/(?P<id>[\w-]+)(?P<report>/report)?$")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def parse_job_params(body: Dict[str, Any]) -> Dict[str, Any]:
+    """validate the params of a submitted job, filling in the defaults"""
+    unknown = set(body) - set(DEFAULT_JOB_PARAMS)
+    if unknown:
+        raise ValueError(f"unknown params: {', '.join(sorted(unknown))}")
+    params = {**DEFAULT_JOB_PARAMS, **body}
+    if not params["path"] or not os.path.exists(params["path"]):
+        raise ValueError(f"path doesn't exist: {params['path']}")
+    if params["style"] not in ("json", "yaml"):
+        raise ValueError("style should be json or yaml")
+    if params["order"] not in planning.ORDERS:
+        raise ValueError(f"order should be one of {planning.ORDERS}")
+    if params["hedge"] and not 0 < params["hedge"] < 100:
+        raise ValueError("hedge should be a percentile, in between 0 and 100")
+    if isinstance(params["keys"], str):
+        params["keys"] = [params["keys"]]
+    return params
+
+
+class FairScheduler:
+    """
+    A budget of concurrent API calls and requests per minute, shared by jobs.
+
+    When the budget frees up, it goes to the waiting job with the fewest
+    calls in flight, ties going to the job served least recently.
+
+    Args:
+        max_concurrency (int): API calls in flight across all jobs.
+        rpm (int): API calls started per minute across all jobs, 0 for no limit.
+    """
+
+    def __init__(self, max_concurrency: int = 8, rpm: int = 0) -> None:
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self._cond = threading.Condition()
+        self.in_flight: Dict[str, int] = {}
+        self._waiting: Dict[str, int] = {}
+        self._last_granted: Dict[str, float] = {}
+        # a token bucket holding about a second's worth of requests
+        self._capacity = max(rpm / 60, 1.0)
+        self._tokens = self._capacity
+        self._refilled_at = time.monotonic()
+
+    def _next_job(self) -> Optional[str]:
+        if sum(self.in_flight.values()) >= self.max_concurrency or not self._waiting:
+            return None
+        return min(
+            self._waiting,
+            key=lambda j: (self.in_flight.get(j, 0), self._last_granted.get(j, 0.0)),
+        )
+
+    def _take_token(self) -> float:
+        """take a request token, or return how long until there is one"""
+        if not self.rpm:
+            return 0
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._refilled_at) * self.rpm / 60)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) * 60 / self.rpm
+
+    def acquire(self, job_id: str, cancelled: Optional[threading.Event] = None) -> None:
+        with self._cond:
+            self._waiting[job_id] = self._waiting.get(job_id, 0) + 1
+            try:
+                while True:
+                    if cancelled is not None and cancelled.is_set():
+                        raise JobCancelled(job_id)
+                    if self._next_job() == job_id:
+                        wait = self._take_token()
+                        if not wait:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        # woken up on release, or to check for cancellation
+                        self._cond.wait(0.5)
+            finally:
+                self._waiting[job_id] -= 1
+                if not self._waiting[job_id]:
+                    del self._waiting[job_id]
+            self.in_flight[job_id] = self.in_flight.get(job_id, 0) + 1
+            self._last_granted[job_id] = time.monotonic()
+
+    def release(self, job_id: str) -> None:
+        with self._cond:
+            self.in_flight[job_id] -= 1
+            if not self.in_flight[job_id]:
+                del self.in_flight[job_id]
+            self._cond.notify_all()
+
+    def forget(self, job_id: str) -> None:
+        with self._cond:
+            self._last_granted.pop(job_id, None)
+            self._cond.notify_all()
+
+    def for_job(self, job: "Job") -> "_JobSlot":
+        """a context manager holding a slot for one of the job's API calls"""
+        return _JobSlot(self, job)
+
+
+class _JobSlot:
+    # holds no state of its own, the same instance gets entered from many threads
+    def __init__(self, scheduler: FairScheduler, job: "Job") -> None:
+        self.scheduler = scheduler
+        self.job = job
+
+    def __enter__(self) -> None:
+        self.scheduler.acquire(self.job.id, self.job.cancelled)
+
+    def __exit__(self, *exc_info) -> None:
+        self.scheduler.release(self.job.id)
+
+
+class Job:
+    """A run submitted to the server, and what's known about its progress"""
+
+    def __init__(self, params: Dict[str, Any]) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.metrics = RunMetrics()
+        self.total = 0
+        self.summary: Optional[Dict[str, Any]] = None
+        self.report = None
+        self.cancelled = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": {
+                "total": self.total,
+                "started": self.metrics.total("promptimize_cases_started_total"),
+                "completed": self.metrics.total("promptimize_cases_completed_total"),
+                "failed": self.metrics.total("promptimize_cases_failed_total"),
+                "skipped": self.metrics.total("promptimize_cases_skipped_total"),
+                "tokens": self.metrics.total("promptimize_tokens_total"),
+            },
+            "summary": self.summary,
+            "error": self.error,
+        }
+
+
+class EvaluationServer:
+    """
+    Serve the job API from a background thread.
+
+    Args:
+        port (int): The port to listen on, 0 picks a free one.
+        max_jobs (int): How many jobs run at the same time, others wait in line.
+        max_concurrency (int): API calls in flight, shared by all running jobs.
+        rpm (int): API calls per minute, shared by all running jobs, 0 for no limit.
+        max_history (int): How many finished jobs to keep around.
+    """
+
+    def __init__(
+        self,
+        port: int = 8090,
+        host: str = "127.0.0.1",
+        max_jobs: int = 4,
+        max_concurrency: int = 8,
+        rpm: int = 0,
+        max_history: int = 100,
+    ) -> None:
+        self.scheduler = FairScheduler(max_concurrency, rpm)
+        self.max_history = max_history
+        self.jobs: Dict[str, Job] = {}
+        self._runner = ThreadPoolExecutor(
+            max_workers=max_jobs, thread_name_prefix="promptimize-job"
+        )
+        self._lock = threading.Lock()
+        self._path_locks: Dict[str, threading.Lock] = {}
+        self._mtimes: Dict[str, Optional[int]] = {}
+        self._reports: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self, "GET")
+
+            def do_POST(self):
+                server._handle(self, "POST")
+
+            def do_DELETE(self):
+                server._handle(self, "DELETE")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "EvaluationServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        for job in list(self.jobs.values()):
+            job.cancelled.set()
+        self._runner.shutdown(wait=True)
+
+    # --- jobs
+
+    def submit(self, body: Dict[str, Any]) -> Job:
+        job = Job(parse_job_params(body))
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+        self._runner.submit(self._run_job, job)
+        return job
+
+    def cancel(self, job: Job) -> None:
+        job.cancelled.set()
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = time.time()
+
+    def _prune(self) -> None:
+        finished = [j for j in self.jobs.values() if j.finished]
+        for job in sorted(finished, key=lambda j: j.finished_at or 0)[: -self.max_history or None]:
+            del self.jobs[job.id]
+            self.scheduler.forget(job.id)
+
+    def _lock_for(self, path: str) -> threading.Lock:
+        """
+        jobs on the same suite share its modules, which may get reloaded, and
+        jobs on the same report write to it, so those steps happen one at a time
+        """
+        with self._lock:
+            return self._path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+    def _run_job(self, job: Job) -> None:
+        if job.cancelled.is_set():
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            suite = self._execute(job)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+            suite = None
+        except Exception:
+            job.status = "failed"
+            job.error = traceback.format_exc()
+            suite = None
+        finally:
+            job.finished_at = time.time()
+        if suite is not None:
+            job.summary = suite._serialize_run_summary()
+
+    def _execute(self, job: Job):
+        from promptimize.prompt_cases import default_model_name
+        from promptimize.reports import Report
+        from promptimize.suite import Suite
+
+        params = job.params
+        report = self._load_report(params["output"])
+        with self._lock_for(params["path"]):
+            # clones, the module's prompt cases staying as imported from one job to the next
+            suite = Suite([p.clone() for p in self._load_prompts(params["path"])])
+        executor_params = {k: params[k] for k in ("engine", "max_tokens", "temperature")}
+        executor_params["engine"] = params["engine"] or default_model_name()
+        suite.apply_executor_params(executor_params)
+        suite.reload_effective_prompts(
+            report=report, keys=params["keys"], repair=params["repair"], limit=params["limit"]
+        )
+        job.total = len(suite.effective_prompts)
+        suite.execute(
+            silent=True,
+            report=report,
+            keys=params["keys"],
+            force=params["force"],
+            repair=params["repair"],
+            limit=params["limit"],
+            stream=params["stream"],
+            target_ci=params["target_ci"],
+            confidence=params["confidence"],
+            workers=params["workers"],
+            metrics=job.metrics,
+            coalesce=params["coalesce"],
+            order=params["order"],
+            time_budget=params["time_budget"],
+            hedge=params["hedge"],
+            adaptive_max_tokens=params["adaptive_max_tokens"],
+            limiter=self.scheduler.for_job(job),
+        )
+        output_report = Report.from_suite(suite)
+        if params["output"]:
+            with self._lock_for(params["output"]):
+                # other jobs may have written to the report since this one started
+                report = self._load_report(params["output"])
+                if report:
+                    output_report.merge(report)
+                output_report.write(params["output"], style=params["style"])
+                planning.update_history_index(params["output"], suite)
+                self._cache_report(params["output"], output_report)
+        job.report = output_report
+        return suite
+
+    # --- warm caches
+
+    def _load_prompts(self, path: str) -> List[Any]:
+        """the suite's prompt cases, reloading the modules whose source changed"""
+        from promptimize.prompt_cases import BasePromptCase
+
+        modules = crawler.discover_modules(path, isolated=True)
+        changed = []
+        for module in modules:
+            mtime = crawler.module_mtime(module)
+            if self._mtimes.setdefault(module.__file__, mtime) != mtime:  # type: ignore
+                self._mtimes[module.__file__] = mtime  # type: ignore
+                changed.append(module)
+        if changed:
+            names = {m.__name__ for m in changed}
+            for module in modules:
+                if module in changed or crawler.module_references(module, names):
+                    importlib.reload(module)
+        prompts = []
+        for module in modules:
+            prompts += crawler.objects_in_module(module, BasePromptCase)
+        return prompts
+
+    @staticmethod
+    def _file_version(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _cache_report(self, path: str, report) -> None:
+        version = self._file_version(path)
+        if version is not None:
+            self._reports[os.path.abspath(path)] = (version, report)
+
+    def _load_report(self, path: Optional[str]):
+        """a parsed report, reused for as long as its file doesn't change"""
+        from promptimize.reports import Report
+
+        if not path:
+            return None
+        cached = self._reports.get(os.path.abspath(path))
+        if cached and cached[0] == self._file_version(path):
+            return cached[1]
+        report = Report.from_path(path)
+        if report is not None:
+            self._cache_report(path, report)
+        return report
+
+    # --- HTTP
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str) -> None:
+        try:
+            status, payload = self._route(handler, method)
+        except ValueError as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception:
+            status, payload = 500, {"error": traceback.format_exc()}
+        data = json.dumps(payload, default=str).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _route(self, handler: BaseHTTPRequestHandler, method: str) -> Tuple[int, Any]:
+        path = handler.path.split("?")[0].rstrip("/")
+        if path == "/health" and method == "GET":
+            running = sum(1 for j in list(self.jobs.values()) if j.status == "running")
+            return 200, {"status": "ok", "running_jobs": running}
+        if path == "/jobs" and method == "POST":
+            return 202, self.submit(_read_json(handler)).to_dict()
+        if path == "/jobs" and method == "GET":
+            return 200, [j.to_dict() for j in list(self.jobs.values())]
+        match = _JOB_PATH.match(path)
+        if match:
+            job = self.jobs.get(match.group("id"))
+            if job is None:
+                return 404, {"error": f"no such job: {match.group('id')}"}
+            return self._route_job(job, method, bool(match.group("report")))
+        return 404, {"error": f"no route for {method} {path}"}
+
+    def _route_job(self, job: Job, method: str, report: bool) -> Tuple[int, Any]:
+        if report and method == "GET":
+            if job.report is None:
+                return 409, {"error": f"job is {job.status}, no report to serve"}
+            return 200, job.report._export_data()
+        if not report and method == "GET":
+            return 200, job.to_dict()
+        if not report and method == "DELETE":
+            self.cancel(job)
+            return 200, job.to_dict()
+        return 405, {"error": f"{method} isn't supported here"}
+
+
+def _read_json(handler: BaseHTTPRequestHandler) -> Dict[str, Any]:
+    length = int(handler.headers.get("Content-Length") or 0)
+    try:
+        body = json.loads(handler.rfile.read(length) or b"{}")
+    except ValueError:
+        raise ValueError("body isn't valid JSON")
+    if not isinstance(body, dict):
+        raise ValueError("body should be a JSON object")
+    return body
@@ -1,8 +1,16 @@
+import functools
+
 import jinja2
 
 environment = jinja2.Environment()
 
 
+@functools.lru_cache(maxsize=256)
+def compile_template(template_as_string):
+    """compiling is the expensive part, and prompt cases tend to share templates"""
+    return environment.from_string(template_as_string)
+
+
 def process_template(template_as_string, **kwargs):
-    template = environment.from_string(template_as_string)
+    template = compile_template(template_as_string)
     return template.render(**kwargs)
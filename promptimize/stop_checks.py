@@ -0,0 +1,44 @@
+"""
+Stop checks that can be registered on prompt cases executed in streaming mode.
+
+A stop check is a callable receiving the prompt case and the partial response
+generated so far. It returns a falsy value to let generation continue, or a
+truthy value (ideally a short string describing why) to cancel it early,
+saving both latency and completion tokens.
+"""
+from typing import Callable, Optional
+
+
+def max_length(max_chars: int) -> Callable:
+    """Stop generating once the response exceeds `max_chars` characters"""
+
+    def check(prompt_case, partial_response: str) -> Optional[str]:
+        if len(partial_response) > max_chars:
+            return f"max_length({max_chars})"
+        return None
+
+    return check
+
+
+def evaluator_failed(evaluator: Callable, threshold: float = 0) -> Callable:
+    """
+    Stop generating once an evaluator scores the partial response at or
+    below `threshold`.
+
+    Only use this with evaluators whose failure can't be undone by more
+    text, for instance "the response must not mention X" or "the response
+    must start with SELECT".
+    """
+
+    def check(prompt_case, partial_response: str) -> Optional[str]:
+        response = prompt_case.response
+        prompt_case.response = partial_response
+        try:
+            score = evaluator(prompt_case)
+        finally:
+            prompt_case.response = response
+        if score <= threshold:
+            return f"evaluator_failed({getattr(evaluator, '__name__', 'evaluator')})"
+        return None
+
+    return check
@@ -0,0 +1,383 @@
+"""
+A local stand-in for the OpenAI completion API, to load-test suites end to
+end (HTTP client, retries, rate limiting, connection pooling, token
+accounting) on a single machine with no network.
+
+It serves `/v1/completions` and `/v1/chat/completions`, streamed or not,
+with configurable latency distributions, request throttling (429 with a
+`Retry-After` header), random error injection, and `usage` payloads that
+langchain's `get_openai_callback` picks up. Point the executor at it with:
+
+    export OPENAI_API_BASE=http://127.0.0.1:8089/v1
+    export OPENAI_API_KEY=stub
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+# OpenAI caches prompt prefixes from 1024 tokens on, by increments of 128
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT = 128
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+STUB_WORDS = (
+    "the quick brown fox jumps over the lazy dog while a stub server answers "
+    "every prompt with plausible filler text"
+).split()
+
+
+class LatencyDistribution:
+    """
+    A latency distribution in seconds, parsed from specs like "0.5",
+    "uniform:0.2,1.5", "normal:0.8,0.2", "lognormal:0.8,0.5" (median, sigma)
+    or "exponential:0.8" (mean). Samples are never negative.
+    """
+
+    def __init__(self, kind: str = "fixed", params: Sequence[float] = (0.0,)) -> None:
+        if kind not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency distribution should be one of {LATENCY_DISTRIBUTIONS}")
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}[kind]
+        if len(params) != expected:
+            raise ValueError(f"{kind} latency takes {expected} parameter(s), got {len(params)}")
+        self.kind = kind
+        self.params = tuple(params)
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, sep, params = spec.partition(":")
+        if not sep:
+            kind, params = "fixed", spec
+        try:
+            values = [float(p) for p in params.split(",")]
+        except ValueError:
+            raise ValueError(f"can't parse latency spec: {spec}")
+        return cls(kind.strip().lower(), values)
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = rng.gauss(p[0], p[1])
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(p[0]), p[1]) if p[0] > 0 else 0.0
+        else:
+            value = rng.expovariate(1 / p[0]) if p[0] > 0 else 0.0
+        return max(value, 0.0)
+
+    def __repr__(self) -> str:
+        return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+
+
+def count_tokens(text: str) -> int:
+    """rough token count, the ~4 characters per token rule of thumb"""
+    return max(math.ceil(len(text) / 4), 1) if text else 0
+
+
+class RateLimiter:
+    """
+    A token bucket allowing `rpm` requests per minute (with bursts up to
+    `burst`), plus a cap on concurrent in-flight requests. Zero disables
+    either limit.
+    """
+
+    def __init__(self, rpm: int = 0, max_concurrency: int = 0, burst: int = 0) -> None:
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.capacity = burst or max(rpm // 60, 1)
+        self.tokens = float(self.capacity)
+        self.in_flight = 0
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[float]:
+        """admit a request, or return how many seconds to wait before retrying"""
+        with self._lock:
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                return 1.0
+            if self.rpm:
+                now = time.monotonic()
+                rate = self.rpm / 60
+                self.tokens = min(self.capacity, self.tokens + (now - self._refilled_at) * rate)
+                self._refilled_at = now
+                if self.tokens < 1:
+                    return (1 - self.tokens) / rate
+                self.tokens -= 1
+            self.in_flight += 1
+            return None
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+
+class StubServer:
+    """
+    Serve fake completions from a background thread.
+
+    Args:
+        port (int): The port to listen on, 0 picks a free one.
+        latency (str): Latency spec for the time to first token, see `LatencyDistribution`.
+        token_latency (str): Latency spec added per completion token.
+        completion_tokens (int): How many tokens to generate, capped by the
+            request's max_tokens.
+        rpm (int): Requests per minute before answering 429, 0 for no limit.
+        max_concurrency (int): In-flight requests before answering 429, 0 for no limit.
+        error_rate (float): Probability of answering with an injected error.
+        error_codes (Sequence[int]): HTTP status codes to pick injected errors from.
+        response (str): A fixed response text, instead of generated filler.
+        seed (int): Seed for latencies, errors and filler text.
+        prefix_cache (int): How many recent prompts to remember, reporting the
+            prefix shared with one of them as cached tokens like OpenAI does
+            (from 1024 tokens on, by increments of 128). 0 disables it.
+    """
+
+    def __init__(
+        self,
+        port: int = 8089,
+        host: str = "127.0.0.1",
+        latency: str = "0",
+        token_latency: str = "0",
+        completion_tokens: int = 16,
+        rpm: int = 0,
+        max_concurrency: int = 0,
+        burst: int = 0,
+        error_rate: float = 0.0,
+        error_codes: Sequence[int] = (500, 502, 503),
+        response: Optional[str] = None,
+        seed: Optional[int] = None,
+        prefix_cache: int = 0,
+    ) -> None:
+        self.latency = LatencyDistribution.parse(latency)
+        self.token_latency = LatencyDistribution.parse(token_latency)
+        self.completion_tokens = completion_tokens
+        self.limiter = RateLimiter(rpm, max_concurrency, burst)
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.response = response
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "completed": 0,
+            "throttled": 0,
+            "errors": 0,
+            "cached_tokens": 0,
+        }
+        self.recent_prompts: Deque[str] = deque(maxlen=prefix_cache or None)
+        self.prefix_cache = prefix_cache
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps connections alive, to exercise client side pooling
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/v1/models":
+                    stub._send_json(self, 200, {"object": "list", "data": []})
+                else:
+                    stub._send_error(self, 404, "not_found", f"Unknown path {self.path}")
+
+            def do_POST(self):
+                stub.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def api_base(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _random(self, func, *args):
+        with self._lock:
+            return func(self._rng, *args)
+
+    def handle(self, handler: BaseHTTPRequestHandler) -> None:
+        self._count("requests")
+        length = int(handler.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(handler.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(handler, 400, "invalid_request_error", "Body isn't valid JSON")
+            return
+
+        path = handler.path.rstrip("/")
+        if path not in ("/v1/completions", "/v1/chat/completions"):
+            self._send_error(handler, 404, "not_found", f"Unknown path {handler.path}")
+            return
+
+        retry_after = self.limiter.acquire()
+        if retry_after is not None:
+            self._count("throttled")
+            self._send_error(
+                handler,
+                429,
+                "requests",
+                "Rate limit reached for requests",
+                code="rate_limit_exceeded",
+                headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+            )
+            return
+        try:
+            self._complete(handler, body, chat=path.endswith("/chat/completions"))
+        finally:
+            self.limiter.release()
+
+    def _complete(self, handler: BaseHTTPRequestHandler, body: dict, chat: bool) -> None:
+        if self.error_rate and self._random(random.Random.random) < self.error_rate:
+            status = self._random(random.Random.choice, self.error_codes)
+            time.sleep(self._random(self.latency.sample))
+            self._count("errors")
+            self._send_error(handler, status, "server_error", f"Injected error ({status})")
+            return
+
+        prompt = _prompt_text(body, chat)
+        words = self._completion_words(body)
+        usage = {
+            "prompt_tokens": count_tokens(prompt),
+            "completion_tokens": len(words),
+            "total_tokens": count_tokens(prompt) + len(words),
+        }
+        if self.prefix_cache:
+            usage["prompt_tokens_details"] = {"cached_tokens": self._cached_tokens(prompt)}
+        time.sleep(self._random(self.latency.sample))
+        if body.get("stream"):
+            self._stream(handler, body, chat, words)
+        else:
+            token_delay = sum(self._random(self.token_latency.sample) for _ in words)
+            time.sleep(token_delay)
+            text = " ".join(words)
+            choice: Dict[str, Any] = {"index": 0, "finish_reason": "stop", "logprobs": None}
+            if chat:
+                choice["message"] = {"role": "assistant", "content": text}
+            else:
+                choice["text"] = text
+            payload = _envelope(body, chat, [choice])
+            payload["usage"] = usage
+            self._send_json(handler, 200, payload)
+        self._count("completed")
+
+    def _cached_tokens(self, prompt: str) -> int:
+        with self._lock:
+            shared = max(
+                (len(os.path.commonprefix([prompt, p])) for p in self.recent_prompts), default=0
+            )
+            self.recent_prompts.append(prompt)
+            tokens = count_tokens(prompt[:shared])
+            cached = 0 if tokens < CACHE_MIN_TOKENS else tokens - tokens % CACHE_INCREMENT
+            self.stats["cached_tokens"] += cached
+        return cached
+
+    def _completion_words(self, body: dict) -> List[str]:
+        n = self.completion_tokens
+        if body.get("max_tokens"):
+            n = min(n, int(body["max_tokens"]))
+        if self.response is not None:
+            return self.response.split(" ")[: max(n, 1)] if self.response else []
+        offset = self._random(random.Random.randrange, len(STUB_WORDS))
+        return [STUB_WORDS[(offset + i) % len(STUB_WORDS)] for i in range(n)]
+
+    def _stream(self, handler: BaseHTTPRequestHandler, body: dict, chat: bool, words) -> None:
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        # no Content-Length when streaming, the end of the response is the end of the connection
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self._random(self.token_latency.sample))
+            text = word if i == 0 else " " + word
+            delta = {"content": text, **({"role": "assistant"} if i == 0 else {})}
+            choice = {"index": 0, "finish_reason": None, "logprobs": None}
+            choice.update({"delta": delta} if chat else {"text": text})
+            _write_event(handler, _envelope(body, chat, [choice], chunk=True))
+        last: Dict[str, Any] = {"index": 0, "finish_reason": "stop", "logprobs": None}
+        last.update({"delta": {}} if chat else {"text": ""})
+        _write_event(handler, _envelope(body, chat, [last], chunk=True))
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+
+    @staticmethod
+    def _send_json(
+        handler: BaseHTTPRequestHandler,
+        status: int,
+        payload: dict,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _send_error(
+        self,
+        handler: BaseHTTPRequestHandler,
+        status: int,
+        error_type: str,
+        message: str,
+        code: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        error = {"message": message, "type": error_type, "param": None, "code": code}
+        self._send_json(handler, status, {"error": error}, headers)
+
+
+def _prompt_text(body: dict, chat: bool) -> str:
+    if chat:
+        return "\n".join(str(m.get("content") or "") for m in body.get("messages") or [])
+    prompt = body.get("prompt") or ""
+    return "\n".join(prompt) if isinstance(prompt, list) else str(prompt)
+
+
+def _envelope(body: dict, chat: bool, choices: List[dict], chunk: bool = False) -> Dict[str, Any]:
+    kind = "chat.completion" if chat else "text_completion"
+    return {
+        "id": f"stub-{uuid.uuid4().hex[:12]}",
+        "object": kind + (".chunk" if chunk and chat else ""),
+        "created": int(time.time()),
+        "model": body.get("model") or "stub",
+        "choices": choices,
+    }
+
+
+def _write_event(handler: BaseHTTPRequestHandler, payload: dict) -> None:
+    handler.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+    handler.wfile.flush()
+
+
+def parse_error_codes(value: str) -> Tuple[int, ...]:
+    return tuple(int(code) for code in value.split(",") if code.strip())
@@ -3,12 +3,17 @@ This module provides a Suite class to manage and execute a collection of
 use cases (prompts) to be tested. It allows running the tests, displaying
 results, and serializing the summary of the suite.
 """
+import itertools
 import random
-from typing import Any, Dict, List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set, Union
 
 import click
 
-from promptimize import utils
+from promptimize import console, planning, profiling, review, sampling, utils
+from promptimize.coalescing import RequestCoalescer, is_shared
+from promptimize.hedging import Hedger, summarize as summarize_hedging
+from promptimize.token_caps import TokenCaps, summarize as summarize_token_caps
 from promptimize.prompt_cases import BasePromptCase
 
 
@@ -49,6 +54,9 @@ class Suite:
         self.prompts = {o.key: o for o in prompts}
         self.last_run_completion_create_kwargs: dict = {}
         self.effective_prompts = list(self.prompts.values())
+        self.sampling_summary: Optional[Dict[str, Any]] = None
+        self.scheduling_summary: Optional[Dict[str, Any]] = None
+        self.coalesced_calls = 0
 
     def execute(  # noqa
         self,
@@ -63,6 +71,18 @@ class Suite:
         human: bool = False,
         shuffle: bool = False,
         limit: int = 0,
+        display: str = "auto",
+        stream: Optional[bool] = None,
+        target_ci: float = 0,
+        confidence: float = 0.95,
+        workers: int = 0,
+        metrics=None,
+        coalesce: bool = True,
+        limiter=None,
+        order: str = "declared",
+        time_budget: float = 0,
+        hedge: float = 0,
+        adaptive_max_tokens: bool = False,
     ) -> None:
         """
         Execute the suite with the given settings.
@@ -71,57 +91,332 @@ class Suite:
             verbose (bool): If True, print verbose output. Defaults to False.
             style (str): Output style for serialization. Defaults to "yaml".
             silent (bool): If True, suppress output. Defaults to False.
+            display (str): "detailed" prints every prompt case, "progress" shows a
+                single live progress line, "auto" picks "progress" when the output
+                isn't a terminal or for large runs. Defaults to "auto".
+            human (bool): Queue the executed prompt cases for human review in the
+                report, see `promptimize review`. Defaults to False.
+            stream (Optional[bool]): Force streaming on or off for all prompt
+                cases, by default each prompt case's own setting is used.
+            target_ci (float): If set, sample prompt cases in stratified order and
+                stop once the suite score is known within +/- target_ci.
+            confidence (float): Confidence level used with target_ci.
+            workers (int): If set, run prompt cases concurrently using this many
+                threads for each model, every model getting its own pool.
+            metrics (RunMetrics): If set, gets updated continuously as the run progresses.
+            coalesce (bool): Make a single API call for prompt cases sending the
+                same prompt with the same executor settings, sharing the response
+                and its usage, counted once. Defaults to True.
+            limiter: A context manager entered around each API call, ie: to
+                share a rate budget in between runs, possibly from several threads.
+            order (str): "declared", "shuffle", "longest" for the longest expected
+                latency first, or "failing" for the most likely to fail first,
+                using the report's history, or "prefix" to run prompts sharing
+                a long prefix back to back. Ignored with target_ci.
+            time_budget (float): If set, in seconds, leave out the prompt cases
+                that are worth the least for their expected latency, so that
+                the run fits the budget.
+            hedge (float): If set, a percentile (ie: 95) of the API latencies seen
+                for a model: calls running for longer get a duplicate request,
+                the first one back winning. See `promptimize.hedging`.
+            adaptive_max_tokens (bool): Cap the max_tokens of each prompt case
+                from its own latest completion lengths, re-running the ones
+                reaching their cap with the global limit. See `promptimize.token_caps`.
         """
         self.reload_effective_prompts(
             report=report,
             keys=keys,
             repair=repair,
-            shuffle=shuffle,
+            shuffle=shuffle or order == "shuffle",
             limit=limit,
         )
         prompts = self.effective_prompts
 
-        for i, prompt in enumerate(prompts):
-            should_run = force or self.should_prompt_execute(prompt, report)
-            progress = f"({i+1}/{len(prompts)})"
-            if not silent:
+        estimator = None
+        self.sampling_summary = None
+        if target_ci:
+            prompts = self.effective_prompts = sampling.stratified_order(prompts)
+            estimator = sampling.WeightedScoreEstimator(len(prompts), confidence)
+            order = "declared"
+        to_run = self.prompts_to_run(prompts, report, force)
+        history = planning.History(report)
+        prompts, to_run = self._schedule(prompts, to_run, history, order, time_budget, workers)
+
+        display = console.resolve_display(display, len(prompts))
+        color = console.is_terminal()
+        progress_line = None
+        writer = None
+        if not silent:
+            writer = console.BackgroundWriter()
+            if display == "progress":
+                progress_line = console.ProgressLine(len(prompts))
+
+        if progress_line and not dry_run:
+            durations = [
+                (p.pool_key, history.estimate_duration_ms(p.key) or 0)
+                for p in prompts
+                if p.key in to_run
+            ]
+            progress_line.expected_ms = planning.estimate_wall_clock_ms(durations, workers)
+        coalescer = RequestCoalescer() if coalesce and not dry_run else None
+        hedger = None
+        if hedge and not dry_run:
+            hedger = Hedger(hedge)
+            hedger.seed((p.pool_key, history.duration_ms.get(p.key)) for p in prompts)
+        token_caps = None
+        if adaptive_max_tokens and not dry_run:
+            token_caps = TokenCaps(history)
+            token_caps.apply(
+                (
+                    p
+                    for p in prompts
+                    if p.key in to_run and not (p.stream if stream is None else stream)
+                ),
+                coalesce=coalescer is not None,
+            )
+        executed = self._execute_prompts(
+            prompts,
+            to_run,
+            dry_run,
+            stream,
+            workers,
+            metrics,
+            coalescer,
+            limiter,
+            hedger,
+            token_caps,
+        )
+        for i, (prompt, should_run) in enumerate(executed):
+            if metrics:
                 if should_run:
-                    separated_section(f"# {progress} [RUN] prompt: {prompt.key}", fg="cyan")
+                    metrics.case_completed(prompt)
                 else:
-                    separated_section(f"# {progress} [SKIP] prompt: {prompt.key}", fg="yellow")
-
-            if should_run:
-                prompt._run(dry_run)
-                if not dry_run:
-                    prompt.test()
+                    metrics.case_skipped(prompt)
+            if writer and not progress_line:
+                progress = f"({i+1}/{len(prompts)})"
+                if should_run:
+                    s, fg = f"# {progress} [RUN] prompt: {prompt.key}", "cyan"
+                else:
+                    s, fg = f"# {progress} [SKIP] prompt: {prompt.key}", "yellow"
+                writer.write(console.format_separated_section(s, fg, color))
 
-            if not silent and should_run:
-                prompt.print(verbose=verbose, style=style)
+            if progress_line:
+                progress_line.update(prompt, should_run)
+            elif writer and should_run:
+                # snapshot the data now, serialize and highlight on the writer thread
+                output = prompt.to_print_dict(verbose=verbose)
+                writer.write(lambda output=output: self._render_output(output, style, color))
 
             if should_run and human:
-                v = click.prompt(
-                    'Press Enter to continue, "Y" to force success, "N" to force fail, "X" to exit',
-                    default="",
-                    show_default=False,
-                )
-                v = v.lower()
-                if v == "":
-                    click.secho("Leaving result unaltered", fg="yellow")
-                elif v == "y":
-                    prompt.execution.score = 1
-                    prompt.execution.human_override = True
-                    click.secho("Forcing SUCCESS", fg="green")
-                elif v == "n":
-                    prompt.execution.score = 0
-                    prompt.execution.human_override = True
-                    click.secho("Forcing FAILURE", fg="red")
-                elif v == "x":
+                review.queue_for_review(prompt.execution)
+
+            if estimator:
+                score = self._known_score(prompt, report, should_run)
+                if score is not None:
+                    estimator.add(score, prompt.weight)
+                if estimator.has_reached(target_ci):
                     break
 
+        executed.close()
+        if token_caps:
+            token_caps.restore(prompts)
+        if estimator:
+            self.sampling_summary = estimator.to_dict()
+            self.sampling_summary["target_ci"] = target_ci
+            self.sampling_summary["target_reached"] = estimator.has_reached(target_ci)
+
+        if progress_line:
+            progress_line.finish()
+        if writer:
+            writer.close()
+
         # `self.last_run_completion_create_kwargs = completion_create_kwargs
         if not silent:
             separated_section("# Suite summary", fg="cyan")
-            click.echo(utils.serialize_object(self._serialize_run_summary(), style))
+            click.echo(utils.serialize_object(self._serialize_run_summary(), style, color))
+
+    @staticmethod
+    def _render_output(output, style, color) -> str:
+        with profiling.section("output"):
+            return utils.serialize_object(output, style, color) + "\n"
+
+    @staticmethod
+    def _run_prompt(
+        prompt,
+        dry_run: bool,
+        stream: Optional[bool],
+        metrics=None,
+        coalescer=None,
+        limiter=None,
+        hedger=None,
+        token_caps=None,
+    ):
+        if metrics:
+            metrics.case_started(prompt)
+        prompt._run(
+            dry_run,
+            stream=stream,
+            coalescer=coalescer,
+            limiter=limiter,
+            hedger=hedger,
+            token_caps=token_caps,
+        )
+        if not dry_run:
+            with profiling.section("evaluation"):
+                prompt.test()
+        return prompt
+
+    def _execute_prompts(
+        self,
+        prompts,
+        to_run,
+        dry_run,
+        stream,
+        workers,
+        metrics=None,
+        coalescer=None,
+        limiter=None,
+        hedger=None,
+        token_caps=None,
+    ):
+        """
+        Run the prompts that need to, yielding (prompt, has_run) tuples as they
+        complete. With workers, prompt cases are dispatched to a separate thread
+        pool per model, closing the generator cancels what hasn't started yet.
+        """
+        if coalescer is not None:
+            # streamed responses are measured and stop-checked per prompt case
+            self.coalesced_calls = coalescer.register(
+                p
+                for p in prompts
+                if p.key in to_run and not (p.stream if stream is None else stream)
+            )
+
+        if not workers:
+            for prompt in prompts:
+                should_run = prompt.key in to_run
+                if should_run:
+                    self._run_prompt(
+                        prompt, dry_run, stream, metrics, coalescer, limiter, hedger, token_caps
+                    )
+                yield prompt, should_run
+            return
+
+        pools: Dict[str, ThreadPoolExecutor] = {}
+        futures = []
+        try:
+            for prompt in prompts:
+                if prompt.key in to_run:
+                    pool_key = prompt.pool_key
+                    if pool_key not in pools:
+                        pools[pool_key] = ThreadPoolExecutor(
+                            max_workers=workers, thread_name_prefix=f"promptimize-{pool_key}"
+                        )
+                    futures.append(
+                        pools[pool_key].submit(
+                            self._run_prompt,
+                            prompt,
+                            dry_run,
+                            stream,
+                            metrics,
+                            coalescer,
+                            limiter,
+                            hedger,
+                            token_caps,
+                        )
+                    )
+                else:
+                    yield prompt, False
+            for future in as_completed(futures):
+                yield future.result(), True
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _known_score(prompt, report, has_run):
+        """the score of a prompt, from this run or from the report if it was skipped"""
+        if has_run:
+            return prompt.execution.get("score") if prompt.was_tested else None
+        # not `get_prompt`, the texts aren't needed
+        report_prompt = report.prompts.get(prompt.key) if report else None
+        if report_prompt and report_prompt.get("execution"):
+            return report_prompt.execution.get("score")
+        return None
+
+    def rescore(
+        self,
+        report,
+        keys: list = None,
+        workers: int = 4,
+        cache=None,
+        silent: bool = False,
+        style: str = "yaml",
+    ) -> Dict[str, int]:
+        """
+        Re-run the evaluators against the responses stored in a report,
+        without calling the API.
+
+        Responses are reattached by key when the prompt hash still matches,
+        prompts with a human override are left alone.
+
+        Args:
+            report (Report): The report holding the responses.
+            keys (list): Only rescore these keys.
+            workers (int): How many prompt cases to test concurrently.
+            cache (EvaluationCache): Memoizes evaluator results by prompt hash,
+                response hash and evaluator code fingerprint.
+            silent (bool): If True, suppress output. Defaults to False.
+            style (str): Output style for serialization. Defaults to "yaml".
+        """
+        self.reload_effective_prompts(keys=keys)
+        stats = {"rescored": 0, "missing": 0, "stale": 0, "human_override": 0}
+        to_rescore = []
+        for prompt in self.effective_prompts:
+            report_prompt = report.get_prompt(prompt.key)
+            if not report_prompt:
+                stats["missing"] += 1
+            elif (report_prompt.get("execution") or {}).get("human_override"):
+                stats["human_override"] += 1
+            elif prompt.attach_response(report_prompt):
+                to_rescore.append(prompt)
+            else:
+                stats["stale"] += 1
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for _ in executor.map(lambda p: p.test(cache=cache), to_rescore):
+                pass
+        stats["rescored"] = len(to_rescore)
+        if cache is not None:
+            stats["cache_hits"] = cache.hits
+            stats["cache_misses"] = cache.misses
+
+        if not silent:
+            color = console.is_terminal()
+            separated_section("# Rescore summary", fg="cyan")
+            summary = {**self._serialize_run_summary(), "rescore": stats}
+            click.echo(utils.serialize_object(summary, style, color))
+        return stats
+
+    def apply_executor_params(self, params: Dict[str, Any]) -> None:
+        """Configure the prompt cases using the default executor with the run's params"""
+        self.last_run_completion_create_kwargs = params
+        for prompt in self.prompts.values():
+            if prompt.uses_default_executor:
+                prompt.set_executor_params(params)
+
+    def expand_matrix(self, matrix: Dict[str, List[Any]]) -> None:
+        """
+        Replace each prompt case by one variant per combination of executor
+        params, ie: {"engine": ["a", "b"], "temperature": [0, 0.7]} makes 4
+        variants. Prompts are rendered and hashed once, and variants are keyed
+        by prompt key and params so that a single report holds the whole grid.
+        """
+        names = list(matrix)
+        combinations = [dict(zip(names, values)) for values in itertools.product(*matrix.values())]
+        variants = [p.make_variant(c) for p in self.prompts.values() for c in combinations]
+        self.prompts = {v.key: v for v in variants}
+        self.effective_prompts = list(self.prompts.values())
 
     def reload_effective_prompts(
         self,
@@ -133,7 +428,9 @@ class Suite:
     ):
         self.effective_prompts = list(self.prompts.values())
         if keys:
-            self.effective_prompts = [p for p in self.effective_prompts if p.key in keys]
+            self.effective_prompts = [
+                p for p in self.effective_prompts if p.key in keys or p.base_key in keys
+            ]
         if repair and report:
             failed_keys = report.failed_keys
             self.effective_prompts = [p for p in self.effective_prompts if p.key in failed_keys]
@@ -144,6 +441,56 @@ class Suite:
         if limit:
             self.effective_prompts = self.effective_prompts[:limit]
 
+    def _schedule(self, prompts, to_run, history, order, time_budget, workers):
+        self.scheduling_summary = None
+        if order not in ("longest", "failing", "prefix") and not time_budget:
+            return prompts, to_run
+        prompts, dropped = planning.schedule(prompts, to_run, history, order, time_budget, workers)
+        self.effective_prompts = prompts
+        if time_budget:
+            self.scheduling_summary = {"time_budget_s": time_budget, "left_out": len(dropped)}
+        return prompts, to_run - dropped
+
+    def prompts_to_run(self, prompts, report=None, force: bool = False) -> Set[str]:
+        """the keys of the prompts to execute, the others being up to date in the report"""
+        return {p.key for p in prompts if force or self.should_prompt_execute(p, report)}
+
+    def plan(
+        self,
+        report=None,
+        keys: list = None,
+        force: bool = False,
+        repair: bool = False,
+        limit: int = 0,
+        workers: int = 0,
+        stream: Optional[bool] = None,
+        coalesce: bool = True,
+        order: str = "declared",
+        time_budget: float = 0,
+    ) -> planning.RunPlan:
+        """
+        What `execute` would do with the same settings, without calling the
+        API: which prompt cases would run or skip, and their estimated tokens,
+        cost and duration. See `promptimize.planning`.
+        """
+        self.reload_effective_prompts(
+            report=report, keys=keys, repair=repair, limit=limit, shuffle=order == "shuffle"
+        )
+        prompts = self.effective_prompts
+        to_run = self.prompts_to_run(prompts, report, force)
+        history = planning.History(report)
+        scheduled, kept = self._schedule(prompts, to_run, history, order, time_budget, workers)
+        left_out = [p for p in prompts if p.key in to_run - kept]
+        return planning.plan_run(
+            scheduled + left_out,
+            kept,
+            history,
+            workers=workers,
+            coalesce=coalesce,
+            stream=stream,
+            left_out={p.key for p in left_out},
+        )
+
     def should_prompt_execute(self, prompt, report):
         if not report or not report.prompts:
             return True
@@ -181,6 +528,27 @@ class Suite:
             "suite_score": suite_score,
             "git_info": utils.get_git_info(),
         }
+        if self.sampling_summary:
+            d["sampling"] = self.sampling_summary
+        if self.scheduling_summary:
+            d["scheduling"] = self.scheduling_summary
+        # rescored responses bring along the figures of the run they came from
+        ran = [p for p in prompts if p.has_run and not p.from_report]
+        cached = sum(
+            (p.execution.get("openai") or {}).get("cached_prompt_tokens") or 0
+            for p in ran
+            if not is_shared(p.execution)
+        )
+        if cached:
+            d["cached_prompt_tokens"] = cached
+        if self.coalesced_calls:
+            d["coalesced_calls"] = self.coalesced_calls
+        hedging = summarize_hedging(ran)
+        if hedging:
+            d["hedging"] = hedging
+        token_caps = summarize_token_caps(ran)
+        if token_caps:
+            d["adaptive_max_tokens"] = token_caps
 
         return d
 
@@ -0,0 +1,152 @@
+"""
+Adaptive max_tokens, sized from each prompt case's own completion lengths.
+
+One global `max_tokens` gets sized for the longest completions, while most
+cases need far fewer tokens. A model going off the rails generates until
+that cap, and providers count max_tokens against tokens-per-minute rate
+limits before anything got generated. With adaptive caps, a case that ran
+before gets its max_tokens set to a percentile of its latest completion
+lengths (kept in the history index, see `promptimize.planning`) times a
+safety margin, never above the global limit.
+
+A completion reaching its cap may have been cut short: the case gets re-run
+right away with the global limit, the tokens of the first attempt being
+accounted for as wasted. Streamed cases keep the global limit, as their
+usage isn't reported. Coalesced cases share a call, so they share a cap too,
+the one of the longest completions in the group.
+"""
+import math
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional
+
+from box import Box
+
+from promptimize.coalescing import RequestCoalescer, is_shared
+
+PERCENTILE = 99
+MARGIN = 1.5
+# below that, the margin doesn't leave much room for a slightly longer completion
+MIN_CAP = 16
+
+
+class _Capped(NamedTuple):
+    cap: int
+    limit: int
+    executor: Any
+    executor_kwargs: dict
+
+
+class TokenCaps:
+    """
+    Args:
+        history (planning.History): Where the completion lengths come from.
+        percentile (float): Percentile of the case's completion lengths the cap is based on.
+        margin (float): Multiplier applied to that percentile.
+    """
+
+    def __init__(self, history, percentile: float = PERCENTILE, margin: float = MARGIN) -> None:
+        self.history = history
+        self.percentile = percentile
+        self.margin = margin
+        self._capped: Dict[str, _Capped] = {}
+        # how the call of each coalesce key went, for the cases waiting on it
+        self._outcomes: Dict[Hashable, Box] = {}
+
+    def cap_for(self, prompt_case) -> Optional[int]:
+        """the max_tokens this case gets, None if it has no history"""
+        tokens = self.history.completion_tokens_percentile(prompt_case.key, self.percentile)
+        if tokens is None:
+            return None
+        return max(int(math.ceil(tokens * self.margin)), MIN_CAP)
+
+    def apply(self, prompt_cases: Iterable, coalesce: bool = False) -> int:
+        """
+        cap the executors of these prompt cases when it's under their limit,
+        with one cap per group of cases making the same call if coalescing,
+        returns how many
+        """
+        groups: Dict[Hashable, List] = {}
+        for prompt_case in prompt_cases:
+            key = RequestCoalescer.make_key(prompt_case) if coalesce else prompt_case.key
+            groups.setdefault(key, []).append(prompt_case)
+        for group in groups.values():
+            caps = [self.cap_for(p) for p in group]
+            if None in caps:
+                # a case without history may need the global limit
+                continue
+            for prompt_case in group:
+                self._cap(prompt_case, max(caps))  # type: ignore
+        return len(self._capped)
+
+    def _cap(self, prompt_case, cap: int) -> None:
+        limit = getattr(prompt_case.prompt_executor, "max_tokens", None)
+        if not isinstance(limit, int) or 0 < limit <= cap:
+            return
+        capped = _Capped(
+            cap, limit, prompt_case.prompt_executor, prompt_case.prompt_executor_kwargs
+        )
+        try:
+            prompt_case.set_executor_params({"max_tokens": cap})
+        except ValueError:
+            # executors that can't be reconfigured keep their own limit
+            return
+        if getattr(prompt_case.prompt_executor, "max_tokens", None) == cap:
+            self._capped[prompt_case.key] = capped
+
+    @staticmethod
+    def _uncap(prompt_case, capped: _Capped) -> None:
+        prompt_case.prompt_executor = capped.executor
+        prompt_case.prompt_executor_kwargs = capped.executor_kwargs
+
+    def restore(self, prompt_cases: Iterable) -> None:
+        """put back the executors with the global limit, once done running"""
+        for prompt_case in prompt_cases:
+            capped = self._capped.get(prompt_case.key)
+            if capped is not None:
+                self._uncap(prompt_case, capped)
+
+    def execute(self, prompt_case, execute_prompt, prompt_str: str) -> str:
+        """execute the prompt with its cap, re-running with the global limit if it got reached"""
+        capped = self._capped.get(prompt_case.key)
+        if capped is None:
+            return execute_prompt(prompt_str)
+        outcome_key = RequestCoalescer.make_key(prompt_case)
+        response = execute_prompt(prompt_str)
+        token_cap = Box(cap=capped.cap, limit=capped.limit)
+        openai = prompt_case.execution.get("openai") or {}
+        if (openai.get("completion_tokens") or 0) >= capped.cap:
+            token_cap.rerun = True
+            token_cap.wasted_tokens = openai.get("total_tokens") or 0
+            token_cap.wasted_cost = openai.get("total_cost") or 0
+            self._uncap(prompt_case, capped)
+            response = execute_prompt(prompt_str)
+        prompt_case.execution.token_cap = token_cap
+        self._outcomes[outcome_key] = token_cap
+        return response
+
+    def record_shared(self, prompt_case) -> None:
+        """for a case that got the response of another's call, record how its cap went"""
+        outcome = self._outcomes.get(RequestCoalescer.make_key(prompt_case))
+        if prompt_case.key in self._capped and outcome is not None:
+            prompt_case.execution.token_cap = Box(outcome)
+
+
+def summarize(prompt_cases) -> Optional[dict]:
+    """
+    how many cases got capped and re-run, the max_tokens no longer reserved
+    and the waste, those last two once per call for coalesced cases
+    """
+    prompt_cases = [p for p in prompt_cases if p.has_run and p.execution.get("token_cap")]
+    if not prompt_cases:
+        return None
+    caps = [p.execution.token_cap for p in prompt_cases]
+    calls = [p.execution.token_cap for p in prompt_cases if not is_shared(p.execution)]
+    return {
+        "capped": len(caps),
+        "reruns": sum(1 for c in caps if c.get("rerun")),
+        # what rate limits and runaway generations no longer get to use
+        "max_tokens_saved": sum(
+            c.limit - c.cap for c in calls if c.limit > 0 and not c.get("rerun")
+        ),
+        "wasted_tokens": sum(c.get("wasted_tokens") or 0 for c in calls),
+        "wasted_cost": sum(c.get("wasted_cost") or 0 for c in calls),
+    }
@@ -1,14 +1,17 @@
+import dis
+import functools
+import inspect
 import json
-from typing import Any, Dict, List, Optional
+import os
+import re
+import sysconfig
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 import subprocess
 import hashlib
 from datetime import datetime
-import re
 import time
-from pygments import highlight
-from pygments.lexers import YamlLexer, JsonLexer
-from pygments.formatters import TerminalFormatter
-from tabulate import tabulate
+import types
 import yaml
 from yaml.representer import SafeRepresenter
 
@@ -72,12 +75,147 @@ yaml.add_representer(literal_str, represent_literal_str)
 yaml.add_representer(str, str_presenter)
 
 
-def extract_json_objects(text: str, get_first: bool = True) -> List[Dict[str, Any]]:
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _clean_dirty_json(text: str) -> str:
+    """
+    Rewrite some common "dirty JSON" as emitted by LLMs into valid JSON:
+    single-quoted strings, trailing commas and Python-style True/False/None.
+    """
+    out = []
+    i = 0
+    n = len(text)
+    while i < n:
+        char = text[i]
+        if char in "\"'":
+            # copy the string over, re-quoting it with double quotes
+            quote = char
+            out.append('"')
+            i += 1
+            while i < n and text[i] != quote:
+                if text[i] == "\\" and i + 1 < n:
+                    escaped = text[i + 1]
+                    out.append(escaped if escaped == "'" else "\\" + escaped)
+                    i += 2
+                    continue
+                out.append('\\"' if text[i] == '"' else text[i])
+                i += 1
+            out.append('"')
+            i += 1
+        elif char == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j >= n or text[j] not in "}]":
+                out.append(char)
+            i += 1
+        elif char.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_PYTHON_LITERALS.get(word, word))
+            i = j
+        else:
+            out.append(char)
+            i += 1
+    return "".join(out)
+
+
+def _loads_json_object(text: str, allow_dirty: bool) -> Optional[Dict[str, Any]]:
+    # RecursionError for deeply nested blocks, JSONDecodeError being a ValueError
+    try:
+        return json.loads(text)
+    except (ValueError, RecursionError):
+        if not allow_dirty:
+            return None
+    try:
+        # not strict, tolerating control characters like newlines within strings
+        return json.loads(_clean_dirty_json(text), strict=False)
+    except (ValueError, RecursionError):
+        return None
+
+
+# what the scanner stops at, everything else in between gets skipped over
+_JSON_SPAN_TOKEN = re.compile(r"[{}\"']")
+_STRING_TOKENS = {'"': re.compile(r'[\\"]'), "'": re.compile(r"[\\']")}
+
+
+def _opens_string(text: str, i: int, allow_dirty: bool) -> bool:
+    if text[i] == '"':
+        return True
+    if text[i] != "'" or not allow_dirty:
+        return False
+    # the last non-space character before the quote
+    j = i - 1
+    while j >= 0 and text[j].isspace():
+        j -= 1
+    return j >= 0 and text[j] in "{[,:"
+
+
+def _string_end(text: str, start: int) -> int:
+    """the index of the quote closing the string opened at `start`"""
+    quote = text[start]
+    i = start + 1
+    while True:
+        match = _STRING_TOKENS[quote].search(text, i)
+        if match is None:
+            return len(text)
+        if text[match.start()] == quote:
+            return match.start()
+        # skip over the escaped character
+        i = match.start() + 2
+
+
+def _iter_json_object_spans(text: str, allow_dirty: bool = True):
+    """
+    Yield the (start, end) spans of the outermost balanced curly-bracket
+    blocks in a single pass over the text, ignoring brackets inside quoted
+    strings. Blocks nested in a bracket that never closes are yielded at the end.
+
+    Single quotes only open a string in dirty mode, right after a `{`, `[`,
+    `,` or `:`, so that apostrophes in prose don't swallow the rest of the text.
+    """
+    stack: List[int] = []
+    pending: List[Tuple[int, int]] = []
+    match = _JSON_SPAN_TOKEN.search(text)
+    while match:
+        i = match.start()
+        char = text[i]
+        if char == "{":
+            stack.append(i)
+        elif char == "}" and stack:
+            start = stack.pop()
+            if not stack:
+                pending.clear()
+                yield start, i + 1
+            else:
+                # a candidate only if its enclosing bracket never closes
+                while pending and pending[-1][0] > start:
+                    pending.pop()
+                pending.append((start, i + 1))
+        elif stack and _opens_string(text, i, allow_dirty):
+            i = _string_end(text, i)
+        match = _JSON_SPAN_TOKEN.search(text, i + 1)
+
+    yield from pending
+
+
+def extract_json_objects(
+    text: str, get_first: bool = False, allow_dirty: bool = True
+) -> List[Dict[str, Any]]:
     """
     Extract JSON objects from a given string by looking for matching curly brackets.
 
+    The text is scanned once, keeping track of bracket nesting (to any depth)
+    and quoted strings, and only the outermost blocks are parsed.
+
     Args:
         text (str): The input string containing JSON objects.
+        get_first (bool): Stop scanning after the first valid JSON object.
+        allow_dirty (bool): Tolerate single-quoted strings, trailing commas
+            and Python-style literals when the block isn't valid JSON.
 
     Returns:
         List[Dict[str, Any]]: A list of JSON objects found in the input string.
@@ -92,16 +230,17 @@ def extract_json_objects(text: str, get_first: bool = True) -> List[Dict[str, An
 
     >>> extract_json_objects('{"a": 1, "b": 2} and {"c": 3, "d": 4}')
     [{'a': 1, 'b': 2}, {'c': 3, 'd': 4}]
+
+    >>> extract_json_objects("{'a': [1, 2,], 'b': True,}", get_first=True)
+    [{'a': [1, 2], 'b': True}]
     """
     json_objects = []
-    # man that regex is something... generated by GPT4...
-    regex = r"(\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\}))*\})"
-    for match in re.finditer(regex, text):
-        try:
-            json_object = json.loads(match.group())
+    for start, end in _iter_json_object_spans(text, allow_dirty):
+        json_object = _loads_json_object(text[start:end], allow_dirty)
+        if json_object is not None:
             json_objects.append(json_object)
-        except json.JSONDecodeError:
-            pass
+            if get_first:
+                break
     return json_objects
 
 
@@ -120,17 +259,27 @@ def short_hash(obj, length=8):
     return hex_hash[:length]
 
 
+def highlight(data, lexer_name):
+    """terminal-highlight some text, pygments is only imported when needed"""
+    from pygments import highlight as pygments_highlight
+    from pygments.formatters import TerminalFormatter
+    from pygments.lexers import get_lexer_by_name
+
+    return pygments_highlight(data, get_lexer_by_name(lexer_name), TerminalFormatter())
+
+
 def to_yaml(data, highlighted=True):
     data = yaml.dump(data, sort_keys=False)
     if highlighted:
-        data = highlight(data, YamlLexer(), TerminalFormatter())
+        data = highlight(data, "yaml")
     return data
 
 
 def to_json(data, highlighted=True):
     data = json.dumps(data, indent=2)
-    highlighted = highlight(data, JsonLexer(), TerminalFormatter())
-    return highlighted
+    if highlighted:
+        data = highlight(data, "json")
+    return data
 
 
 def serialize_object(data, style="yaml", highlighted=True):
@@ -163,21 +312,112 @@ def transform_strings(obj, transformation):
         return obj
 
 
-def get_git_info(sha_length: int = 12):
+def _find_git_dir(path: Path) -> Optional[Path]:
+    for folder in [path, *path.parents]:
+        git_path = folder / ".git"
+        if git_path.is_dir():
+            return git_path
+        if git_path.is_file():
+            # worktrees and submodules point to the actual git dir
+            content = git_path.read_text().strip()
+            if content.startswith("gitdir:"):
+                return (folder / content.partition(":")[2].strip()).resolve()
+    return None
+
+
+def _resolve_git_ref(git_dir: Path, ref: str) -> Optional[str]:
+    # worktrees keep their HEAD locally but share refs with the main git dir
+    common_dir = git_dir
+    if (git_dir / "commondir").is_file():
+        common_dir = (git_dir / (git_dir / "commondir").read_text().strip()).resolve()
+    for folder in (git_dir, common_dir):
+        ref_path = folder / ref
+        if ref_path.is_file():
+            return ref_path.read_text().strip()
+    packed_refs = common_dir / "packed-refs"
+    if packed_refs.is_file():
+        for line in packed_refs.read_text().splitlines():
+            parts = line.split(" ", 1)
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+    return None
+
+
+# the dirty state changes with any edit of the working tree, which leaves no
+# trace in `.git`: cached git info gets recomputed after a few seconds anyway
+GIT_INFO_TTL = 5.0
+_git_info_cache: Dict[Any, Tuple[float, Optional[Dict[str, Any]]]] = {}
+
+
+def _mtime_ns(path: Path) -> Optional[int]:
     try:
-        sha = subprocess.check_output(["git", "rev-parse", "HEAD"]).decode("utf-8").strip()
-        if sha_length:
-            sha = sha[:sha_length]
-        branch = (
-            subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"])
-            .decode("utf-8")
-            .strip()
-        )
-        dirty = subprocess.call(["git", "diff-index", "--quiet", "HEAD"]) != 0
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _git_state(git_dir: Path) -> Tuple[Any, ...]:
+    """what changes in the git dir when checking out, committing or staging"""
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+    except OSError:
+        head = None
+    files = ["index", "packed-refs"]
+    if head and head.startswith("ref:"):
+        files.append(head.partition(":")[2].strip())
+    return (str(git_dir), head) + tuple(_mtime_ns(git_dir / f) for f in files)
+
+
+def get_git_info(sha_length: int = 12) -> Optional[Dict[str, Any]]:
+    """
+    Get the sha, branch and dirty state of the git repo we're running from.
+
+    The sha and branch are read straight from the `.git` folder. The result
+    is cached until HEAD, the current ref or the index change, and for
+    `GIT_INFO_TTL` seconds at most, as long-lived processes keep running
+    across commits and edits.
+    """
+    git_dir = _find_git_dir(Path.cwd())
+    if not git_dir:
+        return None
+    key = (_git_state(git_dir), sha_length)
+    cached = _git_info_cache.get(key)
+    if cached is None or time.monotonic() - cached[0] > GIT_INFO_TTL:
+        _git_info_cache.clear()
+        cached = _git_info_cache[key] = (time.monotonic(), _read_git_info(git_dir, sha_length))
+    # callers get their own copy to mutate
+    return dict(cached[1]) if cached[1] is not None else None
 
-        return {"sha": sha, "branch": branch, "dirty": dirty}
-    except subprocess.CalledProcessError:
+
+def _read_git_info(git_dir: Path, sha_length: int) -> Optional[Dict[str, Any]]:
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if head.startswith("ref:"):
+            ref = head.partition(":")[2].strip()
+            branch = ref.split("refs/heads/", 1)[-1]
+            sha = _resolve_git_ref(git_dir, ref)
+        else:
+            branch, sha = "HEAD", head
+    except OSError:
+        return None
+    if not sha:
         return None
+    if sha_length:
+        sha = sha[:sha_length]
+
+    try:
+        dirty = (
+            subprocess.call(
+                ["git", "diff-index", "--quiet", "HEAD"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            != 0
+        )
+    except OSError:
+        dirty = None
+
+    return {"sha": sha, "branch": branch, "dirty": dirty}
 
 
 class MeasureDuration:
@@ -257,6 +497,18 @@ def insert_in_dict(
     return new_dict
 
 
+def cached_prompt_tokens(usage) -> Optional[int]:
+    """
+    How many prompt tokens the provider served from its prefix cache, as
+    reported in a usage payload (OpenAI's `prompt_tokens_details.cached_tokens`
+    or Anthropic's `cache_read_input_tokens`), None if it doesn't say.
+    """
+    details = usage.get("prompt_tokens_details") or {}
+    if details.get("cached_tokens") is not None:
+        return details["cached_tokens"]
+    return usage.get("cache_read_input_tokens")
+
+
 def current_iso_timestamp():
     now = datetime.utcnow()
     return now.isoformat()
@@ -275,7 +527,208 @@ def hashable_repr(obj):
         return str(obj)
 
 
+def _code_repr(code) -> str:
+    consts = [_code_repr(c) if isinstance(c, types.CodeType) else repr(c) for c in code.co_consts]
+    return repr((code.co_code, code.co_names, consts))
+
+
+_MEMORY_ADDRESS = re.compile(r" at 0x[0-9a-fA-F]+")
+
+
+def _code_names(code) -> List[str]:
+    """the global and attribute names used by some code and the code nested in it"""
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names += [n for n in _code_names(const) if n not in names]
+    return names
+
+
+@functools.lru_cache(maxsize=4096)
+def _global_names(code) -> Tuple[str, ...]:
+    """the names some code, and the code nested in it, loads as globals"""
+    names = [i.argval for i in dis.get_instructions(code) if i.opname == "LOAD_GLOBAL"]
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names += [n for n in _global_names(const) if n not in names]
+    return tuple(names)
+
+
+_LIBRARY_PATHS = tuple(
+    {
+        os.path.abspath(sysconfig.get_paths()[k])
+        for k in ("stdlib", "platstdlib", "purelib", "platlib")
+    }
+)
+
+
+def _is_library(func_globals) -> bool:
+    """whether a module is installed code, as opposed to the code of a project"""
+    if func_globals.get("__name__") == "__main__":
+        return False
+    path = func_globals.get("__file__")
+    return not path or os.path.abspath(path).startswith(_LIBRARY_PATHS)
+
+
+def _referenced_globals(code, func_globals):
+    """
+    the module globals some code uses: functions, values and the classes of
+    its own module, and the functions it reaches as module attributes. Only
+    functions are followed into installed libraries, whose state, like
+    caches, isn't part of what the code does.
+    """
+    names = _code_names(code)
+    library = _is_library(func_globals)
+    for name in _global_names(code):
+        if name not in func_globals:
+            continue
+        value = func_globals[name]
+        if library and not isinstance(value, (types.FunctionType, types.ModuleType)):
+            continue
+        if isinstance(value, types.ModuleType):
+            # helpers reached as module attributes, ie: `evals.any_word`
+            for attr in names:
+                helper = getattr(value, attr, None)
+                if isinstance(helper, types.FunctionType):
+                    yield helper
+        elif not isinstance(value, type) or value.__module__ == func_globals.get("__name__"):
+            yield value
+
+
+def _unwrap_member(member):
+    """the function behind a method, static or class method, or property"""
+    if isinstance(member, property):
+        return member.fget
+    return getattr(member, "__func__", member)
+
+
+def _function_of(func) -> Optional[types.FunctionType]:
+    func = getattr(func, "__func__", func)
+    if not isinstance(func, types.FunctionType):
+        # callable objects, through their __call__
+        func = getattr(type(func), "__call__", None)
+    return func if isinstance(func, types.FunctionType) else None
+
+
+def attribute_fingerprint(
+    cls, func, names: Tuple[str, ...] = (), memo: Optional[Dict] = None
+) -> str:
+    """
+    A hash of the methods and properties of `cls` a function gets to, by
+    attribute name, directly or through the global functions and methods it
+    calls. For functions receiving an instance, like evaluators a prompt case.
+    Methods reached under other names than their own aren't accounted for.
+    `memo` shares the work between functions of the same code and module, as
+    long as that code doesn't change.
+    """
+    function = _function_of(func)
+    if function is None:
+        return short_hash(repr([]), 16)
+    if memo is not None:
+        key = (cls, function.__code__, id(function.__globals__), names)
+        if key not in memo:
+            # holding on to the globals, so that their id doesn't get reused
+            memo[key] = (function.__globals__, attribute_fingerprint(cls, function, names))
+        return memo[key][1]
+    members: Dict[str, str] = {}
+    checked: set = set()
+    seen: set = set()
+    functions = [function]
+    pending = set(names)
+    while functions or pending:
+        reached = []
+        for f in functions:
+            if id(f) not in seen:
+                seen.add(id(f))
+                pending.update(_code_names(f.__code__))
+                reached += [
+                    g
+                    for g in _referenced_globals(f.__code__, f.__globals__)
+                    if isinstance(g, types.FunctionType)
+                ]
+        for name in pending - checked:
+            checked.add(name)
+            member = _unwrap_member(inspect.getattr_static(cls, name, None))
+            if isinstance(member, types.FunctionType):
+                members[name] = code_fingerprint(member)
+                reached.append(member)
+        functions, pending = reached, set()
+    return short_hash(repr(sorted(members.items())), 16)
+
+
+def code_fingerprint(func, _seen=None, memo: Optional[Dict] = None) -> str:
+    """
+    A hash of what a function does: its bytecode, constants, defaults, closure
+    values, and the global values, classes of its own module and functions it
+    references, directly or as module attributes. Unlike
+    `hashable_repr`, two lambdas that only differ by their constants get
+    different fingerprints. `memo` shares the globals' part between functions
+    of the same code and module, as long as that code doesn't change.
+    """
+    _seen = _seen if _seen is not None else set()
+    func = getattr(func, "__func__", func)
+    code = getattr(func, "__code__", None)
+    if code is None:
+        # callable objects, fingerprinted through their __call__ and state
+        call = getattr(type(func), "__call__", None)
+        state = getattr(func, "__dict__", {})
+        inner = code_fingerprint(call, _seen) if hasattr(call, "__code__") else ""
+        return short_hash(inner + _value_repr(state, _seen), 16)
+    if id(func) in _seen:
+        return ""
+    _seen.add(id(func))
+
+    closure = []
+    for cell in func.__closure__ or []:
+        try:
+            closure.append(_value_repr(cell.cell_contents, _seen))
+        except ValueError:  # empty cell
+            closure.append("")
+    func_globals = getattr(func, "__globals__", {})
+    if memo is None:
+        referenced = [_value_repr(v, _seen) for v in _referenced_globals(code, func_globals)]
+    else:
+        key = (code, id(func_globals))
+        if key not in memo:
+            globals_seen: set = set()
+            memo[key] = (
+                func_globals,
+                [_value_repr(v, globals_seen) for v in _referenced_globals(code, func_globals)],
+            )
+        referenced = memo[key][1]
+    parts = [_code_repr(code), _value_repr(func.__defaults__, _seen), closure, referenced]
+    return short_hash(repr(parts), 16)
+
+
+def _value_repr(value, seen) -> str:
+    if isinstance(value, (types.FunctionType, types.MethodType)):
+        return code_fingerprint(value, seen)
+    if isinstance(value, (list, tuple)):
+        return repr([_value_repr(v, seen) for v in value])
+    if isinstance(value, dict):
+        return repr({k: _value_repr(v, seen) for k, v in value.items()})
+    if isinstance(value, types.ModuleType):
+        return value.__name__
+    if isinstance(value, type):
+        name = f"{value.__module__}.{value.__qualname__}"
+        if id(value) in seen:
+            return name
+        seen.add(id(value))
+        members = {k: _unwrap_member(v) for k, v in vars(value).items()}
+        return name + _value_repr(members, seen)
+    if type(value).__repr__ is object.__repr__:
+        # the default repr holds a memory address, changing from one process to the next
+        name = f"{type(value).__module__}.{type(value).__qualname__}"
+        if id(value) in seen or not hasattr(value, "__dict__"):
+            return name
+        seen.add(id(value))
+        return name + _value_repr(vars(value), seen)
+    return _MEMORY_ADDRESS.sub("", repr(value))
+
+
 def trabulate(df, showindex=True, headers="keys"):
+    from tabulate import tabulate
+
     headers = headers if headers else []
     for column in df.columns:
         if df[column].dtype == "int64":
@@ -0,0 +1,135 @@
+"""
+Watch mode: a warm process re-running prompt cases as their modules change.
+
+Discovery, heavy imports and report parsing happen once. After that, the
+suite's modules get polled for changes; changed modules (and the watched
+modules referencing them) are reloaded through importlib, and only their
+prompt cases whose `prompt_hash` changed get executed. The others get their
+stored response rescored, evaluators being cheap and possibly edited. The
+in-memory report is updated and written back after each round.
+"""
+import importlib
+import time
+import traceback
+from types import ModuleType
+from typing import Any, Dict, List, Optional
+
+import click
+
+from promptimize import crawler, planning
+from promptimize.prompt_cases import BasePromptCase
+from promptimize.reports import Report
+from promptimize.suite import Suite
+
+
+class Watcher:
+    """
+    Args:
+        path (str): The file or folder holding the suite's modules.
+        report_path (str): The report kept up to date, loaded once.
+        executor_params (dict): Executor params applied to the prompt cases
+            using the default executor, as with `promptimize run`.
+        execute_kwargs (dict): Passed to `Suite.execute`.
+        interval (float): Seconds in between two polls of the modules.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        report_path: str,
+        executor_params: Optional[Dict[str, Any]] = None,
+        execute_kwargs: Optional[Dict[str, Any]] = None,
+        interval: float = 0.5,
+        style: str = "yaml",
+    ) -> None:
+        self.path = path
+        self.report_path = report_path
+        self.executor_params = executor_params or {}
+        self.execute_kwargs = execute_kwargs or {}
+        self.interval = interval
+        self.style = style
+        self.report = Report.from_path(report_path) or Report(report_path)
+        self.modules: Dict[str, ModuleType] = {}
+        self.mtimes: Dict[str, Optional[int]] = {}
+
+    def _track(self, modules: List[ModuleType]) -> List[ModuleType]:
+        new = [m for m in modules if m.__name__ not in self.modules]
+        for module in modules:
+            self.modules[module.__name__] = module
+            self.mtimes.setdefault(module.__name__, crawler.module_mtime(module))
+        return new
+
+    def changed_modules(self) -> List[ModuleType]:
+        """reload the modules that changed since the last poll, and their dependents"""
+        changed = []
+        for name, module in self.modules.items():
+            mtime = crawler.module_mtime(module)
+            if mtime != self.mtimes[name]:
+                self.mtimes[name] = mtime
+                changed.append(module)
+        if changed:
+            names = {m.__name__ for m in changed}
+            changed += [
+                m
+                for m in self.modules.values()
+                if m.__name__ not in names and crawler.module_references(m, names)
+            ]
+        reloaded = []
+        for module in changed:
+            try:
+                reloaded.append(importlib.reload(module))
+            except Exception:
+                click.secho(f"# Failed reloading {module.__name__}", fg="red")
+                click.secho(traceback.format_exc(), fg="red")
+        return reloaded
+
+    def new_modules(self) -> List[ModuleType]:
+        """modules added to the watched folder since the last poll"""
+        try:
+            return self._track(crawler.discover_modules(self.path))
+        except Exception:
+            click.secho(traceback.format_exc(), fg="red")
+            return []
+
+    def run_modules(self, modules: List[ModuleType]) -> None:
+        """execute the prompt cases of these modules that aren't up to date in the report"""
+        prompts = []
+        for module in modules:
+            prompts += crawler.objects_in_module(module, BasePromptCase)
+        if not prompts:
+            return
+        suite = Suite(prompts)
+        suite.apply_executor_params(self.executor_params)
+        suite.execute(report=self.report, **self.execute_kwargs)
+        skipped = [p.key for p in suite.prompts.values() if not p.has_run]
+        if skipped and self.report.prompts:
+            stats = suite.rescore(self.report, keys=skipped, silent=True)
+            click.secho(f"# Rescored {stats['rescored']} stored responses", fg="yellow")
+        if any(p.has_run or p.was_tested for p in suite.prompts.values()):
+            output_report = Report.from_suite(suite)
+            output_report.merge(self.report)
+            self.report = output_report
+            output_report.write(self.report_path, style=self.style)
+            planning.update_history_index(self.report_path, suite)
+            click.secho(f"# Updated {self.report_path}", fg="yellow")
+
+    def poll(self) -> None:
+        modules = self.changed_modules() + self.new_modules()
+        if modules:
+            names = ", ".join(m.__name__ for m in modules)
+            click.secho(f"# Changes in {names}", fg="cyan")
+            try:
+                self.run_modules(modules)
+            except Exception:
+                # keep watching, the next edit may well fix it
+                click.secho(traceback.format_exc(), fg="red")
+
+    def watch(self) -> None:
+        self.run_modules(self._track(crawler.discover_modules(self.path)))
+        click.secho(f"# Watching {self.path}, Ctrl+C to stop", fg="cyan")
+        try:
+            while True:
+                time.sleep(self.interval)
+                self.poll()
+        except KeyboardInterrupt:
+            pass
@@ -14,6 +14,7 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     install_requires=requirements,
+    extras_require={"parquet": ["pyarrow"], "tokens": ["tiktoken"]},
     entry_points={
         "console_scripts": [
             "promptimize=promptimize:cli",
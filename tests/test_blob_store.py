@@ -0,0 +1,60 @@
+import os
+import random
+
+from click.testing import CliRunner
+
+from promptimize.cli import cli
+from promptimize.reports import Report
+
+
+def write_report(path, keys):
+    rng = random.Random(0)
+    texts = {k: "".join(rng.choice("abcdefgh ") for _ in range(4096)) for k in "abcdefgh"}
+    prompts = {
+        key: {"key": key, "prompt": texts[key], "response": key, "execution": {"score": 1}}
+        for key in keys
+    }
+    Report(data={"name": "report", "prompts": prompts}).write(str(path), storage="blobs")
+    return texts
+
+
+def read_prompts(path):
+    report = Report.from_path(str(path))
+    return {k: report._resolve_texts(p.to_dict())["prompt"] for k, p in report.prompts.items()}
+
+
+def test_write_compacts_the_pack(tmp_path):
+    path = tmp_path / "report.yaml"
+    texts = write_report(path, "abcdefgh")
+    size = os.path.getsize(f"{path}.blobs")
+
+    # a few dropped prompts stay in the pack
+    write_report(path, "abcdef")
+    assert os.path.getsize(f"{path}.blobs") == size
+
+    # until they take more than half of it
+    write_report(path, "abc")
+    assert os.path.getsize(f"{path}.blobs") < size / 2
+    assert read_prompts(path) == {k: texts[k] for k in "abc"}
+
+
+def test_gc(tmp_path):
+    path = tmp_path / "report.yaml"
+    texts = write_report(path, "abcdefgh")
+    write_report(path, "abcdef")
+    size = os.path.getsize(f"{path}.blobs")
+
+    result = CliRunner().invoke(cli, ["blobs", "gc", str(path)])
+    assert result.exit_code == 0
+    assert os.path.getsize(f"{path}.blobs") < size
+    assert f"Reclaimed {size - os.path.getsize(f'{path}.blobs')} bytes" in result.output
+    assert read_prompts(path) == {k: texts[k] for k in "abcdef"}
+
+
+def test_gc_inline_report(tmp_path):
+    path = tmp_path / "report.yaml"
+    Report(data={"name": "report", "prompts": {}}).write(str(path))
+
+    result = CliRunner().invoke(cli, ["blobs", "gc", str(path)])
+    assert result.exit_code == 2
+    assert "doesn't store its texts as blobs" in result.output
@@ -0,0 +1,40 @@
+from promptimize.reports import Report
+
+
+def matrix_report_data():
+    prompts = {}
+    for engine, temperature, score in (("ada", 0, 1), ("ada", 0.5, 0), ("davinci", 0, 1)):
+        key = f"hello[engine={engine},temperature={temperature}]"
+        prompts[key] = {
+            "key": key,
+            "variant": {"engine": engine, "temperature": temperature},
+            "user_input": "hello",
+            "prompt_hash": "abc",
+            "category": "greetings",
+            "weight": 1,
+            "execution": {"score": score, "run_at": "2023-06-01T00:00:00"},
+        }
+    return {"name": "matrix", "prompts": prompts}
+
+
+def test_parquet_groups_by_variant_like_yaml(tmp_path):
+    report = Report(data=matrix_report_data())
+    report.write(str(tmp_path / "m.yaml"))
+    report.write(str(tmp_path / "m.parquet"))
+
+    yaml_df = Report.from_path(str(tmp_path / "m.yaml")).score_df("variant.engine")
+    parquet_df = Report.from_path(str(tmp_path / "m.parquet")).score_df("variant.engine")
+
+    assert parquet_df.values.tolist() == yaml_df.values.tolist()
+    assert sorted(set(parquet_df["variant.engine"])) == ["ada", "davinci"]
+
+
+def test_parquet_round_trips_variant_and_user_input(tmp_path):
+    Report(data=matrix_report_data()).write(str(tmp_path / "m.parquet"))
+
+    prompt = Report.from_path(str(tmp_path / "m.parquet")).prompts[
+        "hello[engine=ada,temperature=0.5]"
+    ]
+
+    assert prompt.variant == {"engine": "ada", "temperature": 0.5}
+    assert prompt.user_input == "hello"
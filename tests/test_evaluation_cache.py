@@ -0,0 +1,107 @@
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pytest
+
+from promptimize.evaluation_cache import EvaluationCache
+
+SUITE = """
+from promptimize.prompt_cases import PromptCase
+
+WORDS = {words}
+
+
+def helper(response):
+    return {helper}
+
+
+class Case(PromptCase):
+    def matches(self):
+        return {method}
+
+
+def uses_helper(prompt_case):
+    return helper(prompt_case.response)
+
+
+def uses_words(prompt_case):
+    return float(any(w in prompt_case.response for w in WORDS))
+
+
+def uses_method(prompt_case):
+    return prompt_case.matches()
+
+
+prompt_case = Case("hello", key="hello")
+"""
+
+DEFAULTS = {"words": '["hello"]', "helper": "1.0", "method": "1.0"}
+
+
+def load_suite(tmp_path, name="suite", **changes):
+    path = tmp_path / f"{name}.py"
+    path.write_text(SUITE.format(**{**DEFAULTS, **changes}))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fingerprints(module):
+    cache = EvaluationCache()
+    return {
+        name: cache.fingerprint(module.prompt_case, getattr(module, name))
+        for name in ("uses_helper", "uses_words", "uses_method")
+    }
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+
+@pytest.mark.parametrize(
+    "change, evaluator",
+    [
+        ({"helper": "0.5"}, "uses_helper"),
+        ({"words": '["world"]'}, "uses_words"),
+        ({"method": "0.5"}, "uses_method"),
+    ],
+)
+def test_fingerprint_covers_what_evaluators_reach(tmp_path, change, evaluator):
+    before = fingerprints(load_suite(tmp_path))
+    after = fingerprints(load_suite(tmp_path, name="edited", **change))
+
+    assert {k for k in before if before[k] != after[k]} == {evaluator}
+
+
+def test_fingerprint_is_stable_across_processes(tmp_path):
+    load_suite(tmp_path)
+    script = (
+        "import sys; sys.path.insert(0, sys.argv[1]); import suite;"
+        "from promptimize.evaluation_cache import EvaluationCache;"
+        "print(EvaluationCache().fingerprint(suite.prompt_case, suite.uses_method))"
+    )
+    outputs = {
+        subprocess.run(
+            [sys.executable, "-c", script, str(tmp_path)],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "OPENAI_API_KEY": "test"},
+        ).stdout
+        for _ in range(2)
+    }
+    assert len(outputs) == 1
+
+
+def test_fingerprint_tells_apart_lambdas_of_the_same_code(tmp_path):
+    module = load_suite(tmp_path)
+    cache = EvaluationCache()
+    evaluators = [lambda prompt_case, w=w: module.helper(w) for w in ("a", "b", "a")]
+    first, second, third = (cache.fingerprint(module.prompt_case, e) for e in evaluators)
+
+    assert first != second
+    assert first == third
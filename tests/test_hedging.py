@@ -0,0 +1,66 @@
+import threading
+import time
+
+from box import Box
+
+from promptimize import hedging
+
+
+class SlowCase:
+    key = "slow"
+    pool_key = "model"
+
+    def __init__(self):
+        self.execution = Box()
+        self.response = None
+
+    def execute_prompt(self, prompt_str):
+        time.sleep(0.2)
+        return "done"
+
+
+def test_cancelled_hedge_queued_before_the_winner(monkeypatch):
+    cancelled_queued = threading.Event()
+
+    class Finished:
+        def __init__(self, queue):
+            self.queue = queue
+
+        def put(self, attempt):
+            self.queue.put(attempt)
+            if attempt.status == "cancelled":
+                cancelled_queued.set()
+
+        def get(self, timeout=None):
+            return self.queue.get(timeout=timeout)
+
+    class Race(hedging._Race):
+        def __init__(self):
+            super().__init__()
+            self.finished = Finished(self.finished)
+
+    class Limiter:
+        """lets the hedge attempt through and queue itself before the primary does"""
+
+        def __init__(self):
+            self.semaphore = threading.Semaphore(1)
+
+        def __enter__(self):
+            self.semaphore.acquire()
+
+        def __exit__(self, *exc_info):
+            self.semaphore.release()
+            if hedging.PRIMARY in threading.current_thread().name:
+                assert cancelled_queued.wait(5)
+
+    monkeypatch.setattr(hedging, "_Race", Race)
+    hedger = hedging.Hedger(min_samples=1)
+    hedger.seed([("model", 10)] * 5)
+    prompt_case = SlowCase()
+
+    assert hedger.execute(prompt_case, "prompt", limiter=Limiter()) == "done"
+    assert cancelled_queued.is_set()
+    assert prompt_case.response == "done"
+    hedge = prompt_case.execution.hedge
+    assert hedge.winner == hedging.PRIMARY
+    assert [a["status"] for a in hedge.attempts] == ["won", "cancelled"]
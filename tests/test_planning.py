@@ -0,0 +1,45 @@
+from box import Box
+
+from promptimize.planning import History, HistoryIndex, schedule
+from promptimize.prompt_cases import PromptCase
+
+
+def test_rescored_cases_are_not_recorded_as_runs(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    prompt_case = PromptCase("hello", lambda response: 1, key="hello")
+    report_prompt = Box(
+        prompt_hash=prompt_case.prompt_hash,
+        response="world",
+        execution={"openai": {"completion_tokens": 16}, "api_call_duration_ms": 100},
+    )
+    index = HistoryIndex()
+    index.keys["hello"] = [1, 0, 100, [16]]
+
+    assert prompt_case.attach_response(report_prompt)
+    prompt_case.test()
+    index.record_suite(Box(prompts={"hello": prompt_case}))
+
+    assert index.entry("hello") == [1, 0, 100, [16]]
+
+
+def test_time_budget_holds_for_each_pool():
+    history = History()
+    prompts = [
+        Box(key=f"{model}-{i}", pool_key=model, weight=1)
+        for model in ("gpt-3.5-turbo", "gpt-4")
+        for i in range(4)
+    ]
+    history.duration_ms = {p.key: 1000 for p in prompts}
+    keys = {p.key for p in prompts}
+
+    # pools run side by side, 2 workers fit 4 cases of a second in 2 seconds each
+    _, dropped = schedule(prompts, keys, history, time_budget=2, workers=2)
+    assert not dropped
+
+    _, dropped = schedule(prompts, keys, history, time_budget=1, workers=2)
+    assert {p.pool_key for p in prompts if p.key in dropped} == {"gpt-3.5-turbo", "gpt-4"}
+    assert len(dropped) == 4
+
+    # sequentially, a single budget for all
+    _, dropped = schedule(prompts, keys, history, time_budget=4)
+    assert len(dropped) == 4
@@ -0,0 +1,44 @@
+import pytest
+from click.testing import CliRunner
+
+from promptimize.cli import cli
+from promptimize.report_diff import diff_reports, iter_report_prompts
+from promptimize.reports import Report
+
+
+def write_report(path, scores):
+    prompts = {
+        key: {
+            "key": key,
+            "prompt_hash": key,
+            "category": "math",
+            "weight": 1,
+            "execution": {"score": score, "openai": {"total_tokens": 10}},
+        }
+        for key, score in scores.items()
+    }
+    Report(data={"name": "report", "prompts": prompts}).write(str(path))
+    return str(path)
+
+
+@pytest.mark.parametrize("suffix", ["yaml", "parquet"])
+def test_diff_yaml_and_parquet(tmp_path, suffix):
+    old = write_report(tmp_path / "old.yaml", {"a": 1, "b": 1, "c": 0})
+    new = write_report(tmp_path / f"new.{suffix}", {"a": 1, "b": 0, "d": 1})
+
+    assert [key for key, _ in iter_report_prompts(new)] == ["a", "b", "d"]
+    diff = diff_reports(old, new)
+    assert diff.keys["regressed"] == ["b"]
+    assert diff.keys["new"] == ["d"]
+    assert diff.keys["removed"] == ["c"]
+    assert diff.category_rows()[0]["new_tokens"] == 30
+
+
+def test_diff_unreadable_report(tmp_path):
+    old = write_report(tmp_path / "old.yaml", {"a": 1})
+    garbage = tmp_path / "new.yaml"
+    garbage.write_bytes(b"\xff\xfe\x00garbage")
+
+    result = CliRunner().invoke(cli, ["diff", old, str(garbage)])
+    assert result.exit_code == 2
+    assert "can't read the reports" in result.output
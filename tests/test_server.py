@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from promptimize.server import EvaluationServer
+from promptimize.stub_server import StubServer
+
+SUITE = """
+from promptimize.prompt_cases import PromptCase
+
+prompts = [PromptCase("{name}", lambda response: 1, key="{name}")]
+"""
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = StubServer(port=0, latency="0.3").start()
+    monkeypatch.setenv("OPENAI_API_BASE", stub.api_base)
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    yield stub
+    stub.stop()
+
+
+def wait(*jobs):
+    deadline = time.time() + 10
+    while not all(job.finished for job in jobs) and time.time() < deadline:
+        time.sleep(0.02)
+    assert all(job.status == "done" for job in jobs), [job.error for job in jobs]
+
+
+def test_jobs_on_the_same_suite_run_concurrently(stub, tmp_path):
+    (tmp_path / "cases.py").write_text(SUITE.format(name="same"))
+    output = str(tmp_path / "report.yaml")
+    server = EvaluationServer(port=0)
+    jobs = [server.submit({"path": str(tmp_path), "output": output}) for _ in range(2)]
+    wait(*jobs)
+
+    first, second = sorted(jobs, key=lambda job: job.started_at)
+    assert second.started_at < first.finished_at
+    assert list(server._load_report(output).prompts) == ["same"]
+
+
+def test_suites_with_modules_of_the_same_name(stub, tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "cases.py").write_text(SUITE.format(name=name))
+    server = EvaluationServer(port=0)
+    for name in ("a", "b"):
+        job = server.submit({"path": str(tmp_path / name)})
+        wait(job)
+        assert list(job.report.prompts) == [name]
@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+import pytest
+
+from promptimize.cli import cli
+
+# heavy dependencies, only for the subcommands that actually use them
+HEAVY_PACKAGES = {"langchain", "openai", "pandas", "pyarrow"}
+
+
+def imported_packages(args):
+    """the top level packages imported while running the CLI, off -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "promptimize", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            module = line.rsplit("|", 1)[1].strip()
+            packages.add(module.split(".")[0])
+    return packages
+
+
+@pytest.mark.parametrize("command", [None, *sorted(cli.commands)])
+def test_help_skips_heavy_imports(command):
+    packages = imported_packages([command, "--help"] if command else ["--help"])
+    assert "promptimize" in packages
+    assert not packages & HEAVY_PACKAGES
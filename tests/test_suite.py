@@ -0,0 +1,31 @@
+from promptimize.prompt_cases import PromptCase
+from promptimize.reports import Report
+from promptimize.suite import Suite
+
+
+def test_rescore_summary_leaves_out_figures_of_the_stored_run(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    prompt_case = PromptCase("hello", lambda response: 1, key="hello")
+    execution = {
+        "openai": {"total_cost": 0.01, "cached_prompt_tokens": 8},
+        "hedge": {"winner": "hedge", "extra_requests": 1, "extra_cost": 0.01},
+        "token_cap": {"cap": 16, "limit": 256},
+    }
+    report = Report(
+        data={
+            "prompts": {
+                "hello": {
+                    "key": "hello",
+                    "prompt_hash": prompt_case.prompt_hash,
+                    "response": "world",
+                    "execution": execution,
+                }
+            }
+        }
+    )
+    suite = Suite([prompt_case])
+
+    assert suite.rescore(report, silent=True)["rescored"] == 1
+    summary = suite._serialize_run_summary()
+    assert summary["suite_score"] == 1
+    assert not {"hedging", "adaptive_max_tokens", "cached_prompt_tokens"} & set(summary)
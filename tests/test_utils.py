@@ -0,0 +1,25 @@
+import pytest
+
+from promptimize.utils import extract_json_objects
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('Some text: {"key1": "value1"} and more.', [{"key1": "value1"}]),
+        ('{"a": 1} and {"b": {"c": 2}}', [{"a": 1}, {"b": {"c": 2}}]),
+        ("{'a': True, 'b': [None, 1,],}", [{"a": True, "b": [None, 1]}]),
+        ("It's {'a': \"don't\"}", [{"a": "don't"}]),
+        (
+            '{"python_function": "def f(x):\n    return x*2"}',
+            [{"python_function": "def f(x):\n    return x*2"}],
+        ),
+        ("{" * 5000, []),
+    ],
+)
+def test_extract_json_objects(text, expected):
+    assert extract_json_objects(text) == expected
+
+
+def test_extract_json_objects_strict():
+    assert extract_json_objects('{"a": "x\ny"}', allow_dirty=False) == []